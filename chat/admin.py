@@ -13,15 +13,15 @@ class MessageInline(admin.TabularInline):
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
     """Admin pour les conversations."""
-    list_display = ['id', 'user', 'title', 'message_count', 'created_at', 'updated_at']
-    list_filter = ['created_at', 'updated_at']
+    list_display = ['id', 'user', 'title', 'message_count', 'created_at', 'updated_at', 'archived_at']
+    list_filter = ['created_at', 'updated_at', 'archived_at']
     search_fields = ['title', 'user__username', 'user__email']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = [
+        'created_at', 'updated_at',
+        'message_count', 'last_message_at', 'last_message_role', 'last_message_preview',
+        'archived_at',
+    ]
     inlines = [MessageInline]
-    
-    def message_count(self, obj):
-        return obj.messages.count()
-    message_count.short_description = 'Messages'
 
 
 @admin.register(Message)
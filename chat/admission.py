@@ -0,0 +1,276 @@
+"""
+Contrôle d'admission des générations : file bornée avec priorités et délais.
+
+Au plus `slots` générations s'exécutent en même temps (`NLP_MAX_CONCURRENCY`).
+Les autres attendent dans une file ordonnée par niveau (pro > free > guest),
+puis par ordre d'arrivée. Chaque niveau a un délai d'attente maximal : une
+requête dont l'attente estimée le dépasse est refusée tout de suite plutôt
+que de s'exécuter trop tard.
+
+Pour que la latence des utilisateurs connectés ne dépende pas du trafic
+invité, `reserved` créneaux ne sont jamais attribués aux invités, et une file
+pleine évince l'invité le plus récent au profit d'une requête prioritaire.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+PRIORITIES = {'pro': 0, 'free': 1, 'guest': 2}
+
+
+class AdmissionRejected(Exception):
+    """
+    Génération refusée : file pleine ou attente supérieure au délai.
+
+    Attributes:
+        queue_position: Position dans la file au moment du refus (None si aucune)
+        retry_after: Attente conseillée en secondes
+    """
+
+    def __init__(self, message: str, queue_position: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.queue_position = queue_position
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    Place d'une requête : en file, puis en cours d'exécution.
+
+    `release()` doit toujours être appelé (ou le ticket utilisé comme
+    gestionnaire de contexte) : il libère le créneau ou retire la requête de
+    la file.
+    """
+
+    def __init__(self, controller: 'AdmissionController', tier: str, timeout: float):
+        self.tier = tier if tier in PRIORITIES else 'guest'
+        self.rank = PRIORITIES[self.tier]
+        self.deadline = time.monotonic() + timeout
+        self.granted_at: Optional[float] = None
+        self.rejected: Optional[AdmissionRejected] = None
+        self.released = False
+        self._controller = controller
+        self._event = threading.Event()
+        self._wakers = []
+
+    def wait(self):
+        """
+        Attend un créneau jusqu'au délai du niveau.
+
+        Raises:
+            AdmissionRejected: Délai dépassé ou requête évincée de la file
+        """
+        try:
+            if not self._event.wait(max(0.0, self.deadline - time.monotonic())):
+                self._controller._expire(self)
+            self._check()
+        except BaseException:
+            self.release()
+            raise
+
+    async def wait_async(self):
+        """Variante asynchrone de `wait`, sans bloquer de thread."""
+        try:
+            if not self._event.is_set():
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+
+                def wake():
+                    loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+                self._controller._add_waker(self, wake)
+                try:
+                    await asyncio.wait_for(future, max(0.0, self.deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    self._controller._expire(self)
+            self._check()
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self, busy: Optional[float] = None):
+        """
+        Libère le créneau (ou la place dans la file).
+
+        Args:
+            busy: Durée effective de la génération, si elle diffère du temps
+                écoulé depuis l'obtention du créneau (flux lu par un client lent)
+        """
+        self._controller._release(self, busy)
+
+    def _check(self):
+        if self.rejected is not None:
+            raise self.rejected
+
+    def __enter__(self):
+        self.wait()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """
+    File d'attente des générations d'un processus.
+
+    Args:
+        slots: Générations simultanées
+        queue_size: Requêtes en attente au maximum
+        reserved: Créneaux interdits aux invités
+        deadlines: Attente maximale en secondes, par niveau
+    """
+
+    def __init__(self, slots: int = 4, queue_size: int = 64, reserved: int = 1,
+                 deadlines: Optional[Dict[str, float]] = None):
+        self.slots = max(1, slots)
+        self.queue_size = queue_size
+        # Au moins un créneau reste accessible aux invités
+        self.guest_slots = max(1, self.slots - reserved)
+        self.deadlines = {'pro': 30.0, 'free': 20.0, 'guest': 5.0, **(deadlines or {})}
+        self.service_time: Optional[float] = None
+        self._waiting = []
+        self._running = 0
+        self._running_guests = 0
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._admitted: Counter = Counter()
+        self._rejected: Counter = Counter()
+
+    def enter(self, tier: str) -> Ticket:
+        """
+        Inscrit une requête : créneau immédiat, ou place dans la file.
+
+        `with controller.enter(tier):` attend le créneau et le libère en sortie.
+
+        Raises:
+            AdmissionRejected: Attente estimée supérieure au délai, ou file pleine
+        """
+        ticket = Ticket(self, tier, self.deadlines.get(tier, self.deadlines['guest']))
+        with self._lock:
+            if self._waiting and len(self._waiting) >= self.queue_size:
+                self._make_room(ticket)
+            heapq.heappush(self._waiting, (ticket.rank, next(self._sequence), ticket))
+            self._dispatch()
+            if ticket.granted_at is not None:
+                return ticket
+
+            position = self._position(ticket)
+            estimate = self._estimate(position, ticket)
+            if estimate is not None and time.monotonic() + estimate > ticket.deadline:
+                self._remove(ticket)
+                self._rejected[ticket.tier] += 1
+                raise AdmissionRejected(
+                    "Modèle saturé, réessayez plus tard.", position, estimate
+                )
+        return ticket
+
+    def _make_room(self, ticket: Ticket):
+        # Dernier de la file : niveau le plus bas, arrivé le plus tard
+        worst = max(self._waiting)
+        if worst[0] <= ticket.rank:
+            self._rejected[ticket.tier] += 1
+            raise AdmissionRejected(
+                "File d'attente du modèle pleine.", len(self._waiting) + 1, self.service_time
+            )
+        evicted = worst[2]
+        self._remove(evicted)
+        self._rejected[evicted.tier] += 1
+        evicted.rejected = AdmissionRejected(
+            "Requête évincée de la file par une requête prioritaire.", None, self.service_time
+        )
+        self._wake(evicted)
+
+    def _can_run(self, ticket: Ticket) -> bool:
+        if self._running >= self.slots:
+            return False
+        return ticket.tier != 'guest' or self._running_guests < self.guest_slots
+
+    def _dispatch(self):
+        # La file est triée par niveau : si la tête (invité) est bloquée par
+        # les créneaux réservés, toutes les suivantes sont aussi des invités
+        while self._waiting and self._can_run(self._waiting[0][2]):
+            _, _, ticket = heapq.heappop(self._waiting)
+            ticket.granted_at = time.monotonic()
+            self._running += 1
+            if ticket.tier == 'guest':
+                self._running_guests += 1
+            self._admitted[ticket.tier] += 1
+            self._wake(ticket)
+
+    def _position(self, ticket: Ticket) -> int:
+        key = next(entry for entry in self._waiting if entry[2] is ticket)
+        return 1 + sum(1 for entry in self._waiting if entry < key)
+
+    def _estimate(self, position: int, ticket: Ticket) -> Optional[float]:
+        """Attente estimée : requêtes devant, réparties sur les créneaux accessibles."""
+        if self.service_time is None:
+            return None
+        slots = self.guest_slots if ticket.tier == 'guest' else self.slots
+        return math.ceil(position / slots) * self.service_time
+
+    def _remove(self, ticket: Ticket):
+        self._waiting = [entry for entry in self._waiting if entry[2] is not ticket]
+        heapq.heapify(self._waiting)
+
+    def _wake(self, ticket: Ticket):
+        ticket._event.set()
+        for wake in ticket._wakers:
+            wake()
+
+    def _add_waker(self, ticket: Ticket, wake):
+        with self._lock:
+            if ticket._event.is_set():
+                wake()
+            else:
+                ticket._wakers.append(wake)
+
+    def _expire(self, ticket: Ticket):
+        with self._lock:
+            if ticket.granted_at is not None or ticket.rejected is not None:
+                # Créneau obtenu (ou éviction) pendant l'expiration du délai
+                return
+            position = self._position(ticket)
+            self._remove(ticket)
+            self._rejected[ticket.tier] += 1
+            ticket.rejected = AdmissionRejected(
+                "Délai d'attente du modèle dépassé.", position, self._estimate(position, ticket)
+            )
+
+    def _release(self, ticket: Ticket, busy: Optional[float] = None):
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted_at is None:
+                if ticket.rejected is None:
+                    self._remove(ticket)
+                return
+            self._running -= 1
+            if ticket.tier == 'guest':
+                self._running_guests -= 1
+            duration = busy if busy is not None else time.monotonic() - ticket.granted_at
+            # Moyenne glissante de la durée d'une génération
+            self.service_time = duration if self.service_time is None \
+                else 0.8 * self.service_time + 0.2 * duration
+            self._dispatch()
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = Counter(entry[2].tier for entry in self._waiting)
+            return {
+                'slots': self.slots,
+                'guest_slots': self.guest_slots,
+                'running': self._running,
+                'queued': {tier: queued[tier] for tier in PRIORITIES},
+                'admitted': {tier: self._admitted[tier] for tier in PRIORITIES},
+                'rejected': {tier: self._rejected[tier] for tier in PRIORITIES},
+                'service_time': round(self.service_time, 4) if self.service_time is not None else None,
+            }
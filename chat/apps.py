@@ -1,6 +1,38 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
+from cocoja.env_loader import get_env
+
+
+def _is_autoreload_parent() -> bool:
+    """
+    Vrai pour le processus parent de `runserver` sous l'autoreloader : il ne
+    sert aucune requête, seul le processus enfant charge le modèle.
+    """
+    return (
+        len(sys.argv) > 1 and sys.argv[1] == 'runserver'
+        and os.environ.get('RUN_MAIN') != 'true' and '--noreload' not in sys.argv
+    )
+
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Préchargement du modèle en arrière-plan : le premier utilisateur
+        # ne paie pas le chargement des poids. `NLP_PRELOAD` est posé par la
+        # commande qui lance le serveur (dev.sh, gunicorn, uvicorn) : les
+        # autres commandes (migrate, test, shell...) ne chargent rien.
+        if get_env('NLP_PRELOAD', False, bool) and not get_env('NLP_SERVER_SOCKET') and not _is_autoreload_parent():
+            from .nlp_model import start_model_warmup, warm_up_model
+            if get_env('NLP_PRELOAD_BLOCKING', False, bool):
+                # Avec `gunicorn --preload` : poids chargés dans le maître
+                # avant le fork, puis partagés par les workers
+                warm_up_model()
+            else:
+                start_model_warmup()
@@ -0,0 +1,257 @@
+"""
+Archivage des conversations inactives.
+
+Les messages d'une conversation sans activité depuis `CHAT_ARCHIVE_AFTER_DAYS`
+jours sont retirés de `chat_message` et rangés dans un seul bloc compressé
+(`ConversationArchive`) : une ligne JSON [id, rôle, contenu, date] par message,
+compressée avec `CHAT_ARCHIVE_CODEC` (`zlib`, ou `zstd` si le paquet
+`zstandard` est installé). La table des messages, ses index et l'index de
+recherche ne contiennent plus que l'historique vivant.
+
+Le résumé de la conversation (`message_count`, dernier message) est conservé :
+la liste des conversations ne change pas. Dès qu'une vue lit ou complète la
+conversation, `rehydrate` réinsère les messages avec leurs identifiants et
+dates d'origine (les curseurs de pagination restent valables) et supprime
+l'archive. Ce coût est proportionnel à la longueur de la conversation : au-delà
+de `CHAT_ARCHIVE_MAX_MESSAGES` messages, elle n'est pas archivée.
+
+Tant qu'elle est archivée, une conversation n'apparaît ni dans la recherche
+plein texte ni dans `/api/chat/messages/`.
+"""
+
+import json
+import zlib
+from datetime import timedelta
+from typing import Callable, Iterator, Optional
+
+from django.db import connection, reset_queries, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from cocoja.env_loader import get_env
+
+from . import embeddings
+from .models import Conversation, ConversationArchive, Message, MessageEmbedding
+from .services import insert_rows
+
+CODECS = ('zlib', 'zstd')
+
+# Messages réinsérés par requête lors de la restauration
+INSERT_BATCH = 2000
+
+# Taille des morceaux décompressés à la fois
+READ_CHUNK = 256 * 1024
+
+
+def _compressor(codec: str):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=get_env('CHAT_ARCHIVE_LEVEL', 9, int)).compressobj()
+    if codec == 'zlib':
+        return zlib.compressobj(get_env('CHAT_ARCHIVE_LEVEL', 9, int))
+    raise ValueError(f"Codec d'archive inconnu : {codec} (choix : {', '.join(CODECS)})")
+
+
+def _decompressor(codec: str):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == 'zlib':
+        return zlib.decompressobj()
+    raise ValueError(f"Codec d'archive inconnu : {codec}")
+
+
+def iter_archived_rows(codec: str, data) -> Iterator[list]:
+    """Décompresse un bloc au fil de l'eau : [id, rôle, contenu, date ISO] par message."""
+    data = bytes(data)
+    decompressor = _decompressor(codec)
+    pending = b''
+    for offset in range(0, len(data), READ_CHUNK):
+        lines = (pending + decompressor.decompress(data[offset:offset + READ_CHUNK])).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield json.loads(line)
+    if pending:
+        yield json.loads(pending)
+
+
+def archive_conversation(conversation_id: int, cutoff, codec: str) -> Optional[dict]:
+    """
+    Archive les messages d'une conversation, dans une seule transaction.
+
+    La conversation est d'abord marquée archivée par un UPDATE conditionnel :
+    si elle a reçu un message depuis la sélection (`updated_at >= cutoff`)
+    ou est déjà archivée, rien n'est fait.
+
+    Returns:
+        {'messages', 'raw_bytes', 'stored_bytes'}, ou None si rien n'a été archivé
+    """
+    with transaction.atomic():
+        claimed = Conversation.objects.filter(
+            pk=conversation_id, archived_at__isnull=True, updated_at__lt=cutoff
+        ).update(archived_at=timezone.now())
+        if not claimed:
+            return None
+
+        compressor = _compressor(codec)
+        parts = []
+        raw_bytes = count = max_id = 0
+        rows = (
+            Message.objects
+            .filter(conversation_id=conversation_id)
+            .order_by('created_at', 'id')
+            .values_list('id', 'role', 'content', 'created_at')
+        )
+        for message_id, role, content, created_at in rows.iterator(chunk_size=INSERT_BATCH):
+            row = [message_id, role, content, created_at.isoformat()]
+            line = (json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8')
+            raw_bytes += len(line)
+            count += 1
+            max_id = max(max_id, message_id)
+            compressed = compressor.compress(line)
+            if compressed:
+                parts.append(compressed)
+        if not count:
+            transaction.set_rollback(True)
+            return None
+        parts.append(compressor.flush())
+        data = b''.join(parts)
+
+        ConversationArchive.objects.create(
+            conversation_id=conversation_id, codec=codec, data=data,
+            message_count=count, raw_size=raw_bytes,
+        )
+        # Les vecteurs d'abord (pas de cascade SQL), l'index plein texte suit
+        # par ses triggers
+        _delete_rows(MessageEmbedding, 'message', conversation_id, max_id)
+        _delete_rows(Message, 'id', conversation_id, max_id)
+    return {'messages': count, 'raw_bytes': raw_bytes, 'stored_bytes': len(data)}
+
+
+def _delete_rows(model, id_field: str, conversation_id: int, max_id: int):
+    """
+    DELETE direct, sans signaux ni collecte des objets liés : le résumé de la
+    conversation est conservé tel quel.
+    """
+    qn = connection.ops.quote_name
+    sql = 'DELETE FROM {} WHERE {} = %s AND {} <= %s'.format(
+        qn(model._meta.db_table),
+        qn(model._meta.get_field('conversation').column),
+        qn(model._meta.get_field(id_field).column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [conversation_id, max_id])
+
+
+def _insert_messages(messages):
+    """
+    Réinsère des messages tels quels : `bulk_create` remplacerait leur date
+    par l'heure courante (`auto_now_add`).
+    """
+    insert_rows(Message, messages, ['id', 'conversation', 'role', 'content', 'created_at'])
+    embeddings.index_messages(messages)
+    # Avec DEBUG, Django garde chaque lot de paramètres
+    reset_queries()
+
+
+def rehydrate(conversation: Conversation) -> int:
+    """
+    Restaure les messages d'une conversation archivée (sans effet sinon).
+
+    Sûr en cas d'appels concurrents : seul l'appel qui remet `archived_at`
+    à NULL restaure les messages.
+
+    Returns:
+        Nombre de messages restaurés
+    """
+    if conversation.archived_at is None:
+        return 0
+    with transaction.atomic():
+        claimed = Conversation.objects.filter(
+            pk=conversation.pk, archived_at__isnull=False
+        ).update(archived_at=None)
+        conversation.archived_at = None
+        if not claimed:
+            return 0
+        archive = ConversationArchive.objects.filter(conversation_id=conversation.pk).first()
+        if archive is None:
+            return 0
+
+        restored = 0
+        batch = []
+        for message_id, role, content, created_at in iter_archived_rows(archive.codec, archive.data):
+            batch.append(Message(
+                id=message_id, conversation_id=conversation.pk, role=role,
+                content=content, created_at=parse_datetime(created_at),
+            ))
+            if len(batch) >= INSERT_BATCH:
+                _insert_messages(batch)
+                restored += len(batch)
+                batch = []
+        if batch:
+            _insert_messages(batch)
+            restored += len(batch)
+        archive.delete()
+    return restored
+
+
+def archive_idle_conversations(
+    older_than_days: Optional[int] = None,
+    codec: Optional[str] = None,
+    batch_size: int = 100,
+    limit: Optional[int] = None,
+    after_pk: int = 0,
+    progress: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Archive les conversations inactives, par lots de `batch_size`.
+
+    Chaque conversation est archivée dans sa propre transaction : le job peut
+    être interrompu à tout moment et relancé, il reprend là où il s'était
+    arrêté (les conversations déjà archivées ne sont plus sélectionnées).
+
+    Args:
+        older_than_days: Inactivité minimale (`CHAT_ARCHIVE_AFTER_DAYS` par défaut)
+        codec: `zlib` ou `zstd` (`CHAT_ARCHIVE_CODEC` par défaut)
+        batch_size: Conversations sélectionnées par requête
+        limit: Nombre maximal de conversations à archiver
+        after_pk: Ne traiter que les conversations d'id supérieur
+        progress: Appelé après chaque lot avec le bilan courant
+
+    Returns:
+        {'conversations', 'messages', 'raw_bytes', 'stored_bytes', 'reclaimed_bytes', 'last_pk'}
+    """
+    days = older_than_days if older_than_days is not None else get_env('CHAT_ARCHIVE_AFTER_DAYS', 180, int)
+    codec = codec or get_env('CHAT_ARCHIVE_CODEC', 'zlib')
+    # Codec invalide ou paquet absent : erreur avant de toucher à la base
+    _compressor(codec)
+    cutoff = timezone.now() - timedelta(days=days)
+    # Restaurer une très longue conversation prendrait trop de temps pour une
+    # requête HTTP : elles restent dans la table
+    max_messages = get_env('CHAT_ARCHIVE_MAX_MESSAGES', 5000, int)
+    candidates = Conversation.objects.filter(
+        archived_at__isnull=True, updated_at__lt=cutoff,
+        message_count__gt=0, message_count__lte=max_messages,
+    ).order_by('pk').values_list('pk', flat=True)
+
+    stats = {'conversations': 0, 'messages': 0, 'raw_bytes': 0, 'stored_bytes': 0,
+             'reclaimed_bytes': 0, 'last_pk': after_pk}
+    while limit is None or stats['conversations'] < limit:
+        batch = list(candidates.filter(pk__gt=stats['last_pk'])[:batch_size])
+        if not batch:
+            break
+        for conversation_id in batch:
+            if limit is not None and stats['conversations'] >= limit:
+                break
+            result = archive_conversation(conversation_id, cutoff, codec)
+            stats['last_pk'] = conversation_id
+            if result is None:
+                continue
+            stats['conversations'] += 1
+            stats['messages'] += result['messages']
+            stats['raw_bytes'] += result['raw_bytes']
+            stats['stored_bytes'] += result['stored_bytes']
+        stats['reclaimed_bytes'] = stats['raw_bytes'] - stats['stored_bytes']
+        if progress is not None:
+            progress(stats)
+    return stats
@@ -0,0 +1,527 @@
+"""
+Banc de charge reproductible de l'API de chat (`python manage.py benchmark_api`).
+
+    1. `seed` : utilisateurs, conversations et messages à l'échelle voulue,
+       dont des utilisateurs ayant une conversation de 10 000 messages
+    2. `build_plan` : suite de requêtes tirée d'un mélange de scénarios
+       (graine fixe : deux exécutions rejouent exactement les mêmes requêtes)
+    3. `run_plan` : exécution à travers toute la pile Django (middlewares,
+       authentification JWT, vues) avec un modèle factice à latence réglable
+    4. `summarize` / `compare` : débit, p50/p95/p99, requêtes SQL par requête
+       HTTP (médiane de plusieurs passes), puis comparaison avec une
+       référence enregistrée
+
+`serialization_benchmark` compare, à 1k/10k/100k lignes, les serializers DRF
+au chemin rapide de chat.serializers et au renderer orjson
+(`python manage.py benchmark_serialization`).
+"""
+
+import queue
+import random
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import nlp_model, renderers
+from .embeddings import index_messages
+from .models import Conversation, Message
+from .nlp_model import NLPModel
+from .renderers import FastJSONRenderer
+from .serializers import (
+    CONVERSATION_LIST_VALUES,
+    MESSAGE_VALUES,
+    ConversationListSerializer,
+    ConversationSerializer,
+    MessageSerializer,
+    conversation_detail,
+    conversation_list_dicts,
+    message_dicts,
+)
+from .services import reconcile_conversation_stats
+
+User = get_user_model()
+
+# Poids par défaut des scénarios
+DEFAULT_MIX = {
+    'ask': 25,
+    'ask_guest': 10,
+    'conversations': 25,
+    'messages': 20,
+    'message_list': 10,
+    'message_detail': 5,
+    'message_update': 5,
+}
+
+WORDS = (
+    "bonjour merci question réponse modèle conversation message projet python django "
+    "serveur requête base données index cache latence mémoire fichier recherche contexte "
+    "utilisateur historique résumé exemple erreur test déploiement configuration réseau"
+).split()
+
+
+class StubNLPModel(NLPModel):
+    """
+    Modèle factice : construit le prompt comme le vrai modèle, puis attend
+    `latency` secondes (plus un aléa uniforme de ± `jitter`) avant de répondre.
+    """
+
+    def __init__(self, latency: float = 0.02, jitter: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        super().__init__()
+
+    def _initialize_model(self):
+        # Aucun moteur : pas de poids à charger
+        pass
+
+    def _delay(self):
+        with self._rng_lock:
+            delay = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def generate_response(self, user_input, conversation_history=None, max_length=512,
+                          temperature=0.7, conversation_id=None):
+        self.build_prompt(user_input, conversation_history, max_length)
+        self._delay()
+        return self._simulation_response(user_input)
+
+    def generate_response_stream(self, user_input, conversation_history=None, max_length=512,
+                                 temperature=0.7, conversation_id=None):
+        yield self.generate_response(user_input, conversation_history, max_length, temperature, conversation_id)
+
+
+def install_stub_model(latency: float, jitter: float = 0.0, seed: int = 0) -> StubNLPModel:
+    """Remplace le modèle du processus par un `StubNLPModel`."""
+    with nlp_model._model_lock:
+        nlp_model._model_instance = StubNLPModel(latency, jitter, seed)
+    return nlp_model._model_instance
+
+
+@contextmanager
+def temporary_database():
+    """
+    Base de test temporaire, détruite en sortie (fichier pour SQLite :
+    partagée par les clients concurrents, contrairement à une base en mémoire).
+    """
+    setup_test_environment(debug=False)
+    old_name = connection.settings_dict['NAME']
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = str(Path(directory) / 'benchmark.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+
+def _sentence(rng: random.Random, low: int = 5, high: int = 40) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def _messages(conversation_id: int, count: int, rng: random.Random):
+    for i in range(count):
+        yield Message(
+            conversation_id=conversation_id,
+            role='user' if i % 2 == 0 else 'assistant',
+            content=_sentence(rng),
+        )
+
+
+def seed(users: int = 20, conversations: int = 5, messages: int = 20,
+         heavy_users: int = 1, heavy_messages: int = 10000,
+         random_seed: int = 0, batch_size: int = 2000) -> dict:
+    """
+    Peuple la base.
+
+    Chaque utilisateur a `conversations` conversations de `messages`
+    messages ; les `heavy_users` premiers ont en plus une conversation de
+    `heavy_messages` messages. Les vecteurs de contexte et les résumés des
+    conversations sont calculés comme en production.
+
+    Returns:
+        {'users': {id: [ids des conversations]}, 'heavy': {id de l'utilisateur: id de la conversation}}
+    """
+    rng = random.Random(random_seed)
+    usernames = [f'bench{i}' for i in range(users)]
+    User.objects.bulk_create([
+        User(username=username, email=f'{username}@example.com', password='!')
+        for username in usernames
+    ])
+    user_ids = list(User.objects.filter(username__in=usernames).order_by('id').values_list('id', flat=True))
+
+    Conversation.objects.bulk_create([
+        Conversation(user_id=user_id, title=f'Conversation {j}')
+        for user_id in user_ids for j in range(conversations)
+    ])
+    heavy_ids = user_ids[:heavy_users]
+    Conversation.objects.bulk_create([
+        Conversation(user_id=user_id, title='Historique long') for user_id in heavy_ids
+    ])
+
+    fixtures = {'users': {user_id: [] for user_id in user_ids}, 'heavy': {}}
+    for conversation_id, user_id, title in Conversation.objects.filter(
+        user_id__in=user_ids
+    ).order_by('id').values_list('id', 'user_id', 'title'):
+        if title == 'Historique long':
+            fixtures['heavy'][user_id] = conversation_id
+        fixtures['users'][user_id].append(conversation_id)
+
+    pending = []
+    for user_id, conversation_ids in fixtures['users'].items():
+        for conversation_id in conversation_ids:
+            count = heavy_messages if fixtures['heavy'].get(user_id) == conversation_id else messages
+            for message in _messages(conversation_id, count, rng):
+                pending.append(message)
+                if len(pending) >= batch_size:
+                    Message.objects.bulk_create(pending)
+                    pending = []
+    if pending:
+        Message.objects.bulk_create(pending)
+
+    # bulk_create n'émet pas de signaux : vecteurs et résumés recalculés ici
+    batch = []
+    for message in Message.objects.filter(conversation__user_id__in=user_ids).only(
+        'id', 'conversation_id', 'content'
+    ).iterator(chunk_size=batch_size):
+        batch.append(message)
+        if len(batch) >= batch_size:
+            index_messages(batch)
+            batch = []
+    if batch:
+        index_messages(batch)
+    reconcile_conversation_stats()
+    return fixtures
+
+
+def build_plan(fixtures: dict, mix: Dict[str, float], total: int,
+               heavy_share: float = 0.2, random_seed: int = 0) -> List[dict]:
+    """
+    Tire `total` requêtes selon les poids de `mix`.
+
+    Une part `heavy_share` des requêtes authentifiées vise la longue
+    conversation d'un utilisateur « lourd ».
+
+    Returns:
+        [{scenario, method, path, data, user_id}, ...]
+    """
+    rng = random.Random(random_seed)
+    scenarios = [name for name in mix if mix[name] > 0]
+    weights = [mix[name] for name in scenarios]
+    user_ids = sorted(fixtures['users'])
+    heavy_ids = sorted(fixtures['heavy'])
+    message_ids = {}
+
+    def pick():
+        if heavy_ids and rng.random() < heavy_share:
+            user_id = rng.choice(heavy_ids)
+            return user_id, fixtures['heavy'][user_id]
+        user_id = rng.choice(user_ids)
+        return user_id, rng.choice(fixtures['users'][user_id])
+
+    def message_of(conversation_id):
+        if conversation_id not in message_ids:
+            message_ids[conversation_id] = list(
+                Message.objects.filter(conversation_id=conversation_id).order_by('-id').values_list('id', flat=True)[:50]
+            )
+        return rng.choice(message_ids[conversation_id])
+
+    plan = []
+    for _ in range(total):
+        scenario = rng.choices(scenarios, weights)[0]
+        user_id, conversation_id = pick()
+        request = {'scenario': scenario, 'method': 'get', 'data': None, 'user_id': user_id}
+        if scenario == 'ask':
+            request.update(method='post', path='/api/chat/ask/',
+                           data={'question': _sentence(rng, 3, 15), 'conversation_id': conversation_id})
+        elif scenario == 'ask_guest':
+            request.update(method='post', path='/api/chat/ask/',
+                           data={'question': _sentence(rng, 3, 15)}, user_id=None)
+        elif scenario == 'conversations':
+            request['path'] = '/api/chat/conversations/'
+        elif scenario == 'messages':
+            request['path'] = f'/api/chat/conversations/{conversation_id}/messages/'
+        elif scenario == 'message_list':
+            request['path'] = '/api/chat/messages/'
+        elif scenario == 'message_detail':
+            request['path'] = f'/api/chat/messages/{message_of(conversation_id)}/'
+        elif scenario == 'message_update':
+            request.update(method='patch', path=f'/api/chat/messages/{message_of(conversation_id)}/',
+                           data={'content': _sentence(rng)})
+        else:
+            raise ValueError(f"Scénario inconnu : {scenario}")
+        plan.append(request)
+    return plan
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_plan(plan: List[dict], concurrency: int = 1, warmup: int = 0) -> dict:
+    """
+    Exécute le plan avec `concurrency` clients en parallèle.
+
+    Les `warmup` premières requêtes ne sont pas mesurées.
+
+    Returns:
+        {'elapsed': secondes, 'samples': [(scenario, secondes, requêtes SQL, statut), ...]}
+    """
+    tokens = {
+        user_id: str(AccessToken.for_user(user))
+        for user_id, user in User.objects.in_bulk({r['user_id'] for r in plan if r['user_id']}).items()
+    }
+
+    def execute(client: APIClient, request: dict):
+        token = tokens.get(request['user_id'])
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            if request['method'] == 'get':
+                response = client.get(request['path'], **headers)
+            else:
+                response = getattr(client, request['method'])(
+                    request['path'], request['data'], format='json', **headers
+                )
+        return request['scenario'], time.perf_counter() - start, counter.count, response.status_code
+
+    warm_client = APIClient()
+    for request in plan[:warmup]:
+        execute(warm_client, request)
+
+    jobs: queue.Queue = queue.Queue()
+    for request in plan[warmup:]:
+        jobs.put(request)
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker():
+        client = APIClient()
+        local = []
+        try:
+            while True:
+                try:
+                    request = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                local.append(execute(client, request))
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+            with samples_lock:
+                samples.extend(local)
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return {'elapsed': time.perf_counter() - start, 'samples': samples}
+
+
+def summarize(result: dict) -> dict:
+    """
+    Statistiques par scénario et globales.
+
+    Returns:
+        {'throughput', 'requests', 'scenarios': {nom: {count, errors, p50, p95, p99, queries}}}
+        (latences en millisecondes, requêtes SQL moyennes par requête HTTP)
+    """
+    by_scenario: Dict[str, list] = {}
+    for scenario, seconds, queries, status in result['samples']:
+        by_scenario.setdefault(scenario, []).append((seconds, queries, status))
+
+    scenarios = {}
+    for scenario, rows in sorted(by_scenario.items()):
+        latencies = np.array([row[0] for row in rows]) * 1000
+        scenarios[scenario] = {
+            'count': len(rows),
+            'errors': sum(1 for row in rows if row[2] >= 400),
+            'p50': round(float(np.percentile(latencies, 50)), 2),
+            'p95': round(float(np.percentile(latencies, 95)), 2),
+            'p99': round(float(np.percentile(latencies, 99)), 2),
+            'queries': round(sum(row[1] for row in rows) / len(rows), 2),
+        }
+    total = len(result['samples'])
+    return {
+        'requests': total,
+        'throughput': round(total / result['elapsed'], 1) if result['elapsed'] else 0,
+        'scenarios': scenarios,
+    }
+
+
+def median_summary(summaries: List[dict]) -> dict:
+    """
+    Médiane, statistique par statistique, de plusieurs passes du même plan :
+    une passe perturbée par la machine ne suffit pas à signaler une régression.
+    """
+    merged = {
+        'requests': summaries[0]['requests'],
+        'throughput': round(float(np.median([s['throughput'] for s in summaries])), 1),
+        'scenarios': {},
+    }
+    for scenario, first in summaries[0]['scenarios'].items():
+        rows = [s['scenarios'][scenario] for s in summaries if scenario in s['scenarios']]
+        merged['scenarios'][scenario] = {
+            key: round(float(np.median([row[key] for row in rows])), 2) if key not in ('count', 'errors')
+            else max(row[key] for row in rows)
+            for key in first
+        }
+    return merged
+
+
+def compare(summary: dict, baseline: dict, tolerance: float = 0.5,
+            query_tolerance: float = 0.5, min_latency_ms: float = 10.0) -> List[str]:
+    """
+    Compare un résultat à la référence.
+
+    Le nombre de requêtes SQL ne dépend pas de la machine : toute hausse
+    au-delà de `query_tolerance` est une régression. Le p50 et le débit
+    tolèrent un écart relatif `tolerance`, le p95, plus bruité, le double ;
+    les latences sous `min_latency_ms` comptent pour `min_latency_ms`.
+
+    Returns:
+        Les régressions, une ligne chacune (liste vide si aucune)
+    """
+    regressions = []
+    for scenario, reference in baseline.get('scenarios', {}).items():
+        current = summary['scenarios'].get(scenario)
+        if current is None:
+            continue
+        if current['queries'] > reference['queries'] + query_tolerance:
+            regressions.append(
+                f"{scenario}: {current['queries']} requêtes SQL par requête (référence {reference['queries']})"
+            )
+        for percentile, allowed in (('p50', tolerance), ('p95', 2 * tolerance)):
+            limit = max(reference[percentile], min_latency_ms) * (1 + allowed)
+            if current[percentile] > limit:
+                regressions.append(
+                    f"{scenario}: {percentile} {current[percentile]} ms "
+                    f"(référence {reference[percentile]} ms, limite {limit:.1f} ms)"
+                )
+        if current['errors'] > reference.get('errors', 0):
+            regressions.append(f"{scenario}: {current['errors']} erreur(s) (référence {reference.get('errors', 0)})")
+    reference_throughput = baseline.get('throughput')
+    if reference_throughput and summary['throughput'] < reference_throughput * (1 - tolerance):
+        regressions.append(
+            f"débit {summary['throughput']} req/s (référence {reference_throughput} req/s)"
+        )
+    return regressions
+
+
+def parse_mix(text: Optional[str]) -> Dict[str, float]:
+    """`ask=30,conversations=20` → poids par scénario (défaut : `DEFAULT_MIX`)."""
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Scénario inconnu : {name} (disponibles : {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _median_ms(func: Callable, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1000, 2)
+
+
+def serialization_benchmark(sizes: Sequence[int] = (1000, 10000, 100000),
+                            repeat: int = 5, page_size: int = 200) -> List[dict]:
+    """
+    Mesure, pour chaque taille, lecture + sérialisation + rendu JSON :
+
+        retrieve  une conversation de `size` messages
+        messages  une page de `page_size` messages de cette conversation
+        list      la liste de `size` conversations d'un utilisateur
+
+    par les serializers DRF (`drf`), par le chemin rapide avec le renderer
+    JSON de DRF (`fast`), puis avec `FastJSONRenderer` (`fast_orjson`).
+    `identical` vérifie que les deux chemins produisent les mêmes octets.
+
+    Returns:
+        [{scenario, size, drf, fast, fast_orjson, speedup, identical}, ...] (temps en ms, médianes)
+    """
+    rng = random.Random(0)
+    json_renderer = JSONRenderer()
+    fast_renderer = FastJSONRenderer()
+    results = []
+    for size in sizes:
+        user = User.objects.create(username=f'serialization{size}', password='!')
+        conversation = Conversation.objects.create(user=user, title=f'{size} messages', message_count=size)
+        for start in range(0, size, 5000):
+            Message.objects.bulk_create(_messages(conversation.pk, min(5000, size - start), rng))
+        now = timezone.now()
+        Conversation.objects.bulk_create([
+            Conversation(user=user, title=f'Conversation {i}', message_count=i % 50, last_message_at=now,
+                         last_message_role='assistant', last_message_preview=_sentence(rng)[:100])
+            for i in range(size - 1)
+        ])
+        conversations = Conversation.objects.filter(user=user)
+        latest = conversation.messages.order_by('-created_at', '-id')
+
+        scenarios = {
+            'retrieve': (
+                lambda: ConversationSerializer(conversation).data,
+                lambda: conversation_detail(conversation),
+            ),
+            'messages': (
+                lambda: MessageSerializer(latest[:page_size], many=True).data,
+                lambda: message_dicts(latest.values_list(*MESSAGE_VALUES)[:page_size]),
+            ),
+            'list': (
+                lambda: ConversationListSerializer(conversations, many=True).data,
+                lambda: conversation_list_dicts(conversations.values_list(*CONVERSATION_LIST_VALUES)),
+            ),
+        }
+        for name, (drf, fast) in scenarios.items():
+            drf_ms = _median_ms(lambda: json_renderer.render(drf()), repeat)
+            fast_ms = _median_ms(lambda: json_renderer.render(fast()), repeat)
+            orjson_ms = _median_ms(lambda: fast_renderer.render(fast()), repeat)
+            results.append({
+                'scenario': name,
+                'size': size,
+                'drf': drf_ms,
+                'fast': fast_ms,
+                'fast_orjson': orjson_ms,
+                'speedup': round(drf_ms / orjson_ms, 1) if orjson_ms else None,
+                'identical': json_renderer.render(drf()) == fast_renderer.render(fast()),
+            })
+    return results
+
+
+def orjson_available() -> bool:
+    return renderers.orjson is not None
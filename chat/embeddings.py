@@ -0,0 +1,181 @@
+"""
+Index sémantique des messages pour la sélection du contexte.
+
+Chaque message reçoit, à l'écriture, un vecteur float32 normalisé stocké dans
+`MessageEmbedding`. Au moment de poser une question, les vecteurs de la
+conversation sont chargés en une matrice NumPy et comparés à la question par
+produit scalaire (similarité cosinus) pour retrouver les échanges anciens
+pertinents.
+
+L'encodeur par défaut est un hachage de mots et bigrammes (aucune dépendance,
+stable entre processus). Il peut être remplacé via `set_encoder`, par exemple
+par un modèle de phrases.
+"""
+
+import hashlib
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cocoja.env_loader import get_env
+
+from .models import Message, MessageEmbedding
+
+_WORD_RE = re.compile(r'\w\w+')
+
+Encoder = Callable[[Sequence[str]], np.ndarray]
+
+
+def embedding_dim() -> int:
+    return get_env('NLP_EMBEDDING_DIM', 256, int)
+
+
+def _features(text: str) -> Counter:
+    text = unicodedata.normalize('NFKD', text).casefold()
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    words = _WORD_RE.findall(text)
+    features = Counter(words)
+    features.update(f'{a} {b}' for a, b in zip(words, words[1:]))
+    return features
+
+
+def hashing_encoder(texts: Sequence[str]) -> np.ndarray:
+    """
+    Encode des textes par hachage signé de leurs mots et bigrammes.
+
+    Returns:
+        Matrice (len(texts), NLP_EMBEDDING_DIM) float32, lignes normalisées
+    """
+    dim = embedding_dim()
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, count in _features(text).items():
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % dim
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vectors[row, bucket] += sign * (1.0 + math.log(count))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+_encoder: Encoder = hashing_encoder
+
+
+def set_encoder(encoder: Encoder):
+    """
+    Remplace l'encodeur (fonction textes -> matrice float32 normalisée).
+
+    Les vecteurs déjà stockés doivent alors être recalculés :
+    `python manage.py index_message_embeddings --rebuild`.
+    """
+    global _encoder
+    _encoder = encoder
+
+
+def encode(texts: Sequence[str]) -> np.ndarray:
+    return np.asarray(_encoder(list(texts)), dtype=np.float32)
+
+
+def build_embeddings(messages: Iterable[Message], vectors: Optional[np.ndarray] = None) -> List[MessageEmbedding]:
+    """
+    Prépare les `MessageEmbedding` de messages déjà enregistrés.
+
+    Les vecteurs peuvent être calculés à l'avance (hors transaction) et
+    passés via `vectors`.
+    """
+    messages = list(messages)
+    if vectors is None:
+        vectors = encode([message.content for message in messages])
+    return [
+        MessageEmbedding(
+            message_id=message.pk,
+            conversation_id=message.conversation_id,
+            vector=vector.astype('<f4').tobytes(),
+        )
+        for message, vector in zip(messages, vectors)
+    ]
+
+
+def index_messages(messages: Iterable[Message], vectors: Optional[np.ndarray] = None):
+    """Calcule et enregistre (ou remplace) les vecteurs de `messages`."""
+    embeddings = build_embeddings(messages, vectors)
+    MessageEmbedding.objects.bulk_create(
+        embeddings,
+        update_conflicts=True,
+        unique_fields=['message'],
+        update_fields=['vector'],
+    )
+
+
+def index_missing(after_id: int = 0, batch_size: int = 500) -> int:
+    """
+    Indexe, par lots, les messages d'id supérieur à `after_id` qui n'ont pas
+    encore de vecteur (messages importés ou antérieurs à l'index).
+
+    Returns:
+        Nombre de messages indexés
+    """
+    indexed = 0
+    last_id = after_id
+    while True:
+        batch = list(
+            Message.objects
+            .filter(id__gt=last_id, embedding__isnull=True)
+            .order_by('id')
+            .only('id', 'conversation_id', 'content')[:batch_size]
+        )
+        if not batch:
+            return indexed
+        index_messages(batch)
+        indexed += len(batch)
+        last_id = batch[-1].id
+
+
+def search_similar(
+    conversation_id: int,
+    query: str,
+    top_k: int,
+    exclude_ids: Iterable[int] = (),
+    min_score: float = 0.0,
+    max_candidates: Optional[int] = None,
+) -> List[Tuple[int, float]]:
+    """
+    Retrouve les messages d'une conversation les plus proches de `query`.
+
+    Une requête charge les vecteurs de la conversation ; la similarité est
+    calculée d'un seul produit matrice-vecteur. Avec `max_candidates`, seuls
+    les vecteurs des messages les plus récents (hors `exclude_ids`) sont
+    chargés : le coût par question ne croît plus avec la conversation.
+
+    Returns:
+        [(message_id, score), ...] du plus au moins similaire
+    """
+    query_vector = encode([query])[0]
+    candidates = (
+        MessageEmbedding.objects
+        .filter(conversation_id=conversation_id)
+        .exclude(message_id__in=list(exclude_ids))
+        .order_by('-message_id')
+        .values_list('message_id', 'vector')
+    )
+    if max_candidates is not None:
+        candidates = candidates[:max_candidates]
+    dim = query_vector.shape[0]
+    # Vecteurs d'un autre encodeur (dimension différente) : ignorés
+    rows = [(message_id, vector) for message_id, vector in candidates if len(vector) == dim * 4]
+    if not rows or top_k <= 0:
+        return []
+
+    ids = np.fromiter((message_id for message_id, _ in rows), dtype=np.int64, count=len(rows))
+    matrix = np.frombuffer(b''.join(bytes(vector) for _, vector in rows), dtype='<f4').reshape(len(rows), dim)
+    scores = matrix @ query_vector
+
+    k = min(top_k, len(rows))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [(int(ids[i]), float(scores[i])) for i in best if scores[i] > min_score]
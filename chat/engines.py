@@ -0,0 +1,437 @@
+"""
+Moteurs d'inférence interchangeables, choisis par `NLP_ENGINE`.
+
+    torch       modèle Transformers/PyTorch tel quel (float32)
+    torch-int8  même modèle, couches linéaires quantifiées en int8 dynamique (CPU)
+    onnx        session ONNX Runtime (`model.onnx`), threads intra/inter-op réglables
+
+Tous exposent la même interface : `next_token_logits` (une passe du modèle)
+et, dans la classe de base, les boucles de génération communes
+(`iter_tokens` et `generate` pour une requête, `generate_batch` pour un
+lot). Les moteurs peuvent ainsi être comparés à l'identique avec
+`python manage.py benchmark_engines`.
+
+Les dépendances (torch, transformers, onnxruntime) ne sont importées que par
+le moteur qui en a besoin.
+"""
+
+import logging
+import warnings
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .weights import load_weights
+
+logger = logging.getLogger(__name__)
+
+
+def sample_token(logits: np.ndarray, temperature: float, rng: np.random.Generator) -> int:
+    """Choisit le token suivant : argmax si `temperature <= 0`, tirage sinon."""
+    if temperature <= 0:
+        return int(np.argmax(logits))
+    scaled = logits.astype(np.float64) / temperature
+    scaled -= scaled.max()
+    probabilities = np.exp(scaled)
+    probabilities /= probabilities.sum()
+    return int(rng.choice(len(probabilities), p=probabilities))
+
+
+class InferenceEngine:
+    """
+    Interface commune des moteurs.
+
+    Les sous-classes implémentent `next_token_logits`. Celles qui gèrent un
+    cache clé/valeur (`supports_state`) ne reçoivent ensuite que le dernier
+    token ; les autres reçoivent toute la séquence à chaque pas. Celles qui
+    acceptent un masque d'attention (`supports_padding`) traitent un lot de
+    prompts de longueurs différentes, complétés à gauche, en une seule passe.
+    """
+    name = 'base'
+    supports_state = False
+    supports_padding = False
+
+    def __init__(self, model_path: str, device: str = 'cpu',
+                 intra_op_threads: int = 0, inter_op_threads: int = 0):
+        self.model_path = Path(model_path)
+        self.device = device
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self._rng = np.random.default_rng()
+
+    def next_token_logits(self, input_ids: np.ndarray, state: Any = None,
+                          attention_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, Any]:
+        """
+        Une passe du modèle.
+
+        Args:
+            input_ids: Tokens à encoder, int64 de forme (lot, longueur)
+            state: Cache clé/valeur couvrant les tokens précédents, ou None
+            attention_mask: 0 pour les positions de remplissage, forme
+                (lot, tokens précédents + longueur) ; None sans remplissage
+
+        Returns:
+            (logits du dernier token, forme (lot, vocabulaire) ; nouvel état)
+        """
+        raise NotImplementedError
+
+    def crop_state(self, state: Any, length: int) -> Any:
+        """Tronque un état aux `length` premiers tokens (None si non géré)."""
+        return None
+
+    def select_state(self, state: Any, row: int, start: int, length: int) -> Any:
+        """
+        Extrait d'un état de lot celui d'une ligne : les `length` tokens à
+        partir de la position `start` (None si non géré).
+        """
+        return None
+
+    def iter_tokens(
+        self,
+        prompt_ids: List[int],
+        max_new_tokens: int,
+        temperature: float = 0.0,
+        state: Any = None,
+        state_length: int = 0,
+        eos_token_id: Optional[int] = None,
+        result: Optional[dict] = None,
+    ) -> Iterator[int]:
+        """
+        Génère les tokens un par un.
+
+        Args:
+            prompt_ids: Le prompt complet
+            max_new_tokens: Nombre maximal de tokens générés
+            temperature: 0 pour une génération déterministe
+            state: État couvrant les `state_length` premiers tokens du prompt
+            state_length: Nombre de tokens couverts par `state`
+            eos_token_id: Token de fin
+            result: Reçoit `state` (couvrant prompt et tokens générés) à la fin
+
+        Yields:
+            Les identifiants des tokens générés
+        """
+        ids = np.asarray([prompt_ids], dtype=np.int64)
+        if not self.supports_state or state is None:
+            state, state_length = None, 0
+        elif state_length >= ids.shape[1]:
+            # Prompt entièrement en cache : on réencode le dernier token pour obtenir ses logits
+            state_length = ids.shape[1] - 1
+            state = self.crop_state(state, state_length)
+        feed = ids[:, state_length:]
+
+        for _ in range(max_new_tokens):
+            logits, new_state = self.next_token_logits(feed, state)
+            if self.supports_state:
+                state = new_state
+            token = sample_token(logits[0], temperature, self._rng)
+            yield token
+            if token == eos_token_id:
+                break
+            ids = np.concatenate([ids, [[token]]], axis=1)
+            feed = ids[:, -1:] if self.supports_state else ids
+
+        if result is not None:
+            result['state'] = state
+
+    def generate(self, prompt_ids: List[int], max_new_tokens: int, temperature: float = 0.0,
+                 state: Any = None, state_length: int = 0,
+                 eos_token_id: Optional[int] = None) -> Tuple[List[int], Any]:
+        """
+        Génère une réponse complète.
+
+        Returns:
+            (tokens générés, état couvrant le prompt et la réponse)
+        """
+        result = {}
+        tokens = list(self.iter_tokens(
+            prompt_ids, max_new_tokens, temperature, state, state_length, eos_token_id, result
+        ))
+        return tokens, result.get('state')
+
+    def generate_batch(
+        self,
+        prompts: List[List[int]],
+        max_new_tokens: int,
+        temperature: float = 0.0,
+        eos_token_id: Optional[int] = None,
+        pad_token_id: int = 0,
+        result: Optional[dict] = None,
+    ) -> List[List[int]]:
+        """
+        Génère les réponses d'un lot de prompts, une passe du modèle par token
+        pour tout le lot.
+
+        Les prompts sont complétés à gauche par `pad_token_id` et masqués. Un
+        moteur sans masque d'attention traite ensemble les prompts de même
+        longueur. Une ligne terminée (token de fin) ne reçoit plus de tokens.
+
+        Args:
+            prompts: Les prompts, de longueurs quelconques
+            max_new_tokens: Nombre maximal de tokens générés par prompt
+            temperature: 0 pour une génération déterministe
+            eos_token_id: Token de fin
+            pad_token_id: Token de remplissage
+            result: Reçoit `states`, l'état couvrant le prompt de chaque ligne
+                (None si le moteur ne le gère pas)
+
+        Returns:
+            Les tokens générés pour chaque prompt, dans le même ordre
+        """
+        prompts = [[int(token) for token in prompt] for prompt in prompts]
+        outputs: List[List[int]] = [[] for _ in prompts]
+        states: List[Any] = [None] * len(prompts)
+        if not prompts:
+            return outputs
+        lengths = [len(prompt) for prompt in prompts]
+
+        if not self.supports_padding and len(set(lengths)) > 1:
+            groups = {}
+            for index, length in enumerate(lengths):
+                groups.setdefault(length, []).append(index)
+            for indices in groups.values():
+                group_result = {}
+                generated = self.generate_batch(
+                    [prompts[index] for index in indices], max_new_tokens, temperature,
+                    eos_token_id, pad_token_id, group_result,
+                )
+                for index, tokens, state in zip(indices, generated, group_result['states']):
+                    outputs[index], states[index] = tokens, state
+            if result is not None:
+                result['states'] = states
+            return outputs
+
+        width = max(lengths)
+        pads = [width - length for length in lengths]
+        ids = np.asarray(
+            [[pad_token_id] * pad + prompt for pad, prompt in zip(pads, prompts)], dtype=np.int64
+        )
+        mask = None
+        if any(pads):
+            mask = (np.arange(width)[None, :] >= np.asarray(pads)[:, None]).astype(np.int64)
+        feed, state = ids, None
+        finished = np.zeros(len(prompts), dtype=bool)
+        for _ in range(max_new_tokens):
+            if mask is None:
+                logits, new_state = self.next_token_logits(feed, state)
+            else:
+                logits, new_state = self.next_token_logits(feed, state, attention_mask=mask)
+            if self.supports_state:
+                state = new_state
+            tokens = np.full((len(prompts), 1), pad_token_id, dtype=np.int64)
+            for row in np.flatnonzero(~finished):
+                token = sample_token(logits[row], temperature, self._rng)
+                outputs[row].append(token)
+                tokens[row, 0] = token
+                finished[row] = token == eos_token_id
+            if finished.all():
+                break
+            if mask is not None:
+                mask = np.concatenate([mask, np.ones((len(prompts), 1), dtype=np.int64)], axis=1)
+            ids = np.concatenate([ids, tokens], axis=1)
+            feed = tokens if self.supports_state else ids
+
+        if result is not None:
+            if state is not None:
+                states = [
+                    self.select_state(state, row, pad, length)
+                    for row, (pad, length) in enumerate(zip(pads, lengths))
+                ]
+            result['states'] = states
+        return outputs
+
+
+class TorchEngine(InferenceEngine):
+    """
+    Modèle Transformers/PyTorch avec cache clé/valeur.
+
+    Si le dossier contient des `.safetensors`, les paramètres sont ensuite
+    remplacés par des vues sur les fichiers projetés en mémoire : les workers
+    partagent les mêmes pages (voir `chat/weights.py`).
+    """
+    name = 'torch'
+    supports_state = True
+    supports_padding = True
+
+    def __init__(self, model_path, device='cpu', intra_op_threads=0, inter_op_threads=0):
+        super().__init__(model_path, device, intra_op_threads, inter_op_threads)
+        import torch
+        from transformers import AutoModelForCausalLM
+
+        self.torch = torch
+        if intra_op_threads:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads:
+            try:
+                torch.set_num_interop_threads(inter_op_threads)
+            except RuntimeError:
+                # Réglable une seule fois, avant tout calcul parallèle
+                logger.warning("Threads inter-op déjà fixés, NLP_INTER_OP_THREADS ignoré")
+
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32)
+        self.model = self._prepare(model).to(device).eval()
+
+    def _prepare(self, model):
+        self._share_mapped_weights(model)
+        return model
+
+    def _share_mapped_weights(self, model):
+        if not any(self.model_path.glob('*.safetensors')):
+            return
+        mapped = load_weights(self.model_path)
+        parameters = dict(model.named_parameters())
+        shared = 0
+        with warnings.catch_warnings():
+            # Tableaux en lecture seule : l'inférence n'écrit jamais dans les poids
+            warnings.simplefilter('ignore', UserWarning)
+            for name, array in mapped.items():
+                parameter = parameters.get(name)
+                if parameter is not None and tuple(parameter.shape) == array.shape \
+                        and str(array.dtype) == 'float32':
+                    parameter.data = self.torch.from_numpy(array)
+                    shared += 1
+        logger.info("%d/%d paramètres partagés par mmap", shared, len(parameters))
+
+    def next_token_logits(self, input_ids, state=None, attention_mask=None):
+        inputs = {}
+        if attention_mask is not None:
+            mask = self.torch.from_numpy(attention_mask).to(self.device)
+            # Positions comptées hors remplissage : chaque ligne commence à 0
+            positions = (mask.cumsum(-1) - 1).clamp(min=0)
+            inputs = {'attention_mask': mask, 'position_ids': positions[:, -input_ids.shape[1]:]}
+        with self.torch.inference_mode():
+            output = self.model(
+                input_ids=self.torch.from_numpy(input_ids).to(self.device),
+                past_key_values=state,
+                use_cache=True,
+                **inputs,
+            )
+        return output.logits[:, -1, :].float().cpu().numpy(), output.past_key_values
+
+    def crop_state(self, state, length):
+        if state is None:
+            return None
+        if hasattr(state, 'crop'):
+            state.crop(length)
+            return state
+        return tuple((key[:, :, :length], value[:, :, :length]) for key, value in state)
+
+    def select_state(self, state, row, start, length):
+        if state is None:
+            return None
+        legacy = state.to_legacy_cache() if hasattr(state, 'to_legacy_cache') else state
+        selected = tuple(
+            (key[row:row + 1, :, start:start + length].clone(),
+             value[row:row + 1, :, start:start + length].clone())
+            for key, value in legacy
+        )
+        if hasattr(state, 'from_legacy_cache'):
+            return type(state).from_legacy_cache(selected)
+        return selected
+
+
+class TorchInt8Engine(TorchEngine):
+    """
+    Couches linéaires quantifiées en int8 (quantification dynamique, CPU).
+
+    Les poids quantifiés sont recalculés dans chaque processus : ils ne sont
+    pas partagés par mmap.
+    """
+    name = 'torch-int8'
+
+    def _prepare(self, model):
+        if self.device != 'cpu':
+            logger.warning("La quantification dynamique int8 ne fonctionne que sur CPU")
+            self.device = 'cpu'
+        return self.torch.ao.quantization.quantize_dynamic(
+            model, {self.torch.nn.Linear}, dtype=self.torch.qint8
+        )
+
+
+class OnnxEngine(InferenceEngine):
+    """
+    Session ONNX Runtime sur CPU.
+
+    Le modèle (`model.onnx`) prend `input_ids` et renvoie `logits` ; il est
+    exporté sans cache clé/valeur, toute la séquence est donc réencodée à
+    chaque token.
+    """
+    name = 'onnx'
+
+    def __init__(self, model_path, device='cpu', intra_op_threads=0, inter_op_threads=0):
+        super().__init__(model_path, device, intra_op_threads, inter_op_threads)
+        import onnxruntime as ort
+
+        if device != 'cpu':
+            logger.warning("Moteur onnx : exécution sur CPU (NLP_DEVICE=%s ignoré)", device)
+        path = self.model_path if self.model_path.suffix == '.onnx' else self.model_path / 'model.onnx'
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+
+    def next_token_logits(self, input_ids, state=None):
+        (logits,) = self.session.run(['logits'], {'input_ids': input_ids})
+        return logits[:, -1, :], None
+
+
+ENGINES = {
+    engine.name: engine
+    for engine in (TorchEngine, TorchInt8Engine, OnnxEngine)
+}
+
+
+def create_engine(name: str, model_path: str, device: str = 'cpu',
+                  intra_op_threads: int = 0, inter_op_threads: int = 0) -> InferenceEngine:
+    """
+    Instancie le moteur `name` (`NLP_ENGINE`).
+
+    Raises:
+        ValueError: Moteur inconnu
+    """
+    engine = ENGINES.get(name)
+    if engine is None:
+        raise ValueError(f"Moteur inconnu : {name} (disponibles : {', '.join(ENGINES)})")
+    return engine(model_path, device, intra_op_threads, inter_op_threads)
+
+
+def build_tiny_model(path: str, vocab_size: int = 512, context: int = 256) -> Path:
+    """
+    Crée un petit modèle GPT-2 aléatoire pour comparer les moteurs :
+    poids Transformers (safetensors) et export `model.onnx`.
+
+    Nécessite torch et transformers (et onnx pour l'export).
+    """
+    import torch
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=vocab_size, n_positions=context, n_embd=128, n_layer=2, n_head=4,
+    )
+    model = GPT2LMHeadModel(config).eval()
+    model.save_pretrained(path, safe_serialization=True)
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids):
+            return self.model(input_ids=input_ids, use_cache=False).logits
+
+    dummy = torch.zeros((1, 8), dtype=torch.long)
+    torch.onnx.export(
+        LogitsOnly(model), (dummy,), str(path / 'model.onnx'),
+        input_names=['input_ids'], output_names=['logits'],
+        dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'}, 'logits': {0: 'batch', 1: 'sequence'}},
+        opset_version=17,
+    )
+    return path
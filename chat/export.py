@@ -0,0 +1,274 @@
+"""
+Export et import de l'historique des conversations au format NDJSON.
+
+Un objet JSON par ligne, dans cet ordre :
+
+    {"type": "export", "version": 1, "exported_at": "..."}
+    {"type": "conversation", "id": 12, "user": "alice", "title": "...", "created_at": "...", "updated_at": "..."}
+    ...
+    {"type": "message", "id": 345, "conversation": 12, "role": "user", "content": "...", "created_at": "..."}
+    ...
+
+Les messages des conversations archivées (chat.archive) suivent les autres.
+Toutes les conversations précèdent les messages : l'export enchaîne deux
+lectures par curseur (`.iterator()`), sans jamais charger une conversation
+entière, et l'import n'a besoin de garder que la correspondance des
+identifiants de conversation. La mémoire utilisée ne dépend pas de la taille
+de l'historique. Le flux peut être compressé en gzip au fil de l'eau.
+"""
+
+import gzip
+import json
+import zlib
+from typing import IO, Iterable, Iterator, Optional
+
+from django.contrib.auth import get_user_model
+from django.db import reset_queries, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import embeddings
+from .archive import iter_archived_rows
+from .models import Conversation, ConversationArchive, Message
+from .services import insert_rows, reconcile_conversation_stats
+
+User = get_user_model()
+
+FORMAT_VERSION = 1
+
+# Taille des morceaux envoyés au client (avant compression)
+CHUNK_BYTES = 64 * 1024
+
+
+def _isoformat(value) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def iter_records(user=None, chunk_size: int = 2000) -> Iterator[dict]:
+    """
+    Parcourt l'historique à exporter, enregistrement par enregistrement.
+
+    Args:
+        user: Limiter l'export aux conversations de cet utilisateur (tous sinon)
+        chunk_size: Lignes lues par aller-retour avec la base
+    """
+    conversations = Conversation.objects.order_by('pk')
+    messages = Message.objects.order_by('conversation_id', 'created_at', 'id')
+    archives = ConversationArchive.objects.order_by('pk')
+    if user is not None:
+        conversations = conversations.filter(user=user)
+        messages = messages.filter(conversation__user=user)
+        archives = archives.filter(conversation__user=user)
+
+    yield {'type': 'export', 'version': FORMAT_VERSION, 'exported_at': timezone.now().isoformat()}
+    for pk, username, title, created_at, updated_at in conversations.values_list(
+        'pk', 'user__username', 'title', 'created_at', 'updated_at'
+    ).iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'conversation',
+            'id': pk,
+            'user': username,
+            'title': title,
+            'created_at': _isoformat(created_at),
+            'updated_at': _isoformat(updated_at),
+        }
+    for pk, conversation_id, role, content, created_at in messages.values_list(
+        'pk', 'conversation_id', 'role', 'content', 'created_at'
+    ).iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'message',
+            'id': pk,
+            'conversation': conversation_id,
+            'role': role,
+            'content': content,
+            'created_at': _isoformat(created_at),
+        }
+    # Conversations archivées : un bloc compressé à la fois
+    for conversation_id, codec, data in archives.values_list('pk', 'codec', 'data').iterator(chunk_size=1):
+        for pk, role, content, created_at in iter_archived_rows(codec, data):
+            yield {
+                'type': 'message',
+                'id': pk,
+                'conversation': conversation_id,
+                'role': role,
+                'content': content,
+                'created_at': created_at,
+            }
+
+
+def ndjson_chunks(records: Iterable[dict], chunk_bytes: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """Sérialise les enregistrements en NDJSON, par morceaux d'environ `chunk_bytes` octets."""
+    buffer = []
+    size = 0
+    for record in records:
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compresse un flux d'octets au format gzip, morceau par morceau."""
+    # wbits=31 : en-tête et somme de contrôle gzip (lisible par gunzip)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(user=None, compress: bool = False, chunk_size: int = 2000) -> Iterator[bytes]:
+    """Export complet sous forme d'octets NDJSON (ou gzip), prêt à écrire ou à streamer."""
+    chunks = ndjson_chunks(iter_records(user, chunk_size))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def open_export(path: str) -> IO[bytes]:
+    """Ouvre un fichier d'export, compressé en gzip ou non (détecté par son en-tête)."""
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+
+class _Importer:
+    """État d'un import : lots en attente et correspondance des identifiants."""
+
+    def __init__(self, user, batch_size: int):
+        self.user = user
+        self.batch_size = batch_size
+        self.conversation_ids = {}
+        self.seen = set()
+        self.user_ids = {}
+        self.pending_conversations = []
+        self.pending_messages = []
+        self.messages = 0
+
+    def _user_id(self, username, line_number):
+        if self.user is not None:
+            return self.user.pk
+        if username not in self.user_ids:
+            user_id = User.objects.filter(username=username).values_list('pk', flat=True).first()
+            if user_id is None:
+                raise ValueError(f"Ligne {line_number} : utilisateur inconnu '{username}'.")
+            self.user_ids[username] = user_id
+        return self.user_ids[username]
+
+    def add_conversation(self, record, line_number):
+        if record['id'] in self.seen:
+            raise ValueError(f"Ligne {line_number} : conversation {record['id']} en double.")
+        self.seen.add(record['id'])
+        now = timezone.now()
+        conversation = Conversation(
+            user_id=self._user_id(record.get('user'), line_number),
+            title=record.get('title') or 'Nouvelle conversation',
+            created_at=parse_datetime(record['created_at']) if record.get('created_at') else now,
+            updated_at=parse_datetime(record['updated_at']) if record.get('updated_at') else now,
+        )
+        self.pending_conversations.append((record['id'], conversation))
+        if len(self.pending_conversations) >= self.batch_size:
+            self.flush_conversations()
+
+    def add_message(self, record, line_number):
+        old_id = record['conversation']
+        if old_id not in self.conversation_ids:
+            # Conversation encore dans le lot en attente : il faut son nouvel id
+            self.flush_conversations()
+            if old_id not in self.conversation_ids:
+                raise ValueError(f"Ligne {line_number} : conversation {old_id} inconnue.")
+        if record.get('role') not in ('user', 'assistant'):
+            raise ValueError(f"Ligne {line_number} : rôle invalide {record.get('role')!r}.")
+        self.pending_messages.append(Message(
+            conversation_id=self.conversation_ids[old_id],
+            role=record['role'],
+            content=record.get('content') or '',
+            created_at=parse_datetime(record['created_at']) if record.get('created_at') else timezone.now(),
+        ))
+        if len(self.pending_messages) >= self.batch_size:
+            self.flush_messages()
+
+    def flush_conversations(self):
+        if not self.pending_conversations:
+            return
+        # INSERT brut : les dates de l'export sont écrites telles quelles
+        # (bulk_create les remplacerait par l'heure courante)
+        ids = insert_rows(
+            Conversation, [conversation for _, conversation in self.pending_conversations], returning=True
+        )
+        for (old_id, _), pk in zip(self.pending_conversations, ids):
+            self.conversation_ids[old_id] = pk
+        self.pending_conversations = []
+
+    def flush_messages(self):
+        if not self.pending_messages:
+            return
+        # Aucun signal : vecteurs et résumés sont calculés une seule fois à la
+        # fin de l'import
+        insert_rows(Message, self.pending_messages)
+        self.messages += len(self.pending_messages)
+        self.pending_messages = []
+        # Avec DEBUG, Django garde le texte de chaque requête (ici des Mo par lot)
+        reset_queries()
+
+
+def import_records(lines: Iterable, user=None, batch_size: int = 5000,
+                   index_embeddings: bool = False) -> dict:
+    """
+    Importe un export NDJSON par lots (un INSERT brut par lot, voir
+    `insert_rows`).
+
+    Les conversations reçoivent de nouveaux identifiants ; les dates de
+    l'export sont conservées. L'import se fait dans une seule transaction :
+    en cas d'erreur, rien n'est écrit.
+
+    Args:
+        lines: Lignes NDJSON (octets ou texte), par ex. un fichier ouvert
+        user: Propriétaire de toutes les conversations importées ; sinon
+            l'utilisateur de même nom que dans l'export (qui doit exister)
+        batch_size: Lignes insérées par requête
+        index_embeddings: Calculer ensuite les vecteurs sémantiques des
+            messages importés, par lots (sinon : `manage.py
+            index_message_embeddings`, hors de la transaction de l'import)
+
+    Returns:
+        {'conversations': nombre, 'messages': nombre}
+
+    Raises:
+        ValueError: Ligne invalide, version inconnue ou utilisateur absent
+    """
+    importer = _Importer(user, batch_size)
+    with transaction.atomic():
+        last_message_id = Message.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ValueError(f"Ligne {line_number} : JSON invalide.")
+            kind = record.get('type')
+            try:
+                if kind == 'export':
+                    if record.get('version') != FORMAT_VERSION:
+                        raise ValueError(f"Version d'export non prise en charge : {record.get('version')}.")
+                elif kind == 'conversation':
+                    importer.add_conversation(record, line_number)
+                elif kind == 'message':
+                    importer.add_message(record, line_number)
+                else:
+                    raise ValueError(f"Ligne {line_number} : type d'enregistrement inconnu {kind!r}.")
+            except KeyError as e:
+                raise ValueError(f"Ligne {line_number} : champ {e} manquant.")
+        importer.flush_conversations()
+        importer.flush_messages()
+        if importer.conversation_ids:
+            # Nouveaux identifiants, tous supérieurs au plus petit d'entre eux
+            reconcile_conversation_stats(after_pk=min(importer.conversation_ids.values()) - 1)
+        if index_embeddings:
+            embeddings.index_missing(after_id=last_message_id)
+    return {'conversations': len(importer.conversation_ids), 'messages': importer.messages}
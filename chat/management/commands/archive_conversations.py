@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chat.archive import CODECS, archive_idle_conversations
+
+
+def _megabytes(size):
+    return f"{size / 1e6:.1f} Mo"
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive les messages des conversations inactives en blocs compressés. "
+        "Interruptible : une nouvelle exécution reprend où la précédente s'est arrêtée."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int,
+                            help="Inactivité minimale en jours (CHAT_ARCHIVE_AFTER_DAYS par défaut).")
+        parser.add_argument('--codec', choices=CODECS, help="Compression (CHAT_ARCHIVE_CODEC par défaut).")
+        parser.add_argument('--batch-size', type=int, default=100, help='Conversations sélectionnées par lot.')
+        parser.add_argument('--limit', type=int, help="Nombre maximal de conversations à archiver.")
+        parser.add_argument('--vacuum', action='store_true',
+                            help="SQLite : réduire le fichier de la base après l'archivage (VACUUM).")
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            self.stdout.write(
+                f"  {stats['conversations']} conversation(s), {stats['messages']} message(s), "
+                f"{_megabytes(stats['reclaimed_bytes'])} récupérés (jusqu'à l'id {stats['last_pk']})"
+            )
+
+        try:
+            stats = archive_idle_conversations(
+                older_than_days=options['older_than_days'],
+                codec=options['codec'],
+                batch_size=options['batch_size'],
+                limit=options['limit'],
+                progress=progress if options['verbosity'] > 1 else None,
+            )
+        except ImportError as e:
+            raise CommandError(f"Codec indisponible ({e}) : pip install zstandard, ou --codec zlib.")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        ratio = stats['stored_bytes'] / stats['raw_bytes'] if stats['raw_bytes'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['conversations']} conversation(s) archivée(s), {stats['messages']} message(s) : "
+            f"{_megabytes(stats['raw_bytes'])} -> {_megabytes(stats['stored_bytes'])} "
+            f"({ratio:.0%}), {_megabytes(stats['reclaimed_bytes'])} récupérés."
+        ))
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                if options['vacuum']:
+                    cursor.execute('VACUUM')
+                cursor.execute('PRAGMA freelist_count')
+                free_pages = cursor.fetchone()[0]
+                cursor.execute('PRAGMA page_size')
+                page_size = cursor.fetchone()[0]
+            # Pages libérées : réutilisées par les prochaines écritures, le
+            # fichier ne rétrécit qu'avec VACUUM
+            self.stdout.write(f"Espace libre dans le fichier SQLite : {_megabytes(free_pages * page_size)}.")
@@ -0,0 +1,136 @@
+import json
+import os
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.benchmark import (
+    build_plan, compare, install_stub_model, median_summary, parse_mix, run_plan, seed, summarize,
+    temporary_database,
+)
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / 'benchmark_baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Banc de charge de l'API de chat sur une base temporaire : débit, p50/p95/p99 "
+        "et requêtes SQL par scénario, comparés à une référence."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--conversations', type=int, default=5, help='Conversations par utilisateur.')
+        parser.add_argument('--messages', type=int, default=20, help='Messages par conversation.')
+        parser.add_argument('--heavy-users', type=int, default=1,
+                            help='Utilisateurs ayant en plus une très longue conversation.')
+        parser.add_argument('--heavy-messages', type=int, default=10000)
+        parser.add_argument('--heavy-share', type=float, default=0.2,
+                            help='Part des requêtes authentifiées visant une longue conversation.')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Passes du même plan ; chaque statistique est la médiane des passes.')
+        parser.add_argument('--mix', help='Poids des scénarios, par ex. ask=30,conversations=20.')
+        parser.add_argument('--model-latency-ms', type=float, default=20)
+        parser.add_argument('--model-jitter-ms', type=float, default=0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Enregistrer ce résultat comme nouvelle référence.')
+        parser.add_argument('--no-compare', action='store_true')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Écart relatif toléré sur le p50 et le débit (le double sur le p95).')
+        parser.add_argument('--json', dest='json_output', help='Écrire le résultat complet dans ce fichier.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        # Mesure de l'application seule : pas de limitation de débit, de cache
+        # de réponses, de serveur de modèle ni d'écritures différées
+        os.environ.update({
+            'RATE_LIMIT_BACKEND': 'none',
+            'NLP_CACHE_BACKEND': 'none',
+            'NLP_SERVER_SOCKET': '',
+            'NLP_BATCHING': 'False',
+            'CHAT_WRITE_BEHIND': 'False',
+        })
+        config = {
+            key: options[key] for key in (
+                'users', 'conversations', 'messages', 'heavy_users', 'heavy_messages',
+                'heavy_share', 'requests', 'warmup', 'concurrency', 'repeat', 'model_latency_ms',
+                'model_jitter_ms', 'seed',
+            )
+        }
+        config['mix'] = mix
+
+        with temporary_database():
+            summary = self._run(options, mix)
+
+        summary['config'] = config
+        self._report(summary)
+        if options['json_output']:
+            Path(options['json_output']).write_text(json.dumps(summary, indent=2, ensure_ascii=False))
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.write_text(json.dumps(summary, indent=2, ensure_ascii=False) + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Référence enregistrée : {baseline_path}"))
+            return
+        if options['no_compare']:
+            return
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f"Pas de référence ({baseline_path}) : --save-baseline pour en créer une."))
+            return
+
+        baseline = json.loads(baseline_path.read_text())
+        if baseline.get('config') != config:
+            self.stdout.write(self.style.WARNING(
+                "Configuration différente de celle de la référence : comparaison indicative."
+            ))
+        regressions = compare(summary, baseline, tolerance=options['tolerance'])
+        if regressions:
+            raise CommandError("Régressions par rapport à la référence :\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("Aucune régression par rapport à la référence."))
+
+    def _run(self, options, mix):
+        start = time.perf_counter()
+        fixtures = seed(
+            users=options['users'],
+            conversations=options['conversations'],
+            messages=options['messages'],
+            heavy_users=options['heavy_users'],
+            heavy_messages=options['heavy_messages'],
+            random_seed=options['seed'],
+        )
+        self.stdout.write(f"Données créées en {time.perf_counter() - start:.1f}s")
+
+        install_stub_model(
+            options['model_latency_ms'] / 1000, options['model_jitter_ms'] / 1000, options['seed']
+        )
+        plan = build_plan(
+            fixtures, mix, options['requests'] + options['warmup'],
+            heavy_share=options['heavy_share'], random_seed=options['seed'],
+        )
+        return median_summary([
+            summarize(run_plan(plan, options['concurrency'], options['warmup']))
+            for _ in range(max(1, options['repeat']))
+        ])
+
+    def _report(self, summary):
+        self.stdout.write(
+            f"{summary['requests']} requêtes, {summary['throughput']} req/s"
+        )
+        self.stdout.write(
+            f"{'scénario':<16} {'n':>5} {'erreurs':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'SQL/req':>8}"
+        )
+        for name, row in summary['scenarios'].items():
+            self.stdout.write(
+                f"{name:<16} {row['count']:>5} {row['errors']:>8} {row['p50']:>9.1f} "
+                f"{row['p95']:>9.1f} {row['p99']:>9.1f} {row['queries']:>8.2f}"
+            )
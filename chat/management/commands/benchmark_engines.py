@@ -0,0 +1,83 @@
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.engines import ENGINES, build_tiny_model, create_engine
+
+
+class Command(BaseCommand):
+    help = "Compare la latence et le débit des moteurs d'inférence sur cette machine."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            help='Dossier du modèle (par défaut : petit modèle de test généré).',
+        )
+        parser.add_argument('--engines', default=','.join(ENGINES))
+        parser.add_argument('--prompt-tokens', type=int, default=64)
+        parser.add_argument('--new-tokens', type=int, default=32)
+        parser.add_argument('--batch-size', type=int, default=8)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--threads', type=int, default=0, help='Threads intra-op (0 = défaut).')
+        parser.add_argument('--inter-op-threads', type=int, default=0)
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['engines'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in ENGINES]
+        if unknown:
+            raise CommandError(f"Moteurs inconnus : {', '.join(unknown)}")
+
+        with tempfile.TemporaryDirectory() as directory:
+            model_path = options['model']
+            if not model_path:
+                try:
+                    model_path = str(build_tiny_model(directory))
+                except ImportError as e:
+                    raise CommandError(f"Le modèle de test nécessite torch et transformers ({e}) ; utilisez --model.")
+            self.stdout.write(f"Modèle : {model_path}")
+            self.stdout.write(
+                f"{'moteur':<12} {'chargement':>11} {'p50 (ms)':>10} {'p95 (ms)':>10} {'tokens/s':>10} {'lot tok/s':>10}"
+            )
+            for name in names:
+                self._benchmark(name, model_path, options)
+
+    def _benchmark(self, name, model_path, options):
+        start = time.perf_counter()
+        try:
+            engine = create_engine(
+                name, model_path,
+                intra_op_threads=options['threads'],
+                inter_op_threads=options['inter_op_threads'],
+            )
+        except Exception as e:
+            self.stdout.write(f"{name:<12} ignoré : {e}")
+            return
+        load_seconds = time.perf_counter() - start
+
+        rng = np.random.default_rng(0)
+        vocab_size = engine.next_token_logits(np.zeros((1, 1), dtype=np.int64))[0].shape[-1]
+        prompt = rng.integers(0, vocab_size, options['prompt_tokens']).tolist()
+        new_tokens = options['new_tokens']
+
+        # Préchauffage, puis latence d'une requête isolée
+        engine.generate(prompt, new_tokens)
+        latencies = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            engine.generate(prompt, new_tokens)
+            latencies.append(time.perf_counter() - start)
+        latencies_ms = np.array(latencies) * 1000
+
+        # Débit d'un lot de requêtes traitées ensemble
+        batch = rng.integers(0, vocab_size, (options['batch_size'], options['prompt_tokens']))
+        start = time.perf_counter()
+        engine.generate_batch(batch, new_tokens)
+        batch_seconds = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{name:<12} {load_seconds:>10.2f}s {np.percentile(latencies_ms, 50):>10.1f} "
+            f"{np.percentile(latencies_ms, 95):>10.1f} {new_tokens / np.median(latencies):>10.1f} "
+            f"{batch.shape[0] * new_tokens / batch_seconds:>10.1f}"
+        )
@@ -0,0 +1,45 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.benchmark import orjson_available, serialization_benchmark, temporary_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare, sur une base temporaire, les serializers DRF au chemin rapide "
+        "(.values_list) et au renderer orjson, pour plusieurs tailles de conversation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Nombres de messages (et de conversations pour la liste).')
+        parser.add_argument('--repeat', type=int, default=5, help='Mesures par cas (médiane).')
+        parser.add_argument('--json', dest='json_output', help='Écrire les résultats dans ce fichier.')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError(f"--sizes invalide : {options['sizes']}")
+
+        with temporary_database():
+            results = serialization_benchmark(sizes, repeat=max(1, options['repeat']))
+
+        if not orjson_available():
+            self.stdout.write(self.style.WARNING("orjson absent : FastJSONRenderer utilise json."))
+        self.stdout.write(
+            f"{'scénario':<10} {'taille':>7} {'DRF (ms)':>10} {'rapide (ms)':>12} "
+            f"{'+ orjson (ms)':>14} {'gain':>6}  sortie"
+        )
+        for row in results:
+            self.stdout.write(
+                f"{row['scenario']:<10} {row['size']:>7} {row['drf']:>10.1f} {row['fast']:>12.1f} "
+                f"{row['fast_orjson']:>14.1f} {row['speedup']:>5.1f}x  "
+                f"{'identique' if row['identical'] else 'DIFFÉRENTE'}"
+            )
+        if options['json_output']:
+            Path(options['json_output']).write_text(json.dumps(results, indent=2))
+        if not all(row['identical'] for row in results):
+            raise CommandError("Le chemin rapide ne produit pas la même sortie que les serializers DRF.")
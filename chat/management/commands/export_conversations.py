@@ -0,0 +1,41 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import export_chunks
+
+
+class Command(BaseCommand):
+    help = "Exporte l'historique des conversations en NDJSON (gzip si le fichier finit par .gz)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Fichier de sortie, ou '-' pour la sortie standard.")
+        parser.add_argument('--user', help="N'exporter que les conversations de cet utilisateur.")
+        parser.add_argument('--gzip', action='store_true', help='Compresser (implicite pour un fichier .gz).')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Lignes lues par aller-retour avec la base.')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(username=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Utilisateur inconnu : {options['user']}")
+
+        output = options['output']
+        compress = options['gzip'] or output.endswith('.gz')
+        chunks = export_chunks(user, compress=compress, chunk_size=options['chunk_size'])
+        size = 0
+        if output == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+                size += len(chunk)
+            sys.stdout.buffer.flush()
+            return
+        with open(output, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Export écrit dans {output} ({size / 1e6:.1f} Mo)."))
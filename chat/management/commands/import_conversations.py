@@ -0,0 +1,40 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import import_records, open_export
+
+
+class Command(BaseCommand):
+    help = "Importe un export NDJSON (gzip ou non) de conversations, par lots."
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Fichier produit par export_conversations.')
+        parser.add_argument('--user', help="Attribuer toutes les conversations à cet utilisateur.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--index-embeddings', action='store_true',
+                            help='Calculer aussi les vecteurs des messages importés '
+                                 '(sinon : index_message_embeddings ensuite).')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(username=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Utilisateur inconnu : {options['user']}")
+
+        start = time.perf_counter()
+        try:
+            with open_export(options['input']) as f:
+                result = import_records(
+                    f, user=user, batch_size=options['batch_size'],
+                    index_embeddings=options['index_embeddings'],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['conversations']} conversation(s) et {result['messages']} message(s) "
+            f"importé(s) en {time.perf_counter() - start:.1f}s."
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from chat.embeddings import index_missing
+from chat.models import MessageEmbedding
+
+
+class Command(BaseCommand):
+    help = "Calcule les vecteurs sémantiques des messages qui n'en ont pas encore."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recalcule tous les vecteurs (après un changement d\'encodeur).',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            MessageEmbedding.objects.all().delete()
+        indexed = index_missing(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{indexed} message(s) indexé(s)."))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.weights import child_pids, process_memory
+
+
+def _mb(size):
+    return f"{size / 1e6:.1f}"
+
+
+class Command(BaseCommand):
+    help = "Affiche la mémoire (RSS/PSS) de chaque worker, pour vérifier le partage des poids."
+
+    def add_arguments(self, parser):
+        parser.add_argument('pids', nargs='*', type=int, help='Processus à mesurer.')
+        parser.add_argument(
+            '--master',
+            type=int,
+            help='PID du maître (gunicorn) : mesure ses workers.',
+        )
+
+    def handle(self, *args, **options):
+        pids = list(options['pids'])
+        if options['master']:
+            pids.append(options['master'])
+            pids.extend(child_pids(options['master']))
+        if not pids:
+            raise CommandError("Indiquez des PID ou --master.")
+
+        self.stdout.write(f"{'PID':>8} {'RSS (Mo)':>10} {'PSS (Mo)':>10} {'partagé':>10} {'privé':>10}")
+        total_rss = total_pss = 0
+        for pid in pids:
+            memory = process_memory(pid)
+            if memory is None:
+                self.stderr.write(f"{pid:>8} illisible (/proc indisponible ?)")
+                continue
+            total_rss += memory['rss']
+            total_pss += memory['pss']
+            self.stdout.write(
+                f"{pid:>8} {_mb(memory['rss']):>10} {_mb(memory['pss']):>10} "
+                f"{_mb(memory['shared']):>10} {_mb(memory['private']):>10}"
+            )
+        # La somme des PSS est le coût réel ; celle des RSS compte les pages partagées plusieurs fois
+        self.stdout.write(f"{'total':>8} {_mb(total_rss):>10} {_mb(total_pss):>10}")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chat.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Reconstruit l'index de recherche plein texte des messages."
+
+    def handle(self, *args, **options):
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Index de recherche reconstruit."))
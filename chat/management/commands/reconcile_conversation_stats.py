@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from chat.services import reconcile_conversation_stats
+
+
+class Command(BaseCommand):
+    help = "Recalcule le nombre de messages et le dernier message de chaque conversation."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Nombre de conversations traitées par lot",
+        )
+
+    def handle(self, *args, **options):
+        checked, fixed = reconcile_conversation_stats(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{checked} conversation(s) vérifiée(s), {fixed} corrigée(s)."
+        ))
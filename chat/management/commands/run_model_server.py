@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from cocoja.env_loader import get_env
+from chat.model_server import ModelServer, get_authkey
+
+
+class Command(BaseCommand):
+    help = "Démarre le serveur de modèle partagé par les workers web (socket Unix)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            default=get_env('NLP_SERVER_SOCKET', '/tmp/cocoja-nlp.sock'),
+            help="Chemin de la socket Unix (défaut : NLP_SERVER_SOCKET)",
+        )
+        parser.add_argument(
+            '--replicas',
+            type=int,
+            default=get_env('NLP_SERVER_REPLICAS', 1, int),
+            help="Nombre de processus réplicas du modèle",
+        )
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=get_env('NLP_SERVER_QUEUE_SIZE', 64, int),
+            help="Requêtes en attente maximum avant de répondre 'busy'",
+        )
+
+    def handle(self, *args, **options):
+        server = ModelServer(
+            options['socket'],
+            replicas=options['replicas'],
+            queue_size=options['queue_size'],
+            authkey=get_authkey(),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Serveur de modèle sur {options['socket']} ({options['replicas']} réplica(s))"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Arrêt du serveur de modèle.")
@@ -0,0 +1,441 @@
+"""
+Instrumentation légère : durée des étapes, requêtes SQL et débit du modèle.
+
+Activée par `METRICS_ENABLED`. Désactivée, chaque point de mesure se réduit
+à un test sur un booléen du module (`stage()` renvoie un gestionnaire de
+contexte vide partagé).
+
+Chaque processus (workers web, réplicas du serveur de modèle) accumule ses
+mesures en mémoire et les recopie au plus toutes les `METRICS_FLUSH_INTERVAL`
+secondes dans un fichier SQLite partagé (`METRICS_PATH`). L'endpoint
+`/metrics` additionne les instantanés de tous les processus et les expose au
+format texte de Prometheus. Les instantanés des processus terminés sont
+repliés dans une ligne `retired` : les compteurs ne reculent pas quand un
+worker redémarre et la table ne grossit pas.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection
+from django.utils.deprecation import MiddlewareMixin
+
+from cocoja.env_loader import get_env
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# nom -> (type, description, bornes des histogrammes)
+FAMILIES = {
+    'cocoja_request_seconds': (
+        'histogram', "Durée des requêtes HTTP (jusqu'aux en-têtes pour un flux)", LATENCY_BUCKETS),
+    'cocoja_stage_seconds': (
+        'histogram', "Durée des étapes du traitement d'une question", LATENCY_BUCKETS),
+    'cocoja_db_queries_per_request': (
+        'histogram', 'Requêtes SQL par requête HTTP', COUNT_BUCKETS),
+    'cocoja_db_seconds_per_request': (
+        'histogram', 'Temps SQL cumulé par requête HTTP', LATENCY_BUCKETS),
+    'cocoja_model_tokens_total': (
+        'counter', 'Tokens générés par le modèle', None),
+    'cocoja_model_generation_seconds_total': (
+        'counter', 'Temps passé à générer des tokens', None),
+    'cocoja_model_tokens_per_second': (
+        'histogram', 'Débit de chaque génération en tokens par seconde', RATE_BUCKETS),
+}
+
+enabled = get_env('METRICS_ENABLED', False, bool)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Ligne du fichier partagé qui cumule les mesures des processus terminés
+RETIRED = 'retired'
+
+
+class Registry:
+    """
+    Compteurs et histogrammes d'un processus.
+
+    Un histogramme garde le nombre d'observations par intervalle (le dernier
+    pour +Inf), leur somme et leur nombre ; les cumuls sont calculés à l'export.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+        self.dirty = False
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+            self.dirty = True
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = FAMILIES[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+            self.dirty = True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self.dirty = False
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, list(labels), list(counts), total, count]
+                    for (name, labels), (counts, total, count) in self._histograms.items()
+                ],
+            }
+
+
+class MetricsStore:
+    """Instantanés des processus, une ligne par processus, dans un fichier SQLite."""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metric_snapshots ("
+                " process TEXT PRIMARY KEY, pid INTEGER NOT NULL,"
+                " data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def write(self, process: str, snapshot: dict):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO metric_snapshots VALUES (?, ?, ?, ?)",
+                (process, os.getpid(), json.dumps(snapshot), time.time()),
+            )
+
+    def prune(self) -> int:
+        """
+        Replie les instantanés des processus terminés dans la ligne `retired`
+        puis les supprime, dans une seule transaction d'écriture : deux
+        processus qui élaguent en même temps ne comptent pas deux fois.
+
+        Returns:
+            Nombre d'instantanés repliés
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT process, pid, data FROM metric_snapshots").fetchall()
+            dead = [(process, data) for process, pid, data in rows if process != RETIRED and not _pid_alive(pid)]
+            if dead:
+                retired = [json.loads(data) for process, _, data in rows if process == RETIRED]
+                merged = merge_snapshots(retired + [json.loads(data) for _, data in dead])
+                conn.execute(
+                    "INSERT OR REPLACE INTO metric_snapshots VALUES (?, 0, ?, ?)",
+                    (RETIRED, json.dumps(merged), time.time()),
+                )
+                conn.executemany("DELETE FROM metric_snapshots WHERE process = ?", [(p,) for p, _ in dead])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return len(dead)
+
+    def read(self) -> List[dict]:
+        rows = self._connection().execute("SELECT data FROM metric_snapshots").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM metric_snapshots")
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Processus d'un autre utilisateur : il existe
+        return True
+    return True
+
+
+registry = Registry()
+_process_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+_flusher: Optional[threading.Thread] = None
+_flusher_lock = threading.Lock()
+_store: Optional[MetricsStore] = None
+_store_lock = threading.Lock()
+
+
+def get_metrics_store() -> MetricsStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                default_path = Path(__file__).resolve().parent.parent / 'metrics.sqlite3'
+                _store = MetricsStore(get_env('METRICS_PATH', str(default_path)))
+    return _store
+
+
+def flush():
+    """Recopie les mesures du processus dans le fichier partagé."""
+    get_metrics_store().write(_process_id, registry.snapshot())
+
+
+def _flush_periodically():
+    interval = get_env('METRICS_FLUSH_INTERVAL', 5, float)
+    while True:
+        time.sleep(interval)
+        if registry.dirty:
+            try:
+                flush()
+            except sqlite3.Error:
+                pass
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _flusher_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_periodically, name='metrics-flush', daemon=True)
+                _flusher.start()
+
+
+def _reset_after_fork():
+    # Le fils repart de zéro : sinon les mesures du parent seraient comptées deux fois
+    global registry, _process_id, _flusher, _flusher_lock
+    registry = Registry()
+    _process_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    _flusher = None
+    _flusher_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    if not enabled:
+        return
+    _ensure_flusher()
+    registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    if not enabled:
+        return
+    _ensure_flusher()
+    registry.observe(name, value, **labels)
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe('cocoja_stage_seconds', time.perf_counter() - self.start, stage=self.name)
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    """`with metrics.stage('history'):` mesure la durée d'une étape."""
+    return _Stage(name) if enabled else _NO_STAGE
+
+
+def observe_auth(request):
+    """
+    Étape `auth` : temps écoulé entre l'appel de la vue et le début de son
+    corps (authentification, permissions et throttling de DRF).
+    """
+    if not enabled:
+        return
+    start = getattr(getattr(request, '_request', request), '_metrics_view_start', None)
+    if start is not None:
+        observe('cocoja_stage_seconds', time.perf_counter() - start, stage='auth')
+
+
+def record_generation(engine: str, tokens: int, seconds: float):
+    """Débit du modèle pour une génération."""
+    if not enabled or seconds <= 0:
+        return
+    inc('cocoja_model_tokens_total', tokens, engine=engine)
+    inc('cocoja_model_generation_seconds_total', seconds, engine=engine)
+    observe('cocoja_model_tokens_per_second', tokens / seconds, engine=engine)
+
+
+class _QueryRecorder:
+    """`execute_wrapper` qui compte les requêtes SQL et leur durée."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Durée totale et requêtes SQL de chaque requête HTTP, par vue ; étape
+    `render` pour les réponses DRF (rendues après la vue).
+    """
+
+    def process_request(self, request):
+        if not enabled:
+            return
+        request._metrics_start = time.perf_counter()
+        request._metrics_queries = _QueryRecorder()
+        connection.execute_wrappers.append(request._metrics_queries)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if enabled:
+            request._metrics_view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        if enabled:
+            start = time.perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: observe('cocoja_stage_seconds', time.perf_counter() - start, stage='render')
+            )
+        return response
+
+    def process_response(self, request, response):
+        queries = getattr(request, '_metrics_queries', None)
+        if queries is None:
+            return response
+        if queries in connection.execute_wrappers:
+            connection.execute_wrappers.remove(queries)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        observe(
+            'cocoja_request_seconds', time.perf_counter() - request._metrics_start,
+            view=view, method=request.method, status=str(response.status_code),
+        )
+        observe('cocoja_db_queries_per_request', queries.count, view=view)
+        observe('cocoja_db_seconds_per_request', queries.seconds, view=view)
+        return response
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _merge(snapshots: List[dict]) -> Tuple[Dict[tuple, float], Dict[tuple, list]]:
+    counters: Dict[tuple, float] = {}
+    histograms: Dict[tuple, list] = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get('counters', []):
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, counts, total, count in snapshot.get('histograms', []):
+            if name not in FAMILIES or len(counts) != len(FAMILIES[name][2]) + 1:
+                continue
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+def merge_snapshots(snapshots: List[dict]) -> dict:
+    """Additionne des instantanés ; le résultat a le format de `Registry.snapshot()`."""
+    counters, histograms = _merge(snapshots)
+    return {
+        'counters': [[name, [list(pair) for pair in labels], value] for (name, labels), value in counters.items()],
+        'histograms': [
+            [name, [list(pair) for pair in labels], counts, total, count]
+            for (name, labels), (counts, total, count) in histograms.items()
+        ],
+    }
+
+
+def render_prometheus(snapshots: List[dict]) -> str:
+    """Additionne les instantanés des processus et les formate pour Prometheus."""
+    counters, histograms = _merge(snapshots)
+    lines = []
+    for name, (kind, description, buckets) in FAMILIES.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (series, labels), value in sorted(counters.items()):
+                if series == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+            continue
+        for (series, labels), (counts, total, count) in sorted(histograms.items()):
+            if series != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else _format_number(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def export() -> str:
+    """Texte de `/metrics` : mesures de tous les processus."""
+    store = get_metrics_store()
+    flush()
+    store.prune()
+    return render_prometheus(store.read())
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.11 on 2026-10-17 19:47
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
+
+
+def backfill_summary(apps, schema_editor):
+    # Modèles historiques uniquement : le code de chat.services évolue avec
+    # les modèles actuels, cette migration doit rester figée
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    db_alias = schema_editor.connection.alias
+
+    messages = Message.objects.using(db_alias).filter(conversation=OuterRef('pk')).order_by('-created_at', '-id')
+    count = messages.order_by().values('conversation').annotate(total=Count('pk')).values('total')
+    Conversation.objects.using(db_alias).update(
+        message_count=Coalesce(Subquery(count), 0),
+        last_message_at=Subquery(messages.values('created_at')[:1]),
+        last_message_role=Coalesce(Subquery(messages.values('role')[:1]), Value('')),
+        last_message_preview=Coalesce(
+            Subquery(messages.annotate(preview=Substr('content', 1, 100)).values('preview')[:1]), Value('')
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_context_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_role',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_summary, migrations.RunPython.noop),
+    ]
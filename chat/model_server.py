@@ -0,0 +1,501 @@
+"""
+Serveur de modèle hors processus et client IPC associé.
+
+Les workers web n'ont plus à charger chacun une copie des poids : un serveur
+(`python manage.py run_model_server`) démarre N réplicas du modèle et les
+expose sur une socket Unix. `generate_ai_response` devient alors un client
+léger (pool de connexions, timeouts, contre-pression).
+
+Protocole (objets picklés via `multiprocessing.connection`) :
+    requête : {'op': 'generate' | 'stream' | 'ping' | 'invalidate', 'user_input': ..., ...}
+    réponse : {'ok': True, 'response': ...}
+              {'ok': True, 'chunk': ...} (répété) puis {'ok': True, 'done': True}
+              {'ok': True, 'replicas': n} (ping : réplicas vivants)
+              {'ok': False, 'error': ..., 'busy': bool}
+
+Les connexions sont authentifiées par `NLP_SERVER_AUTHKEY`, obligatoire : une
+socket Unix accessible en écriture suffirait sinon à faire exécuter des
+objets picklés par le serveur.
+"""
+
+import logging
+import os
+import queue
+import threading
+from multiprocessing import AuthenticationError, Pipe, Process
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Iterator, List, Optional
+
+from django.core.exceptions import ImproperlyConfigured
+
+from cocoja.env_loader import get_env
+
+logger = logging.getLogger(__name__)
+
+
+class ModelServerError(Exception):
+    """Erreur de communication avec le serveur de modèle."""
+
+
+class ModelServerBusy(ModelServerError):
+    """Le serveur (ou le pool de connexions) est saturé."""
+
+
+class ModelServerTimeout(ModelServerError):
+    """Le serveur n'a pas répondu dans le délai imparti."""
+
+
+def _replica_main(conn: Connection):
+    """
+    Boucle d'un réplica : charge le modèle puis traite les jobs un par un.
+
+    Le réplica a son propre canal avec le serveur : il y reçoit les jobs et
+    les invalidations de préfixe (appliquées avant le job suivant) et y
+    renvoie les réponses.
+    """
+    from .nlp_model import get_nlp_model
+
+    model = get_nlp_model()
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request['op'] == 'invalidate':
+            model.prefix_cache.invalidate(request['conversation_id'])
+            continue
+        try:
+            if request['op'] == 'stream':
+                for chunk in model.generate_response_stream(
+                    request['user_input'],
+                    request.get('conversation_history'),
+                    request.get('max_length', 512),
+                    request.get('temperature', 0.7),
+                    request.get('conversation_id'),
+                ):
+                    conn.send({'ok': True, 'chunk': chunk})
+                conn.send({'ok': True, 'done': True})
+            else:
+                response = model.generate_response(
+                    request['user_input'],
+                    request.get('conversation_history'),
+                    request.get('max_length', 512),
+                    request.get('temperature', 0.7),
+                    request.get('conversation_id'),
+                )
+                conn.send({'ok': True, 'response': response})
+        except Exception as e:
+            conn.send({'ok': False, 'error': str(e)})
+
+
+class _Replica:
+    """Processus réplica et son canal ; `lock` protège les envois."""
+
+    def __init__(self):
+        self.conn, child = Pipe()
+        self.lock = threading.Lock()
+        self.process = Process(target=_replica_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def send(self, request: dict):
+        with self.lock:
+            self.conn.send(request)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ModelServer:
+    """
+    Serveur de modèle : une socket Unix devant un pool de réplicas.
+
+    Chaque connexion cliente est servie par un thread qui dépose les requêtes
+    dans une file partagée. Si la file est pleine, la requête est refusée
+    immédiatement (`busy`) plutôt que mise en attente. Un thread par réplica
+    prend les jobs dans cette file, un à la fois, et relaie les réponses.
+
+    Ce même thread supervise son réplica : s'il meurt (plantage, OOM killer),
+    le job en cours reçoit une erreur au lieu de laisser son client attendre
+    le timeout, et le réplica est relancé. La vérification a lieu toutes les
+    `supervise_interval` secondes.
+    """
+
+    def __init__(self, socket_path: str, replicas: int = 1, queue_size: int = 64,
+                 authkey: Optional[bytes] = None, supervise_interval: float = 1):
+        if not authkey:
+            raise ImproperlyConfigured("Le serveur de modèle exige une clé d'authentification.")
+        self.socket_path = socket_path
+        self.replicas = max(1, replicas)
+        self.authkey = authkey
+        self.supervise_interval = supervise_interval
+        self.restarts = 0
+        self._jobs: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._replicas: List[Optional[_Replica]] = [None] * self.replicas
+        self._replicas_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def serve_forever(self):
+        """Démarre les réplicas et accepte les connexions jusqu'à `shutdown`."""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        with self._replicas_lock:
+            for index in range(self.replicas):
+                self._replicas[index] = _Replica()
+        for index in range(self.replicas):
+            threading.Thread(
+                target=self._run_replica, args=(index,), name=f'model-server-replica-{index}', daemon=True
+            ).start()
+
+        listener = Listener(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+        logger.info("Serveur de modèle prêt sur %s (%d réplica(s))", self.socket_path, self.replicas)
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    if not self._stop.is_set():
+                        logger.warning("Connexion refusée : %s", e)
+                    continue
+                if self._stop.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            self.shutdown()
+
+    def shutdown(self):
+        """Arrête les réplicas et supprime la socket."""
+        if not self._stop.is_set():
+            self._stop.set()
+            # Réveille `accept()`, bloquant
+            try:
+                Client(self.socket_path, family='AF_UNIX', authkey=self.authkey).close()
+            except (OSError, EOFError, AuthenticationError):
+                pass
+        with self._replicas_lock:
+            replicas, self._replicas = self._replicas, [None] * self.replicas
+        for replica in replicas:
+            if replica is not None:
+                replica.stop()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def alive_replicas(self) -> int:
+        """Nombre de réplicas en vie."""
+        with self._replicas_lock:
+            return sum(replica is not None and replica.process.is_alive() for replica in self._replicas)
+
+    def _restart(self, index: int, replica: _Replica) -> Optional[_Replica]:
+        if self._stop.is_set():
+            # Arrêté par `shutdown`
+            return None
+        logger.error("Réplica %d arrêté (code %s), redémarrage", index, replica.process.exitcode)
+        replica.stop()
+        with self._replicas_lock:
+            if self._stop.is_set():
+                return None
+            self._replicas[index] = _Replica()
+            self.restarts += 1
+            return self._replicas[index]
+
+    def _run_replica(self, index: int):
+        """Donne les jobs au réplica `index` un par un et le relance s'il meurt."""
+        with self._replicas_lock:
+            replica = self._replicas[index]
+        while replica is not None and not self._stop.is_set():
+            try:
+                request, inbox = self._jobs.get(timeout=self.supervise_interval)
+            except queue.Empty:
+                if not replica.process.is_alive():
+                    replica = self._restart(index, replica)
+                continue
+            try:
+                replica.send(request)
+                while True:
+                    if not replica.conn.poll(self.supervise_interval):
+                        if replica.process.is_alive():
+                            continue
+                        raise EOFError
+                    reply = replica.conn.recv()
+                    inbox.put(reply)
+                    if 'chunk' not in reply:
+                        break
+            except (EOFError, OSError):
+                if self._stop.is_set():
+                    break
+                inbox.put({'ok': False, 'error': 'Réplica du modèle arrêté pendant la génération.'})
+                replica = self._restart(index, replica)
+
+    def _serve_connection(self, conn: Connection):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    break
+
+                if request.get('op') == 'ping':
+                    conn.send({'ok': True, 'replicas': self.alive_replicas()})
+                    continue
+
+                if request.get('op') == 'invalidate':
+                    # Chaque réplica a son propre cache de préfixe
+                    with self._replicas_lock:
+                        replicas = list(self._replicas)
+                    for replica in replicas:
+                        if replica is not None:
+                            try:
+                                replica.send({'op': 'invalidate', 'conversation_id': request['conversation_id']})
+                            except OSError:
+                                pass
+                    conn.send({'ok': True})
+                    continue
+
+                inbox: queue.Queue = queue.Queue()
+                try:
+                    self._jobs.put_nowait((request, inbox))
+                except queue.Full:
+                    conn.send({'ok': False, 'busy': True, 'error': 'Serveur de modèle saturé.'})
+                    continue
+                if not self._relay(conn, inbox):
+                    break
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _relay(self, conn: Connection, inbox: queue.Queue) -> bool:
+        """
+        Transmet les réponses d'un job au client.
+
+        Si le client est parti, on continue à vider les réponses du job
+        jusqu'à la fin pour ne pas laisser de résultats orphelins.
+
+        Returns:
+            False si le client s'est déconnecté en cours de route
+        """
+        client_alive = True
+        while True:
+            reply = inbox.get()
+            if client_alive:
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    client_alive = False
+            if 'chunk' not in reply:
+                return client_alive
+
+
+class ModelClient:
+    """
+    Client du serveur de modèle avec pool de connexions.
+
+    Au plus `pool_size` requêtes sont en vol simultanément ; au-delà, on attend
+    une connexion libre pendant `acquire_timeout` secondes avant de lever
+    `ModelServerBusy`. `ping` passe par sa propre connexion, hors du pool,
+    avec un délai court (`ping_timeout`).
+    """
+
+    def __init__(self, socket_path: str, pool_size: int = 8, timeout: float = 60,
+                 acquire_timeout: float = 5, authkey: Optional[bytes] = None,
+                 ping_timeout: float = 1):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.authkey = authkey
+        self.ping_timeout = ping_timeout
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle: List[Connection] = []
+        self._idle_lock = threading.Lock()
+        self._ping_thread: Optional[threading.Thread] = None
+        self._ping_lock = threading.Lock()
+
+    def generate(self, user_input: str, conversation_history: Optional[list] = None,
+                 max_length: int = 512, temperature: float = 0.7,
+                 conversation_id: Optional[int] = None) -> str:
+        """Génère une réponse complète via le serveur."""
+        request = {
+            'op': 'generate',
+            'user_input': user_input,
+            'conversation_history': conversation_history,
+            'max_length': max_length,
+            'temperature': temperature,
+            'conversation_id': conversation_id,
+        }
+        conn = self._checkout()
+        try:
+            self._send(conn, request)
+            reply = self._recv(conn)
+        except BaseException:
+            self._discard(conn)
+            raise
+        self._checkin(conn)
+        return reply['response']
+
+    def generate_stream(self, user_input: str, conversation_history: Optional[list] = None,
+                        max_length: int = 512, temperature: float = 0.7,
+                        conversation_id: Optional[int] = None) -> Iterator[str]:
+        """Génère une réponse en streaming via le serveur."""
+        request = {
+            'op': 'stream',
+            'user_input': user_input,
+            'conversation_history': conversation_history,
+            'max_length': max_length,
+            'temperature': temperature,
+            'conversation_id': conversation_id,
+        }
+        conn = self._checkout()
+        try:
+            self._send(conn, request)
+            while True:
+                reply = self._recv(conn)
+                if reply.get('done'):
+                    break
+                yield reply['chunk']
+        except BaseException:
+            # Flux interrompu : la connexion contient encore des fragments
+            self._discard(conn)
+            raise
+        self._checkin(conn)
+
+    def invalidate(self, conversation_id: int):
+        """Demande aux réplicas d'oublier l'état de préfixe d'une conversation."""
+        conn = self._checkout()
+        try:
+            self._send(conn, {'op': 'invalidate', 'conversation_id': conversation_id})
+            self._recv(conn)
+        except BaseException:
+            self._discard(conn)
+            raise
+        self._checkin(conn)
+
+    def ping(self) -> bool:
+        """
+        Vérifie que le serveur répond et qu'au moins un réplica est en vie.
+
+        Sonde faite sur une connexion dédiée, dans un thread attendu au plus
+        `ping_timeout` secondes : un pool saturé ou un serveur bloqué pendant
+        la poignée de main ne retardent pas la sonde de disponibilité. Une
+        seule sonde à la fois ; tant qu'une sonde bloquée n'a pas abouti, le
+        serveur est considéré indisponible.
+        """
+        outcome = {}
+
+        def probe():
+            try:
+                conn = self._connect()
+                try:
+                    conn.send({'op': 'ping'})
+                    if conn.poll(self.ping_timeout):
+                        outcome['reply'] = conn.recv()
+                finally:
+                    conn.close()
+            except (ModelServerError, OSError, EOFError):
+                pass
+
+        with self._ping_lock:
+            if self._ping_thread is not None and self._ping_thread.is_alive():
+                return False
+            self._ping_thread = threading.Thread(target=probe, name='model-server-ping', daemon=True)
+            self._ping_thread.start()
+            thread = self._ping_thread
+        thread.join(self.ping_timeout)
+        reply = outcome.get('reply') or {}
+        return bool(reply.get('ok')) and reply.get('replicas', 0) > 0
+
+    def _connect(self) -> Connection:
+        try:
+            return Client(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise ModelServerError(f"Serveur de modèle injoignable ({self.socket_path}): {e}")
+
+    def _checkout(self) -> Connection:
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise ModelServerBusy("Aucune connexion disponible vers le serveur de modèle.")
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn: Connection):
+        with self._idle_lock:
+            self._idle.append(conn)
+        self._slots.release()
+
+    def _discard(self, conn: Connection):
+        try:
+            conn.close()
+        except OSError:
+            pass
+        self._slots.release()
+
+    def _send(self, conn: Connection, request: dict):
+        try:
+            conn.send(request)
+        except (OSError, EOFError) as e:
+            raise ModelServerError(f"Connexion au serveur de modèle perdue: {e}")
+
+    def _recv(self, conn: Connection) -> dict:
+        try:
+            if not conn.poll(self.timeout):
+                raise ModelServerTimeout(f"Pas de réponse du serveur de modèle après {self.timeout}s.")
+            reply = conn.recv()
+        except (OSError, EOFError) as e:
+            raise ModelServerError(f"Connexion au serveur de modèle perdue: {e}")
+        if not reply.get('ok'):
+            if reply.get('busy'):
+                raise ModelServerBusy(reply.get('error'))
+            raise ModelServerError(reply.get('error'))
+        return reply
+
+
+_client_instance: Optional[ModelClient] = None
+_client_lock = threading.Lock()
+
+
+def get_authkey() -> bytes:
+    """
+    Clé partagée entre le serveur et ses clients (`NLP_SERVER_AUTHKEY`).
+
+    Raises:
+        ImproperlyConfigured: Clé absente ; pas de valeur par défaut, elle
+            serait connue de tous
+    """
+    authkey = get_env('NLP_SERVER_AUTHKEY', '')
+    if not authkey:
+        raise ImproperlyConfigured(
+            "NLP_SERVER_AUTHKEY est requis pour le serveur de modèle (NLP_SERVER_SOCKET)."
+        )
+    return authkey.encode()
+
+
+def get_model_client() -> Optional[ModelClient]:
+    """
+    Retourne le client du serveur de modèle, ou None si `NLP_SERVER_SOCKET`
+    n'est pas configuré (le modèle est alors chargé dans le processus).
+    """
+    global _client_instance
+    socket_path = get_env('NLP_SERVER_SOCKET')
+    if not socket_path:
+        return None
+    if _client_instance is None:
+        with _client_lock:
+            if _client_instance is None:
+                _client_instance = ModelClient(
+                    socket_path,
+                    pool_size=get_env('NLP_SERVER_POOL_SIZE', 8, int),
+                    timeout=get_env('NLP_SERVER_TIMEOUT', 60, float),
+                    acquire_timeout=get_env('NLP_SERVER_ACQUIRE_TIMEOUT', 5, float),
+                    authkey=get_authkey(),
+                    ping_timeout=get_env('NLP_SERVER_PING_TIMEOUT', 1, float),
+                )
+    return _client_instance
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -10,6 +10,13 @@ class Conversation(models.Model):
     title = models.CharField(max_length=255, default='Nouvelle conversation')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Résumé dénormalisé, maintenu par chat.signals à chaque écriture de Message
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_role = models.CharField(max_length=10, blank=True)
+    last_message_preview = models.CharField(max_length=100, blank=True)
+    # Renseigné quand les messages sont dans ConversationArchive (chat.archive)
+    archived_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-updated_at']
@@ -31,7 +38,44 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ['created_at']
+        ordering = ['created_at', 'id']
+        indexes = [
+            # Fenêtre de contexte : derniers messages d'une conversation
+            models.Index(fields=['conversation', 'created_at'], name='chat_msg_conv_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # L'écriture du message et celle du résumé de la conversation
+        # (chat.signals, post_save) forment une seule transaction : un échec
+        # entre les deux ne laisse pas de compteur faux
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.conversation.title} - {self.role}: {self.content[:50]}"
+
+
+class MessageEmbedding(models.Model):
+    """Vecteur sémantique (float32) d'un message, pour la sélection du contexte."""
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, primary_key=True, related_name='embedding')
+    # Dénormalisé pour charger tous les vecteurs d'une conversation sans jointure
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='+')
+    vector = models.BinaryField()
+
+    def __str__(self):
+        return f"Embedding du message {self.message_id}"
+
+
+class ConversationArchive(models.Model):
+    """Messages d'une conversation inactive, compressés en un seul bloc (chat.archive)."""
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    codec = models.CharField(max_length=10)
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+    # Taille des messages avant compression, pour le bilan de l'archivage
+    raw_size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive de la conversation {self.conversation_id}"
@@ -3,43 +3,168 @@ Module pour l'intégration du modèle NLP/IA.
 Ce fichier centralise toute la logique d'interaction avec le modèle d'intelligence artificielle.
 """
 
-from typing import Optional
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Tuple
+
+from cocoja.env_loader import get_env
+
+from . import metrics
+from .admission import AdmissionController, Ticket
+from .engines import InferenceEngine, create_engine
+from .model_server import ModelServerError, get_model_client
+from .prompt import PromptBuilder, context_block_size, word_token_ids
+
+logger = logging.getLogger(__name__)
 
 
 class NLPModel:
     """
-    Classe pour gérer le modèle NLP.
+    Façade du modèle NLP.
     
-    TODO: Remplacer cette implémentation par votre modèle réel.
+    Le calcul est délégué à un moteur d'inférence (`chat/engines.py`) choisi
+    par `NLP_ENGINE` ; sans `NLP_MODEL_PATH`, le mode simulation répond.
     """
     
     def __init__(self):
         """
         Initialiser le modèle NLP.
         
-        Ici vous pouvez :
-        - Charger les poids du modèle
-        - Initialiser le tokenizer
-        - Configurer le device (CPU/GPU)
-        - Charger les configurations nécessaires
+        Configuration lue dans l'environnement :
+        - `NLP_MODEL_PATH` : dossier du modèle (Transformers et/ou `model.onnx`)
+        - `NLP_ENGINE` : torch (défaut), torch-int8 ou onnx
+        - `NLP_DEVICE` : cpu (défaut) ou cuda (moteur torch uniquement)
+        - `NLP_MAX_LENGTH` : nombre maximal de tokens générés par réponse
+        - `NLP_INTRA_OP_THREADS` / `NLP_INTER_OP_THREADS` : threads du moteur (0 = défaut)
         """
-        self.model = None
+        self.engine: Optional[InferenceEngine] = None
         self.tokenizer = None
+        self.max_length = get_env('NLP_MAX_LENGTH', 512, int)
         self._initialize_model()
+        self.prompt_builder = PromptBuilder(
+            self._encode, get_env('NLP_PROMPT_CACHE_ENTRIES', 10000, int)
+        )
+        self.prefix_cache = PrefixCache(get_env('NLP_PREFIX_CACHE_MAX_BYTES', 512 * 1024 * 1024, int))
     
     def _initialize_model(self):
         """
-        Initialise et charge le modèle.
+        Initialise le moteur d'inférence et le tokenizer.
+        
+        Raises:
+            RuntimeError: Modèle présent mais sans tokenizer utilisable
+        """
+        model_path = get_env('NLP_MODEL_PATH')
+        if not model_path or not Path(model_path).exists():
+            if model_path:
+                logger.warning("NLP_MODEL_PATH introuvable : %s", model_path)
+            logger.warning("Modèle NLP non initialisé - utilisation du mode simulation")
+            return
         
-        Exemple avec transformers:
-        from transformers import AutoModelForCausalLM, AutoTokenizer
+        try:
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        except (ImportError, OSError) as e:
+            raise RuntimeError(f"Tokenizer introuvable pour {model_path}: {e}")
         
-        model_name = "votre-modele"
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(model_name)
+        engine_name = get_env('NLP_ENGINE', 'torch').lower()
+        start = time.monotonic()
+        self.engine = create_engine(
+            engine_name,
+            model_path,
+            device=get_env('NLP_DEVICE', 'cpu'),
+            intra_op_threads=get_env('NLP_INTRA_OP_THREADS', 0, int),
+            inter_op_threads=get_env('NLP_INTER_OP_THREADS', 0, int),
+        )
+        logger.info("Moteur %s chargé en %.2fs depuis %s", engine_name, time.monotonic() - start, model_path)
+    
+    def _encode(self, text: str) -> List[int]:
+        if self.tokenizer is not None:
+            return self.tokenizer.encode(text, add_special_tokens=False)
+        return word_token_ids(text)
+    
+    def build_prompt(
+        self,
+        user_input: str,
+        conversation_history: Optional[list] = None,
+        max_length: int = 512,
+    ) -> Tuple[List[int], int]:
+        """
+        Identifiants de tokens du prompt, historique tronqué pour laisser
+        `max_length` tokens à la réponse dans la fenêtre du modèle
+        (`NLP_CONTEXT_TOKENS`).
+        
+        Returns:
+            (identifiants de tokens, longueur du préfixe stable d'un tour à
+            l'autre, seule partie dont l'état est gardé en cache)
         """
-        # TODO: Charger votre modèle ici
-        print("⚠️  Modèle NLP non initialisé - utilisation du mode simulation")
+        budget = max(get_env('NLP_CONTEXT_TOKENS', 2048, int) - max_length, 1)
+        block = context_block_size(get_env('NLP_CONTEXT_MAX_MESSAGES', 10, int))
+        token_ids, _, prefix_length = self.prompt_builder.build(
+            user_input, conversation_history, budget, block
+        )
+        return token_ids, prefix_length
+    
+    def _iter_tokens(
+        self,
+        input_ids: List[int],
+        prefix_length: int,
+        max_length: int,
+        temperature: float,
+        conversation_id: Optional[int],
+        cached: Optional[Tuple[Any, int]] = None,
+    ) -> Iterator[int]:
+        """
+        Génère les tokens de la réponse en repartant de l'état du préfixe en
+        cache (ou de `cached`, déjà retiré du cache), puis rend au cache
+        l'état des `prefix_length` premiers tokens : la question et les
+        messages retrouvés changent au tour suivant.
+        """
+        state, state_length = cached or (None, 0)
+        if self.engine.supports_state and cached is None:
+            state, state_length = self.prefix_cache.take(conversation_id, input_ids)
+        result = {}
+        tokens = self.engine.iter_tokens(
+            input_ids,
+            max_new_tokens=min(max_length, self.max_length),
+            temperature=temperature,
+            state=state,
+            state_length=state_length,
+            eos_token_id=self.tokenizer.eos_token_id,
+            result=result,
+        )
+        # Seul le temps passé dans le moteur compte pour le débit, pas
+        # celui du consommateur (client lent en streaming)
+        generated, elapsed = 0, 0.0
+        while True:
+            start = time.perf_counter()
+            token = next(tokens, None)
+            elapsed += time.perf_counter() - start
+            if token is None:
+                break
+            generated += 1
+            yield token
+        metrics.record_generation(self.engine.name, generated, elapsed)
+        if self.engine.supports_state:
+            self._store_prefix(conversation_id, input_ids, prefix_length, result.get('state'))
+    
+    def _store_prefix(self, conversation_id: Optional[int], input_ids: List[int], prefix_length: int, state: Any):
+        if prefix_length and state is not None:
+            self.prefix_cache.store(
+                conversation_id, input_ids[:prefix_length], self.engine.crop_state(state, prefix_length)
+            )
     
     def generate_response(
         self,
@@ -47,6 +172,7 @@ class NLPModel:
         conversation_history: Optional[list] = None,
         max_length: int = 512,
         temperature: float = 0.7,
+        conversation_id: Optional[int] = None,
     ) -> str:
         """
         Génère une réponse basée sur l'entrée de l'utilisateur.
@@ -54,32 +180,138 @@ class NLPModel:
         Args:
             user_input: Le message de l'utilisateur
             conversation_history: Historique des messages [{role: str, content: str}, ...]
-            max_length: Longueur maximale de la réponse
+            max_length: Longueur maximale de la réponse (plafonnée par `NLP_MAX_LENGTH`)
             temperature: Température pour la génération (contrôle la créativité)
+            conversation_id: Conversation concernée, pour réutiliser l'état du préfixe
         
         Returns:
             La réponse générée par le modèle
-        
-        TODO: Implémenter la logique de génération avec votre modèle
         """
+        input_ids, prefix_length = self.build_prompt(user_input, conversation_history, max_length)
         
-        # Mode simulation - À REMPLACER
-        if not self.model:
+        # Mode simulation
+        if self.engine is None:
             return self._simulation_response(user_input)
         
-        # TODO: Implémenter votre logique de génération
-        # Exemple:
-        # inputs = self.tokenizer(user_input, return_tensors="pt")
-        # outputs = self.model.generate(
-        #     inputs.input_ids,
-        #     max_length=max_length,
-        #     temperature=temperature,
-        #     do_sample=True
-        # )
-        # response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        # return response
+        tokens = list(self._iter_tokens(input_ids, prefix_length, max_length, temperature, conversation_id))
+        return self.tokenizer.decode(tokens, skip_special_tokens=True).strip()
+    
+    def generate_response_stream(
+        self,
+        user_input: str,
+        conversation_history: Optional[list] = None,
+        max_length: int = 512,
+        temperature: float = 0.7,
+        conversation_id: Optional[int] = None,
+    ) -> Iterator[str]:
+        """
+        Génère une réponse morceau par morceau (token par token).
+        
+        Mêmes arguments que `generate_response`, mais retourne un générateur
+        qui produit les fragments de texte au fur et à mesure. Fermer le
+        générateur (`close()`) interrompt proprement la génération.
+        
+        Yields:
+            Les fragments successifs de la réponse
+        """
+        input_ids, prefix_length = self.build_prompt(user_input, conversation_history, max_length)
+        
+        # Mode simulation
+        if self.engine is None:
+            yield from self._simulation_stream(user_input)
+            return
+        
+        tokens = []
+        sent = ''
+        for token in self._iter_tokens(input_ids, prefix_length, max_length, temperature, conversation_id):
+            tokens.append(token)
+            text = self.tokenizer.decode(tokens, skip_special_tokens=True)
+            # Un caractère multi-octets peut s'étaler sur plusieurs tokens
+            if len(text) > len(sent) and not text.endswith('\ufffd'):
+                yield text[len(sent):]
+                sent = text
+    
+    def generate_batch(
+        self,
+        user_inputs: List[str],
+        conversation_histories: List[Optional[list]],
+        max_length: int = 512,
+        temperature: float = 0.7,
+        conversation_ids: Optional[List[Optional[int]]] = None,
+    ) -> List[str]:
+        """
+        Génère les réponses d'un lot de requêtes.
+        
+        Args:
+            user_inputs: Les messages des utilisateurs
+            conversation_histories: L'historique associé à chaque message
+            max_length: Longueur maximale des réponses
+            temperature: Température commune au lot
+            conversation_ids: Conversation de chaque requête (cache de préfixe)
+        
+        Returns:
+            Les réponses, dans le même ordre que `user_inputs`
         
-        return self._simulation_response(user_input)
+        Les requêtes dont le préfixe est en cache n'ont que leurs derniers
+        tokens à encoder : elles sont générées seules à partir de cet état.
+        Les autres partent ensemble dans `engine.generate_batch` (une passe
+        du modèle par token pour tout le lot) et l'état de chacune est rendu
+        au cache pour le tour suivant.
+        """
+        
+        # Mode simulation
+        if self.engine is None:
+            return [self._simulation_response(text) for text in user_inputs]
+        
+        conversation_ids = conversation_ids or [None] * len(user_inputs)
+        responses: List[Optional[str]] = [None] * len(user_inputs)
+        batch = []
+        for index, (text, history, conversation_id) in enumerate(
+                zip(user_inputs, conversation_histories, conversation_ids)):
+            input_ids, prefix_length = self.build_prompt(text, history, max_length)
+            state, state_length = None, 0
+            if self.engine.supports_state:
+                state, state_length = self.prefix_cache.take(conversation_id, input_ids)
+            if state is None:
+                batch.append((index, input_ids, prefix_length, conversation_id))
+                continue
+            tokens = list(self._iter_tokens(
+                input_ids, prefix_length, max_length, temperature, conversation_id, (state, state_length)
+            ))
+            responses[index] = self.tokenizer.decode(tokens, skip_special_tokens=True).strip()
+        
+        if batch:
+            eos_token_id = self.tokenizer.eos_token_id
+            pad_token_id = getattr(self.tokenizer, 'pad_token_id', None)
+            if pad_token_id is None:
+                pad_token_id = eos_token_id if eos_token_id is not None else 0
+            result = {}
+            start = time.perf_counter()
+            generated = self.engine.generate_batch(
+                [input_ids for _, input_ids, _, _ in batch],
+                max_new_tokens=min(max_length, self.max_length),
+                temperature=temperature,
+                eos_token_id=eos_token_id,
+                pad_token_id=pad_token_id,
+                result=result,
+            )
+            metrics.record_generation(
+                self.engine.name, sum(len(tokens) for tokens in generated), time.perf_counter() - start
+            )
+            for (index, input_ids, prefix_length, conversation_id), tokens, state in zip(
+                    batch, generated, result['states']):
+                responses[index] = self.tokenizer.decode(tokens, skip_special_tokens=True).strip()
+                self._store_prefix(conversation_id, input_ids, prefix_length, state)
+        return responses
+    
+    def _simulation_stream(self, user_input: str) -> Iterator[str]:
+        """
+        Découpe la réponse de simulation en mots pour imiter un flux de tokens.
+        """
+        response = self._simulation_response(user_input)
+        words = response.split(' ')
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + ' '
     
     def _simulation_response(self, user_input: str) -> str:
         """
@@ -120,8 +352,449 @@ class NLPModel:
         return "\n".join(formatted)
 
 
+def normalize_question(text: str) -> str:
+    """
+    Normalise une question pour la clé de cache.
+    
+    Casse, espaces multiples et ponctuation finale n'influencent pas la clé :
+    "Bonjour !" et "  bonjour" donnent la même entrée.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = ' '.join(text.split())
+    return text.strip(' .!?;,')
+
+
+def history_fingerprint(conversation_history: Optional[list]) -> str:
+    """Empreinte de l'historique (rôles et contenus) pour la clé de cache."""
+    if not conversation_history:
+        return ''
+    payload = json.dumps(
+        [(msg.get('role', 'user'), msg.get('content', '')) for msg in conversation_history],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def response_cache_key(
+    user_input: str,
+    conversation_history: Optional[list],
+    max_length: int,
+    temperature: float,
+) -> str:
+    """Clé de cache : question normalisée + historique + paramètres de génération."""
+    payload = json.dumps([
+        normalize_question(user_input),
+        history_fingerprint(conversation_history),
+        max_length,
+        temperature,
+    ])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Interface des caches de réponses.
+    
+    Les sous-classes implémentent `_get` et `_set` ; les compteurs de
+    hits/misses sont gérés ici.
+    """
+    
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str) -> Optional[str]:
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+    
+    def set(self, key: str, value: str):
+        size = len(value.encode())
+        if size <= self.max_bytes:
+            self._set(key, value, size)
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'backend': type(self).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0,
+            'max_bytes': self.max_bytes,
+        }
+    
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+    
+    def _set(self, key: str, value: str, size: int):
+        raise NotImplementedError
+
+
+class MemoryResponseCache(ResponseCache):
+    """Cache LRU en mémoire du processus, borné en octets, avec expiration."""
+    
+    def __init__(self, max_bytes: int, ttl: float):
+        super().__init__(max_bytes, ttl)
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def _set(self, key, value, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+    
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats.update(entries=len(self._entries), bytes=self._bytes)
+        return stats
+
+
+class SQLiteResponseCache(ResponseCache):
+    """
+    Cache partagé entre processus, stocké dans un fichier SQLite.
+    
+    Éviction LRU sur la date de dernier accès lorsque la taille totale
+    dépasse `max_bytes`.
+    """
+    
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        super().__init__(max_bytes, ttl)
+        self.path = str(path)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at)"
+            )
+    
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _get(self, key):
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+    
+    def _set(self, key, value, size):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + self.ttl, now),
+            )
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+            if total > self.max_bytes:
+                # Supprime les entrées les moins récemment utilisées jusqu'à repasser sous la limite
+                conn.execute(
+                    "DELETE FROM response_cache WHERE key IN ("
+                    " SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC) AS kept"
+                    " FROM response_cache) WHERE kept > ?)",
+                    (self.max_bytes,),
+                )
+    
+    def stats(self):
+        stats = super().stats()
+        with self._connection() as conn:
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache"
+            ).fetchone()
+        stats.update(entries=entries, bytes=total, path=self.path)
+        return stats
+
+
+def prefix_hash(token_ids: List[int]) -> str:
+    """Empreinte d'une séquence de tokens."""
+    return hashlib.blake2b(array('q', token_ids).tobytes(), digest_size=16).hexdigest()
+
+
+def state_nbytes(state: Any) -> int:
+    """
+    Estime la mémoire occupée par un état de préfixe (cache clé/valeur).
+
+    Gère les tableaux NumPy, les tenseurs PyTorch, les caches Transformers
+    (`key_cache` / `value_cache`) et les tuples/listes imbriqués.
+    """
+    if state is None:
+        return 0
+    if hasattr(state, 'nbytes'):
+        return int(state.nbytes)
+    if hasattr(state, 'element_size') and hasattr(state, 'numel'):
+        return state.element_size() * state.numel()
+    if hasattr(state, 'key_cache') and hasattr(state, 'value_cache'):
+        return state_nbytes(state.key_cache) + state_nbytes(state.value_cache)
+    if isinstance(state, (tuple, list)):
+        return sum(state_nbytes(item) for item in state)
+    return sys.getsizeof(state)
+
+
+class PrefixCache:
+    """
+    Cache des états de préfixe (KV cache) par conversation.
+    
+    Une entrée par conversation : l'état calculé pour la fenêtre d'historique
+    du dernier prompt, avec la longueur et l'empreinte des tokens qu'il
+    couvre. Au tour suivant, le nouveau prompt commence par cette fenêtre
+    (elle n'est tronquée que par blocs) : seuls les nouveaux tokens restent
+    à encoder. Si l'historique a changé (message modifié, troncature),
+    l'empreinte ne correspond plus et l'entrée est ignorée.
+    
+    `take` retire l'entrée du cache : la génération modifie l'état en place,
+    il ne doit pas être partagé entre deux requêtes. Le modèle le rend avec
+    `store` une fois la génération terminée. Éviction LRU bornée en octets.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.tokens_reused = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def take(self, conversation_id: Optional[int], token_ids: List[int]) -> Tuple[Any, int]:
+        """
+        Retire l'état réutilisable pour ce prompt.
+        
+        Returns:
+            (état, nombre de tokens couverts), ou (None, 0) si rien ne correspond
+        """
+        if conversation_id is None:
+            return None, 0
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+            if entry is not None:
+                self._bytes -= entry[3]
+        if entry is not None:
+            length, digest, state, _ = entry
+            if length <= len(token_ids) and prefix_hash(token_ids[:length]) == digest:
+                self.hits += 1
+                self.tokens_reused += length
+                return state, length
+        self.misses += 1
+        return None, 0
+    
+    def store(self, conversation_id: Optional[int], token_ids: List[int], state: Any):
+        """Enregistre l'état couvrant exactement `token_ids`."""
+        if conversation_id is None or state is None:
+            return
+        size = state_nbytes(state)
+        if size > self.max_bytes:
+            return
+        entry = (len(token_ids), prefix_hash(token_ids), state, size)
+        with self._lock:
+            old = self._entries.pop(conversation_id, None)
+            if old is not None:
+                self._bytes -= old[3]
+            self._entries[conversation_id] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+    
+    def invalidate(self, conversation_id: int):
+        """Oublie l'état d'une conversation (message modifié ou supprimé)."""
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+            if entry is not None:
+                self._bytes -= entry[3]
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries, held = len(self._entries), self._bytes
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0,
+            'tokens_reused': self.tokens_reused,
+            'entries': entries,
+            'bytes': held,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class _PendingRequest:
+    """Une requête en attente dans la file du `BatchScheduler`."""
+    
+    def __init__(self, user_input, conversation_history, max_length, temperature, conversation_id):
+        self.user_input = user_input
+        self.conversation_history = conversation_history
+        self.max_length = max_length
+        self.temperature = temperature
+        self.conversation_id = conversation_id
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class BatchScheduler:
+    """
+    Regroupe les appels concurrents au modèle en lots (batching dynamique).
+    
+    Un thread dédié collecte les requêtes pendant au plus `max_wait_ms`
+    millisecondes, ou jusqu'à `max_batch_size` requêtes, puis les exécute en
+    un seul appel à `NLPModel.generate_batch`. Chaque appelant reçoit
+    ensuite sa propre réponse.
+    """
+    
+    def __init__(self, model: NLPModel, max_batch_size: int = 8, max_wait_ms: float = 10):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_PendingRequest]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._thread = threading.Thread(target=self._run, name='nlp-batcher', daemon=True)
+        self._thread.start()
+    
+    def submit(
+        self,
+        user_input: str,
+        conversation_history: Optional[list] = None,
+        max_length: int = 512,
+        temperature: float = 0.7,
+        conversation_id: Optional[int] = None,
+    ) -> str:
+        """
+        Ajoute une requête à la file et attend sa réponse.
+        
+        Returns:
+            La réponse générée pour cette requête
+        """
+        pending = _PendingRequest(user_input, conversation_history, max_length, temperature, conversation_id)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._execute(batch)
+    
+    def _execute(self, batch: List[_PendingRequest]):
+        # Les paramètres de génération sont communs à un lot : on regroupe
+        groups = {}
+        for pending in batch:
+            groups.setdefault((pending.max_length, pending.temperature), []).append(pending)
+        
+        for (max_length, temperature), group in groups.items():
+            with self._stats_lock:
+                self._batch_sizes[len(group)] += 1
+            try:
+                results = self.model.generate_batch(
+                    [p.user_input for p in group],
+                    [p.conversation_history for p in group],
+                    max_length,
+                    temperature,
+                    [p.conversation_id for p in group],
+                )
+                for pending, result in zip(group, results):
+                    pending.result = result
+            except Exception as e:
+                for pending in group:
+                    pending.error = e
+            finally:
+                for pending in group:
+                    pending.done.set()
+    
+    def stats(self) -> dict:
+        """
+        Statistiques du batching.
+        
+        Returns:
+            Profondeur de file, nombre de lots et de requêtes traités,
+            taille moyenne et maximale des lots, histogramme des tailles
+        """
+        with self._stats_lock:
+            sizes = dict(self._batch_sizes)
+        batches = sum(sizes.values())
+        requests = sum(size * count for size, count in sizes.items())
+        return {
+            'queue_depth': self._queue.qsize(),
+            'batches': batches,
+            'requests': requests,
+            'avg_batch_size': round(requests / batches, 2) if batches else 0,
+            'max_batch_size': max(sizes, default=0),
+            'batch_size_histogram': dict(sorted(sizes.items())),
+        }
+
+
 # Instance globale du modèle (singleton)
 _model_instance: Optional[NLPModel] = None
+_model_lock = threading.Lock()
+
+# État du chargement, exposé par /health/ready : idle | loading | ready | failed
+_model_status = {'status': 'idle', 'error': None, 'load_seconds': None, 'warmup_seconds': None}
+
+# Cache de réponses (configuré par NLP_CACHE_BACKEND)
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+# Ordonnanceur de batching (créé si NLP_BATCHING est activé)
+_batch_scheduler: Optional[BatchScheduler] = None
+_batch_scheduler_lock = threading.Lock()
+
+# Pool de threads dédié aux appels du modèle (chemin asynchrone)
+_model_executor: Optional[ThreadPoolExecutor] = None
+
+# File d'admission des générations (créée si NLP_ADMISSION est activé)
+_admission_controller: Optional[AdmissionController] = None
+_admission_controller_lock = threading.Lock()
 
 
 def get_nlp_model() -> NLPModel:
@@ -134,13 +807,226 @@ def get_nlp_model() -> NLPModel:
     """
     global _model_instance
     if _model_instance is None:
-        _model_instance = NLPModel()
+        # Si le préchargement est en cours, on attend sa fin au lieu de
+        # charger une seconde copie
+        with _model_lock:
+            if _model_instance is None:
+                _model_instance = NLPModel()
+    return _model_instance
+
+
+def warm_up_model():
+    """Charge le modèle puis, si `NLP_WARMUP` est activé, génère une réponse courte."""
+    _model_status.update(status='loading', error=None)
+    try:
+        start = time.monotonic()
+        model = get_nlp_model()
+        _model_status['load_seconds'] = round(time.monotonic() - start, 3)
+        logger.info("Modèle NLP chargé en %.2fs", _model_status['load_seconds'])
+        
+        if get_env('NLP_WARMUP', True, bool):
+            # Première génération : initialise les noyaux et alloue les buffers
+            start = time.monotonic()
+            model.generate_response('Bonjour', max_length=8, temperature=0)
+            _model_status['warmup_seconds'] = round(time.monotonic() - start, 3)
+            logger.info("Génération de préchauffage en %.2fs", _model_status['warmup_seconds'])
+    except Exception as e:
+        _model_status.update(status='failed', error=str(e))
+        logger.exception("Échec du chargement du modèle NLP")
+        return
+    _model_status['status'] = 'ready'
+
+
+def start_model_warmup() -> threading.Thread:
+    """
+    Lance le chargement du modèle en arrière-plan (appelé au démarrage).
+    
+    Les requêtes arrivant avant la fin attendent le chargement en cours ;
+    `/health/ready` répond 503 tant que le modèle n'est pas prêt.
+    """
+    _model_status['status'] = 'loading'
+    thread = threading.Thread(target=warm_up_model, name='nlp-model-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def _restart_warmup_after_fork():
+    # Le thread de chargement ne survit pas au fork (gunicorn --preload) :
+    # le verrou peut être resté pris par le parent
+    global _model_lock
+    if _model_status['status'] == 'loading' and _model_instance is None:
+        _model_lock = threading.Lock()
+        start_model_warmup()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_warmup_after_fork)
+
+
+def model_status() -> dict:
+    """
+    État du modèle pour les sondes de disponibilité.
+    
+    Avec le serveur de modèle (`NLP_SERVER_SOCKET`), l'état est celui de la
+    connexion au serveur : le processus web ne charge pas de modèle.
+    """
+    client = get_model_client()
+    if client is not None:
+        ready = client.ping()
+        return {'status': 'ready' if ready else 'unavailable', 'backend': 'model_server'}
+    if _model_instance is not None and _model_status['status'] == 'idle':
+        # Chargé à la demande, sans préchargement
+        return {**_model_status, 'status': 'ready', 'backend': 'local'}
+    return {**_model_status, 'backend': 'local'}
+
+
+def get_loaded_model() -> Optional[NLPModel]:
+    """Retourne le modèle s'il est déjà chargé dans ce processus, sans le charger."""
     return _model_instance
 
 
+def invalidate_message(message_id: int):
+    """
+    Oublie l'état dérivé d'un message modifié ou supprimé (tokens en cache).
+
+    Sans effet si le modèle n'est pas chargé dans ce processus.
+    """
+    if _model_instance is not None:
+        _model_instance.prompt_builder.invalidate(message_id)
+
+
+def invalidate_conversation(conversation_id: int):
+    """
+    Oublie l'état de préfixe d'une conversation dont l'historique a changé.
+
+    Agit sur le modèle chargé dans ce processus et, s'il est configuré, sur
+    les réplicas du serveur de modèle.
+    """
+    if _model_instance is not None:
+        _model_instance.prefix_cache.invalidate(conversation_id)
+    client = get_model_client()
+    if client is not None:
+        try:
+            client.invalidate(conversation_id)
+        except ModelServerError as e:
+            # L'empreinte du préfixe empêche de toute façon un état périmé d'être réutilisé
+            logger.warning("Invalidation du préfixe impossible : %s", e)
+
+
+def get_batch_scheduler() -> Optional[BatchScheduler]:
+    """
+    Retourne l'ordonnanceur de batching, ou None s'il est désactivé.
+    
+    Configuré par `NLP_BATCHING`, `NLP_BATCH_MAX_SIZE` et `NLP_BATCH_WAIT_MS`.
+    
+    Returns:
+        L'ordonnanceur partagé du processus, ou None
+    """
+    global _batch_scheduler
+    if not get_env('NLP_BATCHING', False, bool):
+        return None
+    if _batch_scheduler is None:
+        with _batch_scheduler_lock:
+            if _batch_scheduler is None:
+                _batch_scheduler = BatchScheduler(
+                    get_nlp_model(),
+                    max_batch_size=get_env('NLP_BATCH_MAX_SIZE', 8, int),
+                    max_wait_ms=get_env('NLP_BATCH_WAIT_MS', 10, float),
+                )
+    return _batch_scheduler
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """
+    Retourne la file d'admission des générations, ou None si elle est désactivée.
+    
+    Configurée par `NLP_ADMISSION`, `NLP_MAX_CONCURRENCY` (créneaux),
+    `NLP_ADMISSION_QUEUE_SIZE`, `NLP_ADMISSION_RESERVED` (créneaux interdits
+    aux invités) et `NLP_DEADLINE_PRO|FREE|GUEST` (attente maximale).
+    
+    Returns:
+        La file partagée du processus, ou None
+    """
+    global _admission_controller
+    if not get_env('NLP_ADMISSION', True, bool):
+        return None
+    if _admission_controller is None:
+        with _admission_controller_lock:
+            if _admission_controller is None:
+                _admission_controller = AdmissionController(
+                    slots=get_env('NLP_MAX_CONCURRENCY', 4, int),
+                    queue_size=get_env('NLP_ADMISSION_QUEUE_SIZE', 64, int),
+                    reserved=get_env('NLP_ADMISSION_RESERVED', 1, int),
+                    deadlines={
+                        'pro': get_env('NLP_DEADLINE_PRO', 30, float),
+                        'free': get_env('NLP_DEADLINE_FREE', 20, float),
+                        'guest': get_env('NLP_DEADLINE_GUEST', 5, float),
+                    },
+                )
+    return _admission_controller
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Retourne le cache de réponses, ou None s'il est désactivé.
+    
+    `NLP_CACHE_BACKEND` vaut `memory` (défaut, par processus), `sqlite`
+    (fichier partagé entre workers, `NLP_CACHE_PATH`) ou `none`.
+    
+    Returns:
+        Le cache partagé du processus, ou None
+    """
+    global _response_cache
+    backend = get_env('NLP_CACHE_BACKEND', 'memory').lower()
+    if backend == 'none':
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                max_bytes = get_env('NLP_CACHE_MAX_BYTES', 16 * 1024 * 1024, int)
+                ttl = get_env('NLP_CACHE_TTL', 3600, float)
+                if backend == 'sqlite':
+                    default_path = Path(__file__).resolve().parent.parent / 'nlp_cache.sqlite3'
+                    path = get_env('NLP_CACHE_PATH', str(default_path))
+                    _response_cache = SQLiteResponseCache(path, max_bytes, ttl)
+                else:
+                    _response_cache = MemoryResponseCache(max_bytes, ttl)
+    return _response_cache
+
+
+def is_cacheable(temperature: float) -> bool:
+    """
+    Une génération déterministe (température nulle) est toujours cacheable ;
+    avec échantillonnage, le cache est opt-in via `NLP_CACHE_SAMPLING`.
+    """
+    return temperature <= 0 or get_env('NLP_CACHE_SAMPLING', False, bool)
+
+
+def resolve_temperature(temperature: Optional[float], conversation_history: Optional[list]) -> float:
+    """
+    Température effective d'une génération.
+
+    Sans valeur explicite : `NLP_TEMPERATURE` (0.7 par défaut). Une question
+    hors conversation utilise `NLP_STANDALONE_TEMPERATURE` si elle est
+    définie : à 0, les questions isolées souvent répétées (« bonjour », FAQ)
+    reçoivent une réponse déterministe que le cache de réponses conserve, au
+    prix de réponses moins variées.
+    """
+    if temperature is not None:
+        return temperature
+    default = get_env('NLP_TEMPERATURE', 0.7, float)
+    if not conversation_history:
+        return get_env('NLP_STANDALONE_TEMPERATURE', default, float)
+    return default
+
+
 def generate_ai_response(
     user_input: str,
-    conversation_history: Optional[list] = None
+    conversation_history: Optional[list] = None,
+    max_length: int = 512,
+    temperature: Optional[float] = None,
+    conversation_id: Optional[int] = None,
+    priority: Optional[str] = None,
 ) -> str:
     """
     Fonction helper pour générer une réponse IA.
@@ -148,9 +1034,239 @@ def generate_ai_response(
     Args:
         user_input: Le message de l'utilisateur
         conversation_history: Historique optionnel de la conversation
+        max_length: Longueur maximale de la réponse
+        temperature: Température pour la génération (voir `resolve_temperature`)
+        conversation_id: Conversation concernée (cache de préfixe du modèle)
+        priority: Niveau du demandeur (pro, free, guest) ; None pour ne pas
+            passer par la file d'admission
     
     Returns:
         La réponse générée
+    
+    Raises:
+        AdmissionRejected: Modèle saturé pour ce niveau
     """
+    temperature = resolve_temperature(temperature, conversation_history)
+    cache = get_response_cache() if is_cacheable(temperature) else None
+    if cache is not None:
+        key = response_cache_key(user_input, conversation_history, max_length, temperature)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    
+    admission = get_admission_controller() if priority is not None else None
+    if admission is not None:
+        with admission.enter(priority):
+            response = _generate(user_input, conversation_history, max_length, temperature, conversation_id)
+    else:
+        response = _generate(user_input, conversation_history, max_length, temperature, conversation_id)
+    
+    if cache is not None:
+        cache.set(key, response)
+    return response
+
+
+def _generate(user_input, conversation_history, max_length, temperature, conversation_id) -> str:
+    client = get_model_client()
+    scheduler = get_batch_scheduler()
+    if client is not None:
+        return client.generate(user_input, conversation_history, max_length, temperature, conversation_id)
+    if scheduler is not None:
+        return scheduler.submit(user_input, conversation_history, max_length, temperature, conversation_id)
     model = get_nlp_model()
-    return model.generate_response(user_input, conversation_history)
+    return model.generate_response(user_input, conversation_history, max_length, temperature, conversation_id)
+
+
+def generate_ai_response_stream(
+    user_input: str,
+    conversation_history: Optional[list] = None,
+    max_length: int = 512,
+    temperature: Optional[float] = None,
+    conversation_id: Optional[int] = None,
+    priority: Optional[str] = None,
+) -> Iterator[str]:
+    """
+    Fonction helper pour générer une réponse IA en streaming.
+    
+    L'attente dans la file d'admission a lieu dès l'appel : un refus est levé
+    avant le premier fragment. Le créneau est libéré dès la fin de la
+    génération (ou à la fermeture du flux).
+    
+    Args:
+        user_input: Le message de l'utilisateur
+        conversation_history: Historique optionnel de la conversation
+        max_length: Longueur maximale de la réponse
+        temperature: Température pour la génération (voir `resolve_temperature`)
+        conversation_id: Conversation concernée (cache de préfixe du modèle)
+        priority: Niveau du demandeur ; None pour ne pas passer par la file
+    
+    Returns:
+        Un générateur produisant les fragments de la réponse
+    
+    Raises:
+        AdmissionRejected: Modèle saturé pour ce niveau
+    """
+    temperature = resolve_temperature(temperature, conversation_history)
+    cache = get_response_cache() if is_cacheable(temperature) else None
+    if cache is not None:
+        key = response_cache_key(user_input, conversation_history, max_length, temperature)
+        cached = cache.get(key)
+        if cached is not None:
+            return (chunk for chunk in [cached])
+    
+    admission = get_admission_controller() if priority is not None else None
+    ticket = None
+    if admission is not None:
+        ticket = admission.enter(priority)
+        ticket.wait()
+    
+    try:
+        client = get_model_client()
+        if client is not None:
+            stream = client.generate_stream(
+                user_input, conversation_history, max_length, temperature, conversation_id
+            )
+        else:
+            model = get_nlp_model()
+            stream = model.generate_response_stream(
+                user_input, conversation_history, max_length, temperature, conversation_id
+            )
+    except BaseException:
+        # Aucun flux ne portera le créneau : il est rendu tout de suite
+        if ticket is not None:
+            ticket.release()
+        raise
+    if ticket is not None:
+        stream = AdmittedStream(stream, ticket)
+    
+    if cache is None:
+        return stream
+    return _caching_stream(stream, cache, key)
+
+
+class AdmittedStream:
+    """
+    Flux qui libère son créneau d'admission à la fin, à la fermeture ou à la
+    destruction (un générateur jamais démarré n'exécute pas son `finally`).
+
+    Seul le temps passé à produire les fragments est compté dans la durée
+    moyenne d'une génération : le temps de lecture du client n'allonge pas
+    les attentes estimées par la file.
+    """
+
+    def __init__(self, stream: Iterator[str], ticket: Ticket):
+        self.stream = stream
+        self.ticket = ticket
+        self.busy = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        start = time.monotonic()
+        try:
+            chunk = next(self.stream)
+        except BaseException:
+            self.busy += time.monotonic() - start
+            self.ticket.release(self.busy)
+            raise
+        self.busy += time.monotonic() - start
+        return chunk
+
+    def close(self):
+        try:
+            close = getattr(self.stream, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.ticket.release(self.busy)
+
+    def __del__(self):
+        self.ticket.release(self.busy)
+
+
+def _caching_stream(stream: Iterator[str], cache: ResponseCache, key: str) -> Iterator[str]:
+    """Relaie un flux et met la réponse en cache s'il va jusqu'au bout."""
+    chunks = []
+    try:
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        stream.close()
+    cache.set(key, ''.join(chunks))
+
+
+def get_model_executor() -> ThreadPoolExecutor:
+    """
+    Retourne le pool de threads borné utilisé pour les appels au modèle.
+    
+    La taille est fixée par `NLP_MAX_CONCURRENCY` : c'est le nombre maximal
+    de générations simultanées. Les requêtes en surplus attendent dans la file
+    du pool sans occuper de thread.
+    
+    Returns:
+        Le pool de threads partagé du processus
+    """
+    global _model_executor
+    if _model_executor is None:
+        _model_executor = ThreadPoolExecutor(
+            max_workers=get_env('NLP_MAX_CONCURRENCY', 4, int),
+            thread_name_prefix='nlp-model',
+        )
+    return _model_executor
+
+
+async def agenerate_ai_response(
+    user_input: str,
+    conversation_history: Optional[list] = None,
+    conversation_id: Optional[int] = None,
+    priority: Optional[str] = None,
+) -> str:
+    """
+    Version asynchrone de `generate_ai_response`.
+    
+    Comme en synchrone, le cache de réponses est consulté avant la file
+    d'admission : une réponse en cache ne prend pas de créneau du modèle.
+    L'attente dans la file se fait dans la boucle d'événements ; seuls la
+    génération et l'écriture en cache sont déléguées au pool borné.
+    
+    Args:
+        user_input: Le message de l'utilisateur
+        conversation_history: Historique optionnel de la conversation
+        conversation_id: Conversation concernée (cache de préfixe du modèle)
+        priority: Niveau du demandeur ; None pour ne pas passer par la file
+    
+    Returns:
+        La réponse générée
+    
+    Raises:
+        AdmissionRejected: Modèle saturé pour ce niveau
+    """
+    max_length = 512
+    temperature = resolve_temperature(None, conversation_history)
+    cache = get_response_cache() if is_cacheable(temperature) else None
+    key = None
+    if cache is not None:
+        key = response_cache_key(user_input, conversation_history, max_length, temperature)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    
+    def call():
+        response = _generate(user_input, conversation_history, max_length, temperature, conversation_id)
+        if cache is not None:
+            cache.set(key, response)
+        return response
+    
+    loop = asyncio.get_running_loop()
+    admission = get_admission_controller() if priority is not None else None
+    if admission is None:
+        return await loop.run_in_executor(get_model_executor(), call)
+    
+    ticket = admission.enter(priority)
+    try:
+        await ticket.wait_async()
+        return await loop.run_in_executor(get_model_executor(), call)
+    finally:
+        ticket.release()
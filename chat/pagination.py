@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class MessageCursorPagination(CursorPagination):
+    """
+    Pagination par curseur (keyset) des messages, du plus récent au plus ancien.
+
+    Le lien `next` pointe vers les messages plus anciens ("charger les messages
+    précédents"). Chaque page filtre sur `created_at` au lieu d'utiliser un
+    OFFSET : le coût d'une page profonde est le même que celui de la première.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,164 @@
+"""
+Construction du prompt du modèle sous contrainte de budget en tokens.
+
+Chaque tour d'historique est tokenisé une seule fois : ses identifiants de
+tokens sont gardés dans un cache LRU indexé par l'id du message. À chaque
+requête, seul le nouveau tour (la question) est tokenisé ; l'historique est
+tronqué par blocs, du plus ancien au plus récent, pour tenir dans le budget.
+
+Le début du prompt reste ainsi identique d'un tour à l'autre tant qu'aucun
+bloc n'est abandonné : c'est ce qui permet au cache de préfixe du modèle de
+resservir l'état calculé au tour précédent.
+"""
+
+import hashlib
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from cocoja.env_loader import get_env
+
+Encode = Callable[[str], List[int]]
+
+_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+
+def word_token_ids(text: str) -> List[int]:
+    """
+    Tokenisation de repli (mots et ponctuation) quand aucun tokenizer n'est
+    chargé. Les identifiants sont stables entre processus.
+    """
+    return [zlib.crc32(token.encode()) for token in _TOKEN_RE.findall(text)]
+
+
+def format_turn(role: str, content: str) -> str:
+    """Format d'un tour, identique à `NLPModel.format_conversation_history`."""
+    return f"{role.upper()}: {content}\n"
+
+
+def context_block_size(max_messages: int) -> int:
+    """
+    Nombre de messages abandonnés d'un coup quand l'historique déborde
+    (`NLP_CONTEXT_BLOCK`, par défaut la moitié de la fenêtre).
+    """
+    return max(get_env('NLP_CONTEXT_BLOCK', max_messages // 2, int), 1)
+
+
+class PromptBuilder:
+    """
+    Assemble les identifiants de tokens du prompt.
+
+    Le cache est borné en nombre de messages. Une entrée mémorise une
+    empreinte (blake2b) du contenu tokenisé : un message modifié dans un autre
+    processus est retokenisé même si l'invalidation explicite ne l'a pas
+    atteint, y compris quand sa longueur n'a pas changé.
+    """
+
+    def __init__(self, encode: Encode, max_entries: int = 10000):
+        self.encode = encode
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._reply_prefix = encode('ASSISTANT:')
+
+    def turn_tokens(self, message: dict) -> List[int]:
+        """Tokens d'un tour d'historique, depuis le cache si possible."""
+        role = message.get('role', 'user')
+        content = message.get('content', '')
+        message_id = message.get('id')
+        if message_id is not None:
+            digest = hashlib.blake2b(content.encode(), digest_size=8).digest()
+            with self._lock:
+                entry = self._entries.get(message_id)
+                if entry is not None and entry[0] == digest:
+                    self._entries.move_to_end(message_id)
+                    self.hits += 1
+                    return entry[1]
+
+        tokens = self.encode(format_turn(role, content))
+        if message_id is not None:
+            with self._lock:
+                self.misses += 1
+                self._entries[message_id] = (digest, tokens)
+                self._entries.move_to_end(message_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return tokens
+
+    def build(
+        self,
+        user_input: str,
+        conversation_history: Optional[list],
+        max_tokens: int,
+        block: int = 1,
+    ) -> Tuple[List[int], List[dict], int]:
+        """
+        Construit le prompt : historique, messages retrouvés, question, amorce
+        de réponse.
+
+        Les messages retrouvés par la recherche sémantique (`retrieved`) sont
+        placés après la fenêtre récente et abandonnés en premier. La fenêtre
+        est tronquée par blocs de `block` tours en partant des plus anciens ;
+        si la question seule dépasse le budget, seule sa fin est gardée.
+
+        Args:
+            user_input: La question (nouveau tour, jamais en cache)
+            conversation_history: [{id, role, content}, ...] du plus ancien au plus récent
+            max_tokens: Budget total du prompt
+            block: Nombre de tours abandonnés d'un coup
+
+        Returns:
+            (identifiants de tokens, tours d'historique conservés, nombre de
+            tokens de la fenêtre récente en tête du prompt)
+        """
+        tail = self.encode(format_turn('user', user_input)) + self._reply_prefix
+        if len(tail) >= max_tokens:
+            return tail[-max_tokens:], [], 0
+
+        budget = max_tokens - len(tail)
+        history = conversation_history or []
+        window = [message for message in history if not message.get('retrieved')]
+        parts = [self.turn_tokens(message) for message in window]
+        used = sum(len(tokens) for tokens in parts)
+        start = 0
+        while used > budget:
+            used -= sum(len(tokens) for tokens in parts[start:start + block])
+            start += block
+        kept = window[start:]
+        token_ids = [token for tokens in parts[start:] for token in tokens]
+        prefix_length = len(token_ids)
+
+        budget -= used
+        for message in history:
+            if not message.get('retrieved'):
+                continue
+            tokens = self.turn_tokens(message)
+            if len(tokens) > budget:
+                continue
+            budget -= len(tokens)
+            kept.append(message)
+            token_ids.extend(tokens)
+
+        token_ids.extend(tail)
+        return token_ids, kept, prefix_length
+
+    def invalidate(self, message_id: int):
+        """Oublie les tokens d'un message modifié ou supprimé."""
+        with self._lock:
+            self._entries.pop(message_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0,
+            'entries': entries,
+            'max_entries': self.max_entries,
+        }
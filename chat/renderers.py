@@ -0,0 +1,44 @@
+"""
+Renderer JSON rapide pour DRF.
+
+Utilise orjson s'il est installé (`pip install orjson`), sinon le
+`JSONRenderer` de DRF. La sortie est la même que celle de DRF (UTF-8,
+compacte, U+2028/U+2029 échappés) : seul le temps de sérialisation change.
+"""
+
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    `JSONRenderer` sérialisé par orjson.
+
+    Les dates et les types que orjson ne connaît pas (chaînes traduites
+    paresseuses, Decimal, QuerySet...) passent par l'encodeur de DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        # Dates confiées à DRF : même format (suffixe Z pour UTC)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        # orjson ne sait indenter que de deux espaces (API navigable)
+        if self.get_indent(accepted_media_type, renderer_context):
+            option |= orjson.OPT_INDENT_2
+        ret = orjson.dumps(data, default=_encoder.default, option=option)
+        # Comme DRF : ces séparateurs sont valides en JSON mais pas en JavaScript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,176 @@
+"""
+Recherche plein texte dans l'historique des messages.
+
+SQLite : table virtuelle FTS5 `chat_message_fts`, synchronisée par triggers
+(migration 0004). PostgreSQL : index GIN sur `to_tsvector('simple', content)`.
+Les autres moteurs retombent sur un `icontains` non indexé.
+"""
+
+import html
+from typing import List
+
+from django.db import connection
+from django.db.models import F, Func
+
+from .models import Message
+
+# Marqueurs (zone d'usage privé Unicode) posés par le moteur autour des termes
+# trouvés, puis remplacés par <mark> après échappement HTML du texte
+_START = '\ue000'
+_STOP = '\ue001'
+SNIPPET_WORDS = 16
+
+
+def _highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def _fts5_query(query: str) -> str:
+    """
+    Transforme la saisie utilisateur en requête FTS5 sûre : chaque mot est
+    cité (pas d'opérateurs injectés) et le dernier sert de préfixe.
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _search_sqlite(user, query: str, limit: int) -> List[dict]:
+    sql = f"""
+        SELECT m.id, m.conversation_id, c.title, m.role, m.created_at,
+               snippet(chat_message_fts, 0, %s, %s, '…', {SNIPPET_WORDS}),
+               bm25(chat_message_fts) AS rank
+        FROM chat_message_fts
+        JOIN chat_message m ON m.id = chat_message_fts.rowid
+        JOIN chat_conversation c ON c.id = m.conversation_id
+        WHERE chat_message_fts MATCH %s AND c.user_id = %s
+        ORDER BY rank
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_START, _STOP, _fts5_query(query), user.pk, limit])
+        rows = cursor.fetchall()
+
+    created_at_field = Message._meta.get_field('created_at')
+    converters = connection.ops.get_db_converters(created_at_field.get_col(Message._meta.db_table))
+    results = []
+    for message_id, conversation_id, title, role, created_at, snippet, rank in rows:
+        for converter in converters:
+            created_at = converter(created_at, created_at_field, connection)
+        results.append({
+            'id': message_id,
+            'conversation_id': conversation_id,
+            'conversation_title': title,
+            'role': role,
+            'created_at': created_at,
+            'highlight': _highlight(snippet),
+            # bm25 est négatif : plus il est petit, plus le résultat est pertinent
+            'rank': round(-rank, 4),
+        })
+    return results
+
+
+def content_vector() -> Func:
+    """
+    `to_tsvector('simple', content)`, l'expression exacte de l'index GIN.
+
+    `SearchVector` produirait `to_tsvector(..., COALESCE(content, ''))` :
+    une expression différente de celle de l'index, qui ne serait pas utilisé.
+    """
+    from django.contrib.postgres.search import SearchVectorField
+
+    return Func(
+        F('content'),
+        function='to_tsvector',
+        template="%(function)s('simple'::regconfig, %(expressions)s)",
+        output_field=SearchVectorField(),
+    )
+
+
+def _search_postgresql(user, query: str, limit: int) -> List[dict]:
+    from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+
+    search_query = SearchQuery(query, config='simple', search_type='websearch')
+    messages = (
+        Message.objects
+        .filter(conversation__user=user)
+        .annotate(search=content_vector())
+        .filter(search=search_query)
+        .annotate(
+            rank=SearchRank(F('search'), search_query),
+            snippet=SearchHeadline(
+                'content', search_query, config='simple',
+                start_sel=_START, stop_sel=_STOP, max_words=SNIPPET_WORDS,
+            ),
+        )
+        .order_by('-rank')
+        .values('id', 'conversation_id', 'conversation__title', 'role', 'created_at', 'snippet', 'rank')
+        [:limit]
+    )
+    return [
+        {
+            'id': m['id'],
+            'conversation_id': m['conversation_id'],
+            'conversation_title': m['conversation__title'],
+            'role': m['role'],
+            'created_at': m['created_at'],
+            'highlight': _highlight(m['snippet']),
+            'rank': round(m['rank'], 4),
+        }
+        for m in messages
+    ]
+
+
+def _search_fallback(user, query: str, limit: int) -> List[dict]:
+    messages = (
+        Message.objects
+        .filter(conversation__user=user, content__icontains=query)
+        .order_by('-created_at')
+        .values('id', 'conversation_id', 'conversation__title', 'role', 'created_at', 'content')
+        [:limit]
+    )
+    return [
+        {
+            'id': m['id'],
+            'conversation_id': m['conversation_id'],
+            'conversation_title': m['conversation__title'],
+            'role': m['role'],
+            'created_at': m['created_at'],
+            'highlight': html.escape(m['content'][:200]),
+            'rank': 0,
+        }
+        for m in messages
+    ]
+
+
+def search_messages(user, query: str, limit: int = 20) -> List[dict]:
+    """
+    Recherche dans les messages des conversations de `user`.
+
+    Args:
+        user: L'utilisateur dont on parcourt les conversations
+        query: Les mots recherchés
+        limit: Nombre maximal de résultats
+
+    Returns:
+        Résultats classés par pertinence, avec un extrait `highlight` en HTML
+        échappé où les termes trouvés sont entourés de <mark>
+    """
+    if not query.strip():
+        return []
+    if connection.vendor == 'sqlite':
+        return _search_sqlite(user, query, limit)
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(user, query, limit)
+    return _search_fallback(user, query, limit)
+
+
+def rebuild_search_index():
+    """Reconstruit entièrement l'index plein texte."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')")
+            cursor.execute("INSERT INTO chat_message_fts(chat_message_fts) VALUES ('optimize')")
+        elif connection.vendor == 'postgresql':
+            cursor.execute("REINDEX INDEX chat_message_content_fts")
@@ -1,4 +1,9 @@
-from rest_framework import serializers
+from typing import Callable, Iterable, List
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from .models import Conversation, Message
 
 
@@ -14,39 +19,35 @@ class MessageSerializer(serializers.ModelSerializer):
 class ConversationSerializer(serializers.ModelSerializer):
     """Serializer pour les conversations avec les messages."""
     messages = MessageSerializer(many=True, read_only=True)
-    message_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Conversation
         fields = ['id', 'title', 'created_at', 'updated_at', 'messages', 'message_count']
-        read_only_fields = ['id', 'created_at', 'updated_at']
-    
-    def get_message_count(self, obj):
-        return obj.messages.count()
+        read_only_fields = ['id', 'created_at', 'updated_at', 'message_count']
 
 
 class ConversationListSerializer(serializers.ModelSerializer):
-    """Serializer léger pour la liste des conversations (sans les messages)."""
-    message_count = serializers.SerializerMethodField()
+    """
+    Serializer léger pour la liste des conversations (sans les messages).
+    
+    Lit le résumé dénormalisé de `Conversation` : aucune requête sur les
+    messages.
+    """
     last_message = serializers.SerializerMethodField()
     
     class Meta:
         model = Conversation
         fields = ['id', 'title', 'created_at', 'updated_at', 'message_count', 'last_message']
-        read_only_fields = ['id', 'created_at', 'updated_at']
-    
-    def get_message_count(self, obj):
-        return obj.messages.count()
+        read_only_fields = ['id', 'created_at', 'updated_at', 'message_count']
     
     def get_last_message(self, obj):
-        last_msg = obj.messages.last()
-        if last_msg:
-            return {
-                'role': last_msg.role,
-                'content': last_msg.content[:100],
-                'created_at': last_msg.created_at
-            }
-        return None
+        if obj.last_message_at is None:
+            return None
+        return {
+            'role': obj.last_message_role,
+            'content': obj.last_message_preview,
+            'created_at': obj.last_message_at,
+        }
 
 
 class MessageCreateSerializer(serializers.ModelSerializer):
@@ -60,3 +61,83 @@ class MessageCreateSerializer(serializers.ModelSerializer):
         if value not in ['user', 'assistant']:
             raise serializers.ValidationError("Le rôle doit être 'user' ou 'assistant'.")
         return value
+
+
+# Chemin rapide en lecture seule : dictionnaires construits directement depuis
+# `.values_list()`, sans instancier de modèle ni de champ DRF par message. La
+# sortie est identique à celle des serializers ci-dessus (mêmes clés, même
+# format de date) ; tout changement de champ doit être reporté ici.
+
+MESSAGE_VALUES = ('id', 'role', 'content', 'created_at')
+
+
+def datetime_formatter() -> Callable:
+    """
+    Formate les dates comme `serializers.DateTimeField` (ISO 8601 dans le
+    fuseau courant, `Z` pour UTC).
+
+    Le fuseau est lu une seule fois : DRF le relit à chaque valeur, ce qui
+    coûte plus cher que le formatage lui-même.
+    """
+    field = serializers.DateTimeField()
+    if not settings.USE_TZ or (api_settings.DATETIME_FORMAT or '').lower() != ISO_8601:
+        return field.to_representation
+    current = timezone.get_current_timezone()
+
+    def to_representation(value):
+        if not value:
+            return None
+        value = value.astimezone(current).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return to_representation
+
+
+def message_dicts(rows: Iterable[tuple]) -> List[dict]:
+    """Messages au format de `MessageSerializer`, depuis des tuples `MESSAGE_VALUES`."""
+    to_representation = datetime_formatter()
+    return [
+        {'id': pk, 'role': role, 'content': content, 'created_at': to_representation(created_at)}
+        for pk, role, content, created_at in rows
+    ]
+
+
+def conversation_detail(conversation: Conversation) -> dict:
+    """Équivalent rapide de `ConversationSerializer(conversation).data`."""
+    to_representation = datetime_formatter()
+    rows = Message.objects.filter(conversation_id=conversation.pk).values_list(*MESSAGE_VALUES)
+    return {
+        'id': conversation.pk,
+        'title': conversation.title,
+        'created_at': to_representation(conversation.created_at),
+        'updated_at': to_representation(conversation.updated_at),
+        'messages': message_dicts(rows.iterator(chunk_size=2000)),
+        'message_count': conversation.message_count,
+    }
+
+
+CONVERSATION_LIST_VALUES = (
+    'id', 'title', 'created_at', 'updated_at', 'message_count',
+    'last_message_at', 'last_message_role', 'last_message_preview',
+)
+
+
+def conversation_list_dicts(rows: Iterable[tuple]) -> List[dict]:
+    """Conversations au format de `ConversationListSerializer`, depuis des tuples `CONVERSATION_LIST_VALUES`."""
+    to_representation = datetime_formatter()
+    return [
+        {
+            'id': pk,
+            'title': title,
+            'created_at': to_representation(created_at),
+            'updated_at': to_representation(updated_at),
+            'message_count': message_count,
+            'last_message': None if last_at is None else {
+                'role': last_role,
+                'content': last_preview,
+                # Date brute, comme get_last_message : formatée par le renderer
+                'created_at': last_at,
+            },
+        }
+        for pk, title, created_at, updated_at, message_count, last_at, last_role, last_preview in rows
+    ]
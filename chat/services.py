@@ -0,0 +1,355 @@
+"""
+Services de la messagerie : accès aux données partagé par les vues.
+"""
+
+import atexit
+import logging
+import math
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Substr
+
+from cocoja.env_loader import get_env
+
+from . import embeddings
+from .models import Conversation, Message
+from .prompt import context_block_size
+from .signals import record_new_messages
+
+logger = logging.getLogger(__name__)
+
+
+def _context_window_queryset(conversation: Conversation, max_messages: int, block: int):
+    # La fenêtre commence sur une frontière de bloc : elle ne glisse pas d'un
+    # message à chaque tour mais s'allonge jusqu'à `max_messages`, puis perd
+    # ses `block` messages les plus anciens d'un coup. Le début du prompt
+    # reste identique entre deux abandons (cache de préfixe du modèle).
+    count = conversation.message_count
+    limit = count if count <= max_messages else count - math.ceil((count - max_messages) / block) * block
+    # Parcours descendant de l'index (conversation, created_at) : le coût ne
+    # dépend que de `max_messages`, pas de la longueur de la conversation.
+    return (
+        Message.objects
+        .filter(conversation_id=conversation.pk)
+        .order_by('-created_at', '-id')
+        .values('id', 'role', 'content')[:max(limit, 1)]
+    )
+
+
+def _fit_budget(rows: List[dict], max_chars: int, block: int) -> List[dict]:
+    """
+    Abandonne les blocs les plus anciens jusqu'à tenir dans le budget, du plus
+    ancien au plus récent. Le message le plus récent est toujours gardé.
+    """
+    window = rows[::-1]
+    used = sum(len(row['content']) for row in window)
+    while used > max_chars and len(window) > 1:
+        used -= sum(len(row['content']) for row in window[:block])
+        window = window[block:]
+    return window or rows[:1]
+
+
+def _add_retrieved(conversation: Conversation, query: Optional[str], window: List[dict], max_chars: int) -> List[dict]:
+    """
+    Complète la fenêtre récente par les messages plus anciens les plus proches
+    de `query`, dans la limite du budget restant.
+
+    Les messages retrouvés changent à chaque question : ils sont placés après
+    la fenêtre, dans l'ordre chronologique, et marqués `retrieved` pour que le
+    début du prompt reste stable.
+    """
+    top_k = get_env('NLP_RETRIEVAL_TOP_K', 4, int)
+    if not query or top_k <= 0 or conversation.message_count <= len(window):
+        return window
+    budget = max_chars - sum(len(row['content']) for row in window)
+    if budget <= 0:
+        return window
+
+    matches = embeddings.search_similar(
+        conversation.pk,
+        query,
+        top_k,
+        exclude_ids=[row['id'] for row in window],
+        min_score=get_env('NLP_RETRIEVAL_MIN_SCORE', 0.2, float),
+        max_candidates=get_env('NLP_RETRIEVAL_MAX_CANDIDATES', 2000, int) or None,
+    )
+    if not matches:
+        return window
+    rows = Message.objects.filter(id__in=[message_id for message_id, _ in matches]).in_bulk(field_name='id')
+
+    retrieved = []
+    for message_id, _ in matches:
+        message = rows.get(message_id)
+        if message is None or len(message.content) > budget:
+            continue
+        budget -= len(message.content)
+        retrieved.append(message)
+    retrieved.sort(key=lambda message: (message.created_at, message.id))
+    return window + [
+        {'id': m.id, 'role': m.role, 'content': m.content, 'retrieved': True} for m in retrieved
+    ]
+
+
+def get_context_window(
+    conversation: Conversation,
+    max_messages: Optional[int] = None,
+    max_chars: Optional[int] = None,
+    query: Optional[str] = None,
+) -> List[dict]:
+    """
+    Retourne le contexte d'une conversation pour le modèle.
+
+    La fenêtre des derniers messages est bornée à la fois en nombre de messages
+    (`NLP_CONTEXT_MAX_MESSAGES`) et en caractères (`NLP_CONTEXT_MAX_CHARS`) ;
+    l'historique ancien en sort par blocs de `NLP_CONTEXT_BLOCK` messages. Le
+    message le plus récent est toujours inclus. Si `query` est fourni et que
+    la conversation dépasse la fenêtre, jusqu'à `NLP_RETRIEVAL_TOP_K` messages
+    plus anciens proches de la question sont ajoutés dans le budget restant.
+
+    Args:
+        conversation: La conversation
+        max_messages: Nombre maximal de messages récents
+        max_chars: Budget total en caractères
+        query: La question posée, pour la recherche sémantique
+
+    Returns:
+        Liste [{id, role, content}, ...] : la fenêtre du plus ancien au plus
+        récent, puis les messages retrouvés (`retrieved`)
+    """
+    max_messages = max_messages or get_env('NLP_CONTEXT_MAX_MESSAGES', 10, int)
+    max_chars = max_chars or get_env('NLP_CONTEXT_MAX_CHARS', 4000, int)
+    block = context_block_size(max_messages)
+    rows = list(_context_window_queryset(conversation, max_messages, block))
+    return _add_retrieved(conversation, query, _fit_budget(rows, max_chars, block), max_chars)
+
+
+async def aget_context_window(
+    conversation: Conversation,
+    max_messages: Optional[int] = None,
+    max_chars: Optional[int] = None,
+    query: Optional[str] = None,
+) -> List[dict]:
+    """Version asynchrone de `get_context_window`."""
+    max_messages = max_messages or get_env('NLP_CONTEXT_MAX_MESSAGES', 10, int)
+    max_chars = max_chars or get_env('NLP_CONTEXT_MAX_CHARS', 4000, int)
+    block = context_block_size(max_messages)
+    rows = [row async for row in _context_window_queryset(conversation, max_messages, block)]
+    window = _fit_budget(rows, max_chars, block)
+    return await sync_to_async(_add_retrieved)(conversation, query, window, max_chars)
+
+
+def save_exchange(conversation: Conversation, user_input: str, response: str) -> List[Message]:
+    """
+    Enregistre une question et la réponse du modèle en une seule transaction.
+
+    Les deux messages sont insérés par un `bulk_create` et le résumé de la
+    conversation (compteur, dernier message, `updated_at`) ainsi que les
+    vecteurs sémantiques sont écrits dans le même commit : un seul verrou
+    d'écriture sous SQLite. Les vecteurs sont calculés avant d'ouvrir la
+    transaction pour ne pas allonger ce verrou.
+
+    Returns:
+        Les messages créés [question, réponse]
+    """
+    messages = [
+        Message(conversation=conversation, role='user', content=user_input),
+        Message(conversation=conversation, role='assistant', content=response),
+    ]
+    vectors = embeddings.encode([user_input, response])
+    with transaction.atomic():
+        # bulk_create n'émet pas post_save : résumé et vecteurs sont écrits ici
+        Message.objects.bulk_create(messages)
+        record_new_messages(conversation.pk, messages)
+        embeddings.index_messages(messages, vectors)
+    return messages
+
+
+class WriteBehindQueue:
+    """
+    File d'écritures différées, vidée par un thread dédié.
+
+    Permet de répondre au client sans attendre l'insertion en base. Les
+    erreurs sont journalisées : une écriture perdue ne casse pas la requête.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, func: Callable, *args):
+        self._queue.put((func, args))
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        Attend que toutes les écritures en attente soient faites.
+
+        Returns:
+            False si le délai a expiré avant la fin
+        """
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                close_old_connections()
+                func(*args)
+            except Exception:
+                logger.exception("Échec d'une écriture différée")
+            finally:
+                self._queue.task_done()
+
+
+_write_behind: Optional[WriteBehindQueue] = None
+_write_behind_lock = threading.Lock()
+
+
+def get_write_behind_queue() -> Optional[WriteBehindQueue]:
+    """Retourne la file d'écritures différées, ou None si `CHAT_WRITE_BEHIND` est désactivé."""
+    global _write_behind
+    if not get_env('CHAT_WRITE_BEHIND', False, bool):
+        return None
+    if _write_behind is None:
+        with _write_behind_lock:
+            if _write_behind is None:
+                _write_behind = WriteBehindQueue()
+                # Vider la file avant l'arrêt du worker
+                atexit.register(_write_behind.flush)
+    return _write_behind
+
+
+def persist_exchange(conversation: Conversation, user_input: str, response: str):
+    """
+    Enregistre un échange, immédiatement ou via la file d'écritures différées.
+    """
+    write_behind = get_write_behind_queue()
+    if write_behind is not None:
+        write_behind.enqueue(save_exchange, conversation, user_input, response)
+    else:
+        save_exchange(conversation, user_input, response)
+
+
+def insert_rows(model, objs: Sequence, field_names: Optional[Sequence[str]] = None,
+                returning: bool = False) -> Optional[List[int]]:
+    """
+    Insère des objets tels quels, en SQL brut.
+
+    Contrairement à `bulk_create`, les dates fournies sont écrites même pour
+    les champs `auto_now` / `auto_now_add` : chaque ligne n'est écrite qu'une
+    fois. Aucun signal n'est émis.
+
+    Args:
+        model: Modèle cible
+        objs: Instances à insérer
+        field_names: Champs écrits (par défaut tous sauf la clé primaire)
+        returning: Renvoyer les clés primaires créées, dans l'ordre de `objs`
+
+    Returns:
+        Les clés primaires si `returning`, None sinon
+    """
+    opts = model._meta
+    if field_names is None:
+        fields = [field for field in opts.concrete_fields if not field.primary_key]
+    else:
+        fields = [opts.get_field(name) for name in field_names]
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    columns = ', '.join(qn(field.column) for field in fields)
+    placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+    rows = [
+        [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+        for obj in objs
+    ]
+    sql = f'INSERT INTO {table} ({columns}) VALUES {placeholders}'
+    with connection.cursor() as cursor:
+        if not returning:
+            cursor.executemany(sql, rows)
+            return None
+        ids = []
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # Pas de RETURNING sur plusieurs lignes : une requête par ligne
+            for row in rows:
+                cursor.execute(sql, row)
+                ids.append(connection.ops.last_insert_id(cursor, opts.db_table, opts.pk.column))
+            return ids
+        batch_size = connection.ops.bulk_batch_size(fields, objs)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES {", ".join([placeholders] * len(batch))} '
+                f'RETURNING {qn(opts.pk.column)}',
+                [value for row in batch for value in row],
+            )
+            ids.extend(row[0] for row in cursor.fetchall())
+    return ids
+
+
+SUMMARY_FIELDS = ['message_count', 'last_message_at', 'last_message_role', 'last_message_preview']
+
+
+def reconcile_conversation_stats(batch_size: int = 500, after_pk: int = 0) -> Tuple[int, int]:
+    """
+    Recalcule le résumé dénormalisé des conversations depuis leurs messages.
+
+    Sert à la correction d'éventuelles dérives et après un import. Les
+    conversations archivées sont ignorées : leurs messages ne sont plus dans
+    la table, leur résumé est conservé tel quel.
+
+    Args:
+        batch_size: Nombre de conversations traitées par lot
+        after_pk: Ne vérifier que les conversations d'id supérieur (import)
+
+    Returns:
+        (conversations vérifiées, conversations corrigées)
+    """
+    messages = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id')
+    count = messages.order_by().values('conversation').annotate(total=Count('pk')).values('total')
+    expected = Conversation.objects.filter(archived_at__isnull=True).annotate(
+        expected_count=Subquery(count),
+        expected_at=Subquery(messages.values('created_at')[:1]),
+        expected_role=Subquery(messages.values('role')[:1]),
+        expected_preview=Subquery(
+            messages.annotate(preview=Substr('content', 1, 100)).values('preview')[:1]
+        ),
+    ).order_by('pk')
+
+    checked = fixed = 0
+    last_pk = after_pk
+    while True:
+        batch = list(expected.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        drifted = []
+        for conversation in batch:
+            values = {
+                'message_count': conversation.expected_count or 0,
+                'last_message_at': conversation.expected_at,
+                'last_message_role': conversation.expected_role or '',
+                'last_message_preview': conversation.expected_preview or '',
+            }
+            if any(getattr(conversation, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(conversation, field, value)
+                drifted.append(conversation)
+        Conversation.objects.bulk_update(drifted, SUMMARY_FIELDS)
+        checked += len(batch)
+        fixed += len(drifted)
+    return checked, fixed
@@ -0,0 +1,96 @@
+"""
+Maintien du résumé dénormalisé de `Conversation` (nombre de messages,
+dernier message) et des vecteurs sémantiques lors des écritures de `Message`.
+
+Les mises à jour passent par des expressions F() : elles sont atomiques
+même si plusieurs messages sont écrits en parallèle. `Message.save()` et la
+suppression (collecteur de Django) ouvrent une transaction : le résumé est
+écrit dans le même commit que le message.
+"""
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Conversation, Message
+from .nlp_model import invalidate_message
+
+PREVIEW_LENGTH = 100
+
+
+def record_new_messages(conversation_id, messages):
+    """
+    Met à jour le résumé d'une conversation après l'ajout de `messages`.
+
+    Le dernier message n'est remplacé que s'il est plus récent que celui déjà
+    enregistré (imports hors ordre). `updated_at` est mis à jour dans la même
+    requête (`auto_now` ne s'applique pas aux `update()`).
+    """
+    if not messages:
+        return
+    latest = max(messages, key=lambda message: (message.created_at, message.pk or 0))
+    is_newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=latest.created_at)
+    Conversation.objects.filter(pk=conversation_id).update(
+        updated_at=timezone.now(),
+        message_count=F('message_count') + len(messages),
+        last_message_at=Case(When(is_newer, then=Value(latest.created_at)), default=F('last_message_at')),
+        last_message_role=Case(When(is_newer, then=Value(latest.role)), default=F('last_message_role')),
+        last_message_preview=Case(
+            When(is_newer, then=Value(latest.content[:PREVIEW_LENGTH])),
+            default=F('last_message_preview'),
+        ),
+    )
+
+
+def refresh_last_message(conversation_id):
+    """Recalcule le dernier message d'une conversation (une requête indexée)."""
+    last = (
+        Message.objects
+        .filter(conversation_id=conversation_id)
+        .order_by('-created_at', '-id')
+        .values('created_at', 'role', 'content')
+        .first()
+    )
+    Conversation.objects.filter(pk=conversation_id).update(
+        last_message_at=last['created_at'] if last else None,
+        last_message_role=last['role'] if last else '',
+        last_message_preview=last['content'][:PREVIEW_LENGTH] if last else '',
+    )
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    from .embeddings import index_messages
+
+    # Création ou modification : le vecteur suit le contenu
+    index_messages([instance])
+    if created:
+        record_new_messages(instance.conversation_id, [instance])
+    else:
+        invalidate_message(instance.pk)
+        # Modification : l'aperçu change si c'est le dernier message
+        Conversation.objects.filter(
+            pk=instance.conversation_id, last_message_at=instance.created_at
+        ).update(
+            last_message_role=instance.role,
+            last_message_preview=instance.content[:PREVIEW_LENGTH],
+        )
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, origin=None, **kwargs):
+    invalidate_message(instance.pk)
+    # Suppression en cascade (conversation, utilisateur) : rien d'autre à maintenir
+    deleting_messages = isinstance(origin, Message) or getattr(origin, 'model', None) is Message
+    if origin is not None and not deleting_messages:
+        return
+    with transaction.atomic():
+        Conversation.objects.filter(pk=instance.conversation_id).update(
+            message_count=Greatest(F('message_count') - 1, 0)
+        )
+        refresh_last_message(instance.conversation_id)
@@ -0,0 +1,98 @@
+"""
+Utilitaires pour les réponses en streaming (Server-Sent Events, NDJSON).
+"""
+
+import json
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+
+def sse_event(event: str, data: dict) -> str:
+    """
+    Formate un événement Server-Sent Events.
+
+    Args:
+        event: Nom de l'événement (token, done, error...)
+        data: Données sérialisées en JSON dans le champ `data`
+
+    Returns:
+        L'événement formaté, terminé par une ligne vide
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renderer `text/event-stream` pour la négociation de contenu DRF.
+
+    Les réponses classiques (erreurs de validation...) renvoyées à un client
+    SSE sont émises sous forme d'un unique événement `error`.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event('error', data or {}).encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renderer `application/x-ndjson` pour la négociation de contenu DRF.
+
+    Les réponses classiques (erreurs) sont émises sur une seule ligne JSON.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data or {}, ensure_ascii=False) + '\n').encode(self.charset)
+
+
+async def aiterate(iterator: Iterator) -> AsyncIterator:
+    """
+    Adapte un itérateur synchrone pour un serveur ASGI.
+
+    Chaque élément est produit dans le thread de la requête (ORM compris),
+    sans bloquer la boucle d'événements. Si le client se déconnecte,
+    l'itérateur synchrone est fermé pour libérer ses ressources.
+    """
+    sentinel = object()
+    next_part = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            part = await next_part(iterator, sentinel)
+            if part is sentinel:
+                break
+            yield part
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=True)()
+
+
+def stream_response(request, content: Iterator, content_type: str) -> StreamingHttpResponse:
+    """
+    Construit une réponse en streaming adaptée au serveur (WSGI ou ASGI).
+
+    Sous ASGI (`cocoja.asgi.application`), Django doit recevoir un itérateur
+    asynchrone, sinon il met tout le contenu en mémoire avant de l'envoyer.
+    """
+    django_request = getattr(request, '_request', request)
+    if isinstance(django_request, ASGIRequest):
+        content = aiterate(content)
+    return StreamingHttpResponse(content, content_type=content_type)
+
+
+def sse_response(request, events: Iterator[str]) -> StreamingHttpResponse:
+    """Construit une réponse SSE adaptée au serveur (WSGI ou ASGI)."""
+    response = stream_response(request, events, 'text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,3 +1,1266 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import AsyncClient, SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from cocoja.env_loader import load_env_file, parse_database_url
+
+from . import benchmark, metrics, nlp_model, throttling
+from .admission import AdmissionController, AdmissionRejected
+from .archive import archive_idle_conversations
+from .engines import InferenceEngine
+from .export import export_chunks, import_records, iter_records
+from .model_server import ModelClient, ModelServer, ModelServerBusy, ModelServerError, get_authkey
+from .models import Conversation, ConversationArchive, Message, MessageEmbedding
+from .nlp_model import AdmittedStream, MemoryResponseCache, PrefixCache, SQLiteResponseCache, start_model_warmup
+from .prompt import PromptBuilder, word_token_ids
+from .search import content_vector
+from .serializers import ConversationListSerializer, ConversationSerializer, MessageSerializer
+from .services import get_context_window, save_exchange
+from .throttling import SQLiteBucketStore
+from .weights import load_weights, save_safetensors
+
+User = get_user_model()
+
+
+def isolate_bucket_store(test):
+    """Seaux de la limitation dans un fichier temporaire, le temps du test."""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    store = SQLiteBucketStore(Path(directory.name) / 'ratelimit.sqlite3')
+    for patcher in (
+        mock.patch.dict(os.environ, {'RATE_LIMIT_BACKEND': 'sqlite'}),
+        mock.patch.object(throttling, '_bucket_store', store),
+    ):
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+class ConversationListTestCase(TestCase):
+    """Liste des conversations (barre latérale)."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'motdepasse123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _create_conversations(self, count, messages_per_conversation=3):
+        for i in range(count):
+            conversation = Conversation.objects.create(user=self.user, title=f'Conversation {i}')
+            for j in range(messages_per_conversation):
+                Message.objects.create(
+                    conversation=conversation,
+                    role='user' if j % 2 == 0 else 'assistant',
+                    content=f'Message {j} ' + 'x' * 150,
+                )
+
+    def test_list_returns_count_and_last_message(self):
+        self._create_conversations(1)
+        Conversation.objects.create(user=self.user, title='Vide')
+
+        response = self.client.get('/api/chat/conversations/')
+
+        self.assertEqual(response.status_code, 200)
+        by_title = {c['title']: c for c in response.json()}
+        self.assertEqual(by_title['Conversation 0']['message_count'], 3)
+        last_message = by_title['Conversation 0']['last_message']
+        self.assertEqual(last_message['role'], 'user')
+        self.assertTrue(last_message['content'].startswith('Message 2 '))
+        self.assertEqual(len(last_message['content']), 100)
+        self.assertEqual(by_title['Vide']['message_count'], 0)
+        self.assertIsNone(by_title['Vide']['last_message'])
+
+    def test_list_query_count_does_not_grow_with_conversations(self):
+        self._create_conversations(2)
+        with self.assertNumQueries(1):
+            self.client.get('/api/chat/conversations/')
+
+        self._create_conversations(50)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/chat/conversations/')
+        self.assertEqual(len(response.json()), 52)
+
+
+class ConversationSummaryTestCase(TestCase):
+    """Résumé dénormalisé de Conversation (nombre et dernier message)."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'motdepasse123')
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def test_summary_follows_message_writes(self):
+        first = Message.objects.create(conversation=self.conversation, role='user', content='Bonjour')
+        last = Message.objects.create(conversation=self.conversation, role='assistant', content='Salut !')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(self.conversation.last_message_role, 'assistant')
+        self.assertEqual(self.conversation.last_message_preview, 'Salut !')
+
+        last.delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 1)
+        self.assertEqual(self.conversation.last_message_at, first.created_at)
+        self.assertEqual(self.conversation.last_message_preview, 'Bonjour')
+
+        first.delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 0)
+        self.assertIsNone(self.conversation.last_message_at)
+
+    def test_failed_summary_update_rolls_back_the_message(self):
+        with mock.patch('chat.signals.record_new_messages', side_effect=DatabaseError('verrou')):
+            with self.assertRaises(DatabaseError):
+                Message.objects.create(conversation=self.conversation, role='user', content='Bonjour')
+
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 0)
+
+    def test_reconcile_fixes_drift(self):
+        Message.objects.create(conversation=self.conversation, role='user', content='Bonjour')
+        Conversation.objects.filter(pk=self.conversation.pk).update(message_count=42, last_message_preview='')
+
+        call_command('reconcile_conversation_stats', stdout=StringIO())
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 1)
+        self.assertEqual(self.conversation.last_message_preview, 'Bonjour')
+
+
+class SaveExchangeTestCase(TestCase):
+    """Enregistrement transactionnel d'un échange question/réponse."""
+
+    def setUp(self):
+        isolate_bucket_store(self)
+        self.user = User.objects.create_user('carol', 'carol@example.com', 'motdepasse123')
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def test_ask_model_saves_exchange_and_touches_conversation(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        updated_at = self.conversation.updated_at
+
+        response = client.post(
+            '/api/chat/ask/',
+            {'question': 'Bonjour', 'conversation_id': self.conversation.id},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        roles = list(self.conversation.messages.values_list('role', flat=True))
+        self.assertEqual(roles, ['user', 'assistant'])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(self.conversation.last_message_role, 'assistant')
+        self.assertGreater(self.conversation.updated_at, updated_at)
+
+    def test_save_exchange_is_atomic(self):
+        with self.assertNumQueries(5):  # savepoint, insert, update, vecteurs, release
+            save_exchange(self.conversation, 'Question', 'Réponse')
+
+
+class StreamingTestCase(TestCase):
+    """Réponses en Server-Sent Events (`/api/chat/ask/stream/`)."""
+
+    def setUp(self):
+        isolate_bucket_store(self)
+        self.user = User.objects.create_user('erin', 'erin@example.com', 'motdepasse123')
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self):
+        return self.client.post(
+            '/api/chat/ask/stream/',
+            {'question': 'Bonjour', 'conversation_id': self.conversation.id},
+            format='json',
+        )
+
+    def test_sends_token_events_then_done_and_saves_the_exchange(self):
+        response = self.post()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode().strip().split('\n\n')
+        names = [event.split('\n')[0] for event in events]
+        self.assertEqual(set(names[:-1]), {'event: token'})
+        self.assertEqual(names[-1], 'event: done')
+        answer = "Bonjour ! Comment puis-je vous aider aujourd'hui ?"
+        self.assertEqual(events[-1].split('\n')[1], 'data: ' + json.dumps({'answer': answer}, ensure_ascii=False))
+        contents = list(self.conversation.messages.values_list('content', flat=True))
+        self.assertEqual(contents, ['Bonjour', answer])
+
+    def test_abandoned_stream_writes_nothing(self):
+        response = self.post()
+
+        next(iter(response.streaming_content))
+        response.close()
+
+        self.assertFalse(self.conversation.messages.exists())
+
+    def test_errors_before_the_stream_are_json(self):
+        cases = [(ModelServerBusy('Serveur de modèle saturé'), 503), (RuntimeError('Poids introuvables'), 500)]
+        for error, status_code in cases:
+            with self.subTest(status_code), mock.patch('chat.views.generate_ai_response_stream', side_effect=error):
+                response = self.post()
+
+            self.assertEqual(response.status_code, status_code)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertIn(str(error), response.json()['error'])
+
+
+class AsyncAskTestCase(TestCase):
+    """Vue asynchrone `/api/chat/ask/async/`."""
+
+    def setUp(self):
+        isolate_bucket_store(self)
+        self.user = User.objects.create_user('frank', 'frank@example.com', 'motdepasse123')
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    async def test_anonymous_question_is_answered(self):
+        response = await AsyncClient().post(
+            '/api/chat/ask/async/', {'question': 'Bonjour'}, content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Bonjour', response.json()['answer'])
+
+    async def test_authenticated_question_saves_the_exchange(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+
+        response = await client.post(
+            '/api/chat/ask/async/',
+            {'question': 'Bonjour', 'conversation_id': self.conversation.id},
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self.conversation.messages.acount(), 2)
+
+    async def test_session_without_csrf_token_is_refused(self):
+        client = AsyncClient(enforce_csrf_checks=True)
+        await client.aforce_login(self.user)
+
+        response = await client.post(
+            '/api/chat/ask/async/', {'question': 'Bonjour'}, content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('CSRF', response.json()['detail'])
+
+    async def test_guest_is_throttled(self):
+        client = AsyncClient()
+        with mock.patch.dict(os.environ, {'RATE_LIMIT_GUEST': '1', 'RATE_LIMIT_PERIOD': '3600'}):
+            statuses = [
+                (await client.post(
+                    '/api/chat/ask/async/', {'question': 'Bonjour'}, content_type='application/json'
+                )).status_code
+                for _ in range(2)
+            ]
+
+        self.assertEqual(statuses, [200, 429])
+
+    async def test_generation_runs_in_the_bounded_model_pool(self):
+        threads = []
+
+        def generate(user_input, *args):
+            threads.append(threading.current_thread().name)
+            return 'Réponse'
+
+        previous = nlp_model._model_executor
+        nlp_model._model_executor = None
+        try:
+            with mock.patch.dict(os.environ, {'NLP_MAX_CONCURRENCY': '2', 'NLP_CACHE_BACKEND': 'none'}), \
+                    mock.patch.object(nlp_model, '_generate', generate):
+                response = await AsyncClient().post(
+                    '/api/chat/ask/async/', {'question': 'Bonjour'}, content_type='application/json'
+                )
+                executor = nlp_model.get_model_executor()
+        finally:
+            nlp_model._model_executor.shutdown()
+            nlp_model._model_executor = previous
+
+        self.assertEqual(response.json(), {'answer': 'Réponse'})
+        self.assertEqual(executor._max_workers, 2)
+        self.assertTrue(threads[0].startswith('nlp-model'))
+
+    async def test_cache_hit_does_not_take_a_model_slot(self):
+        cache = MemoryResponseCache(1024, 60)
+        cache.set(nlp_model.response_cache_key('Bonjour', None, 512, 0.0), 'En cache')
+        admission = mock.Mock()
+        with mock.patch.dict(os.environ, {'NLP_STANDALONE_TEMPERATURE': '0'}), \
+                mock.patch.object(nlp_model, 'get_response_cache', return_value=cache), \
+                mock.patch.object(nlp_model, 'get_admission_controller', return_value=admission):
+            answer = await nlp_model.agenerate_ai_response('Bonjour', priority='guest')
+
+        self.assertEqual(answer, 'En cache')
+        admission.enter.assert_not_called()
+
+
+class ContextWindowTestCase(TestCase):
+    """Fenêtre des derniers messages envoyée au modèle."""
+
+    def setUp(self):
+        user = User.objects.create_user('gina', 'gina@example.com', 'motdepasse123')
+        self.conversation = Conversation.objects.create(user=user)
+        for i in range(3):
+            save_exchange(self.conversation, f'Question {i}', f'Réponse {i}')
+        self.conversation.refresh_from_db()
+
+    def test_returns_latest_messages_in_chronological_order_in_one_query(self):
+        with self.assertNumQueries(1):
+            context = get_context_window(self.conversation, max_messages=4)
+
+        self.assertEqual(
+            [message['content'] for message in context],
+            ['Question 1', 'Réponse 1', 'Question 2', 'Réponse 2'],
+        )
+        self.assertEqual([message['role'] for message in context], ['user', 'assistant'] * 2)
+
+    def test_character_budget_keeps_the_most_recent_messages(self):
+        context = get_context_window(self.conversation, max_messages=4, max_chars=19)
+
+        self.assertEqual([message['content'] for message in context], ['Question 2', 'Réponse 2'])
+
+    def test_latest_message_is_kept_even_over_budget(self):
+        context = get_context_window(self.conversation, max_messages=4, max_chars=1)
+
+        self.assertEqual([message['content'] for message in context], ['Réponse 2'])
+
+    def test_window_start_only_moves_by_blocks(self):
+        starts = []
+        for i in range(3, 8):
+            starts.append(get_context_window(self.conversation, max_messages=8)[0]['content'])
+            save_exchange(self.conversation, f'Question {i}', f'Réponse {i}')
+            self.conversation.refresh_from_db()
+
+        # Blocs de 4 messages (moitié de la fenêtre) : deux tours par bloc
+        self.assertEqual(starts, ['Question 0', 'Question 0', 'Question 2', 'Question 2', 'Question 4'])
+
+
+class MessagePaginationTestCase(TestCase):
+    """Pagination par curseur des messages, y compris à dates identiques."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('hugo', 'hugo@example.com', 'motdepasse123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.conversation = Conversation.objects.create(user=self.user)
+        for i in range(11):
+            Message.objects.create(conversation=self.conversation, role='user', content=f'Message {i}')
+        # Messages insérés dans la même milliseconde (import, lot)
+        same_time = timezone.now() - timedelta(hours=1)
+        Message.objects.filter(pk__in=list(
+            self.conversation.messages.order_by('id').values_list('id', flat=True)[2:9]
+        )).update(created_at=same_time)
+
+    def collect(self, url):
+        ids = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [message['id'] for message in response.json()['results']]
+            url = response.json()['next']
+            pages += 1
+        return ids, pages
+
+    def test_following_next_visits_every_message_once_in_order(self):
+        expected = list(
+            self.conversation.messages.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        urls = [
+            f'/api/chat/conversations/{self.conversation.id}/messages/?page_size=3',
+            '/api/chat/messages/?page_size=3',
+        ]
+        for url in urls:
+            with self.subTest(url):
+                ids, pages = self.collect(url)
+
+                self.assertEqual(ids, expected)
+                self.assertEqual(pages, 4)
+
+
+class ContextRetrievalTestCase(TestCase):
+    """Sélection du contexte : fenêtre récente et messages anciens pertinents."""
+
+    def setUp(self):
+        user = User.objects.create_user('frank', 'frank@example.com', 'motdepasse123')
+        self.conversation = Conversation.objects.create(user=user)
+        save_exchange(self.conversation, 'Mon chien s\'appelle Rex.', 'Enchanté, Rex !')
+        for i in range(10):
+            save_exchange(self.conversation, f'Question de calcul numéro {i}', f'Réponse {i}')
+        self.conversation.refresh_from_db()
+
+    def test_old_relevant_message_is_added_after_recent_window(self):
+        context = get_context_window(self.conversation, max_messages=4, query='Comment s\'appelle mon chien ?')
+
+        self.assertEqual(len(context), 5)
+        self.assertEqual(context[3]['content'], 'Réponse 9')
+        self.assertEqual(context[-1]['content'], 'Mon chien s\'appelle Rex.')
+        self.assertTrue(context[-1]['retrieved'])
+
+    def test_retrieval_respects_budget(self):
+        context = get_context_window(self.conversation, max_messages=4, max_chars=50, query='mon chien')
+
+        self.assertTrue(all('chien' not in message['content'] for message in context))
+
+    def test_only_recent_vectors_are_candidates(self):
+        with mock.patch.dict(os.environ, {'NLP_RETRIEVAL_MAX_CANDIDATES': '6'}):
+            context = get_context_window(self.conversation, max_messages=4, query='Comment s\'appelle mon chien ?')
+
+        self.assertTrue(all('chien' not in message['content'] for message in context))
+
+
+class SearchTestCase(TestCase):
+    """Recherche plein texte dans l'historique."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('dave', 'dave@example.com', 'motdepasse123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        conversation = Conversation.objects.create(user=self.user, title='Cuisine')
+        save_exchange(conversation, 'Une recette de crêpes ?', 'Farine, œufs, lait <b>et</b> beurre.')
+        other = User.objects.create_user('eve', 'eve@example.com', 'motdepasse123')
+        save_exchange(Conversation.objects.create(user=other), 'Des crêpes ?', 'Non.')
+
+    def test_search_is_scoped_and_highlighted(self):
+        response = self.client.get('/api/chat/search/', {'q': 'crepes'})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['conversation_title'], 'Cuisine')
+        self.assertIn('<mark>crêpes</mark>', results[0]['highlight'])
+
+    def test_index_follows_updates_and_escapes_html(self):
+        message = Message.objects.get(role='assistant', conversation__user=self.user)
+        message.content = 'Beurre <b>salé</b>'
+        message.save()
+
+        results = self.client.get('/api/chat/search/', {'q': 'farine'}).json()['results']
+        self.assertEqual(results, [])
+        results = self.client.get('/api/chat/search/', {'q': 'sal'}).json()['results']
+        self.assertEqual(results[0]['highlight'], 'Beurre &lt;b&gt;<mark>salé</mark>&lt;/b&gt;')
+
+    def test_postgresql_vector_is_the_gin_index_expression(self):
+        # Index de la migration 0004 : to_tsvector('simple', content)
+        sql = str(Message.objects.annotate(search=content_vector()).values('search').query)
+
+        self.assertIn('to_tsvector(\'simple\'::regconfig, "chat_message"."content")', sql)
+        self.assertNotIn('COALESCE', sql)
+
+
+class PromptBuilderTestCase(SimpleTestCase):
+    """Assemblage du prompt sous budget de tokens."""
+
+    def setUp(self):
+        self.encoded = []
+
+        def encode(text):
+            self.encoded.append(text)
+            return word_token_ids(text)
+
+        self.builder = PromptBuilder(encode)
+        self.history = [
+            {'id': i, 'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'message {i}'}
+            for i in range(1000)
+        ]
+
+    def test_history_is_truncated_from_the_oldest_turn(self):
+        token_ids, kept, _ = self.builder.build('Bonjour', self.history, 50)
+
+        self.assertLessEqual(len(token_ids), 50)
+        self.assertEqual(kept[-1]['id'], 999)
+        self.assertEqual([m['id'] for m in kept], list(range(1000 - len(kept), 1000)))
+
+    def test_only_the_new_turn_is_tokenized_on_follow_up(self):
+        self.builder.build('Bonjour', self.history, 50)
+        self.encoded.clear()
+
+        self.builder.build('Et ensuite ?', self.history, 50)
+
+        self.assertEqual(self.encoded, ['USER: Et ensuite ?\n'])
+
+    def test_edited_message_is_retokenized_even_at_the_same_length(self):
+        message = {'id': 1, 'role': 'user', 'content': 'message A'}
+        self.builder.turn_tokens(message)
+
+        tokens = self.builder.turn_tokens(dict(message, content='message B'))
+
+        self.assertEqual(tokens, word_token_ids('USER: message B\n'))
+        self.assertEqual(self.builder.misses, 2)
+
+    def test_history_is_dropped_by_blocks_after_retrieved_turns(self):
+        history = self.history[-6:] + [dict(self.history[0], retrieved=True)]
+        window_tokens = len(word_token_ids('USER: message 998\n')) * 4
+
+        token_ids, kept, prefix_length = self.builder.build('Bonjour', history, window_tokens + 8, block=2)
+
+        self.assertEqual([m['id'] for m in kept], [996, 997, 998, 999])
+        self.assertEqual(prefix_length, window_tokens)
+        self.assertEqual(token_ids[:prefix_length], [
+            token for message in kept for token in self.builder.turn_tokens(message)
+        ])
+
+
+class FakeClock:
+    """Horloge factice : avance d'une seconde à chaque lecture."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+    monotonic = time
+
+
+class ResponseCacheTestCase(SimpleTestCase):
+    """Caches de réponses en mémoire et SQLite : hits, LRU, expiration."""
+
+    def caches(self, max_bytes=1024, ttl=50):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return [
+            MemoryResponseCache(max_bytes, ttl),
+            SQLiteResponseCache(Path(directory.name) / 'cache.sqlite3', max_bytes, ttl),
+        ]
+
+    def test_hits_and_misses(self):
+        for cache in self.caches():
+            with self.subTest(type(cache).__name__):
+                self.assertIsNone(cache.get('bonjour'))
+                cache.set('bonjour', 'Bonjour !')
+
+                self.assertEqual(cache.get('bonjour'), 'Bonjour !')
+                self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        clock = FakeClock()
+        with mock.patch.object(nlp_model, 'time', clock):
+            for cache in self.caches(max_bytes=10):
+                with self.subTest(type(cache).__name__):
+                    cache.set('a', 'aaaa')
+                    cache.set('b', 'bbbb')
+                    cache.get('a')
+                    cache.set('c', 'cccc')
+
+                    self.assertEqual([cache.get(key) for key in 'abc'], ['aaaa', None, 'cccc'])
+                    self.assertLessEqual(cache.stats()['bytes'], 10)
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        with mock.patch.object(nlp_model, 'time', clock):
+            for cache in self.caches(ttl=50):
+                with self.subTest(type(cache).__name__):
+                    cache.set('bonjour', 'Bonjour !')
+                    clock.now += 100
+
+                    self.assertIsNone(cache.get('bonjour'))
+
+    def generate_twice(self, **env):
+        previous = nlp_model._response_cache
+        nlp_model._response_cache = None
+        self.addCleanup(setattr, nlp_model, '_response_cache', previous)
+        with mock.patch.dict(os.environ, {'NLP_CACHE_BACKEND': 'memory', **env}), \
+                mock.patch.object(nlp_model, '_generate', return_value='Bonjour !') as generate:
+            if 'NLP_STANDALONE_TEMPERATURE' not in env:
+                os.environ.pop('NLP_STANDALONE_TEMPERATURE', None)
+            answers = [nlp_model.generate_ai_response('Bonjour') for _ in range(2)]
+            nlp_model.generate_ai_response('Bonjour', [{'role': 'user', 'content': 'Salut'}])
+        self.assertEqual(answers, ['Bonjour !'] * 2)
+        return [call.args[3] for call in generate.call_args_list]
+
+    def test_sampled_standalone_question_is_not_cached_by_default(self):
+        self.assertEqual(self.generate_twice(), [0.7, 0.7, 0.7])
+
+    def test_standalone_question_is_generated_once_when_deterministic(self):
+        self.assertEqual(self.generate_twice(NLP_STANDALONE_TEMPERATURE='0'), [0.0, 0.7])
+
+
+class PrefixCacheTestCase(SimpleTestCase):
+    """Réutilisation de l'état de préfixe entre les tours d'une conversation."""
+
+    def test_follow_up_turn_reuses_prefix(self):
+        cache = PrefixCache(max_bytes=1024)
+        state = memoryview(bytes(100))
+        cache.store(1, [1, 2, 3], state)
+
+        self.assertEqual(cache.take(1, [1, 2, 3, 4, 5]), (state, 3))
+        # L'état est retiré tant que la génération ne l'a pas rendu
+        self.assertEqual(cache.take(1, [1, 2, 3, 4, 5]), (None, 0))
+
+    def test_changed_history_misses(self):
+        cache = PrefixCache(max_bytes=1024)
+        cache.store(1, [1, 2, 3], memoryview(bytes(100)))
+
+        self.assertEqual(cache.take(1, [1, 9, 3, 4]), (None, 0))
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_eviction_is_bounded_in_bytes(self):
+        cache = PrefixCache(max_bytes=250)
+        for conversation_id in range(3):
+            cache.store(conversation_id, [conversation_id], memoryview(bytes(100)))
+        cache.invalidate(2)
+
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertLessEqual(stats['bytes'], 250)
+
+
+class PreloadTestCase(SimpleTestCase):
+    """Préchargement du modèle au démarrage, sur demande explicite."""
+
+    def ready(self, argv, **env):
+        env = {'NLP_PRELOAD': '', 'NLP_SERVER_SOCKET': '', **env}
+        with mock.patch.dict(os.environ, env), mock.patch.object(sys, 'argv', argv), \
+                mock.patch.object(nlp_model, 'start_model_warmup') as warmup:
+            apps.get_app_config('chat').ready()
+        return warmup.called
+
+    def test_preload_requires_the_flag(self):
+        self.assertFalse(self.ready(['gunicorn']))
+        self.assertFalse(self.ready(['manage.py', 'migrate']))
+        self.assertTrue(self.ready(['gunicorn'], NLP_PRELOAD='True'))
+
+    def test_runserver_autoreload_parent_does_not_preload(self):
+        self.assertFalse(self.ready(['manage.py', 'runserver'], NLP_PRELOAD='True', RUN_MAIN=''))
+        self.assertTrue(self.ready(['manage.py', 'runserver'], NLP_PRELOAD='True', RUN_MAIN='true'))
+
+
+class HealthReadyTestCase(TestCase):
+    """Sonde de disponibilité."""
+
+    def test_ready_once_model_is_warm(self):
+        start_model_warmup().join()
+
+        response = self.client.get('/health/ready')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'ready')
+
+
+class EnvLoaderTestCase(SimpleTestCase):
+    """Lecture du fichier .env."""
+
+    def test_inline_comments_are_stripped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / '.env'
+            path.write_text(
+                "COCOJA_TEST_EMPTY=  # si défini, exiger un jeton\n"
+                "COCOJA_TEST_VALUE=0.7  # température\n"
+                "COCOJA_TEST_HASH=abc#123\n"
+                "COCOJA_TEST_QUOTED='a # b'\n",
+                encoding='utf-8',
+            )
+            with mock.patch.dict(os.environ):
+                load_env_file(path)
+                values = {key: os.environ[key] for key in os.environ if key.startswith('COCOJA_TEST_')}
+
+        self.assertEqual(values, {
+            'COCOJA_TEST_EMPTY': '',
+            'COCOJA_TEST_VALUE': '0.7',
+            'COCOJA_TEST_HASH': 'abc#123',
+            'COCOJA_TEST_QUOTED': 'a # b',
+        })
+
+
+class DatabaseSettingsTestCase(SimpleTestCase):
+    """Configuration de la base : DATABASE_URL et réglages SQLite."""
+
+    def test_parse_database_url(self):
+        base_dir = Path('/srv/cocoja')
+        cases = {
+            'sqlite:///db.sqlite3': ('django.db.backends.sqlite3', '/srv/cocoja/db.sqlite3'),
+            'sqlite:////var/lib/cocoja.db': ('django.db.backends.sqlite3', '/var/lib/cocoja.db'),
+            'sqlite://': ('django.db.backends.sqlite3', ':memory:'),
+        }
+        for url, (engine, name) in cases.items():
+            with self.subTest(url):
+                config = parse_database_url(url, base_dir)
+                self.assertEqual((config['ENGINE'], config['NAME']), (engine, name))
+
+        config = parse_database_url('postgres://app:s%40cret@db:5433/cocoja?sslmode=require')
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(
+            (config['NAME'], config['USER'], config['PASSWORD'], config['HOST'], config['PORT']),
+            ('cocoja', 'app', 's@cret', 'db', '5433'),
+        )
+        self.assertEqual(config['OPTIONS'], {'sslmode': 'require'})
+        with self.assertRaises(ValueError):
+            parse_database_url('oracle://db/cocoja')
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite uniquement')
+    def test_sqlite_connections_apply_pragmas_and_transaction_mode(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = DatabaseWrapper(
+                {**connection.settings_dict, 'NAME': str(Path(directory) / 'pragmas.sqlite3')}, alias='pragmas'
+            )
+            try:
+                with wrapper.cursor() as cursor:
+                    values = {}
+                    for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store'):
+                        values[pragma] = cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+            finally:
+                wrapper.close()
+
+        self.assertEqual(values, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'temp_store': 2})
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+
+
+class WeightsTestCase(SimpleTestCase):
+    """Chargement des poids par mmap."""
+
+    def test_safetensors_round_trip_is_memory_mapped(self):
+        tensors = {
+            'embedding': np.arange(12, dtype=np.float32).reshape(3, 4),
+            'bias': np.array([1, -2], dtype=np.int64),
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'model.safetensors'
+            save_safetensors(tensors, path)
+
+            loaded = load_weights(path)
+
+            for name, tensor in tensors.items():
+                np.testing.assert_array_equal(loaded[name], tensor)
+                self.assertIsInstance(loaded[name].base, np.memmap)
+                self.assertFalse(loaded[name].flags.writeable)
+            del loaded
+
+
+class CountingEngine(InferenceEngine):
+    """Moteur factice : le token suivant est le dernier + 1 ; garde les entrées reçues."""
+    name = 'counting'
+    supports_state = True
+    supports_padding = True
+
+    def __init__(self):
+        super().__init__('.')
+        self.feeds = []
+        self.batches = []
+
+    def next_token_logits(self, input_ids, state=None, attention_mask=None):
+        self.feeds.append(input_ids.shape[1])
+        self.batches.append(input_ids.shape[0])
+        logits = np.zeros((input_ids.shape[0], 100), dtype=np.float32)
+        logits[np.arange(input_ids.shape[0]), (input_ids[:, -1] + 1) % 100] = 1
+        return logits, (state or 0) + input_ids.shape[1]
+
+    def crop_state(self, state, length):
+        return length
+
+    def select_state(self, state, row, start, length):
+        return length
+
+
+class WordTokenizer:
+    """Tokenizer factice : un identifiant par mot, décodé en chiffres."""
+    eos_token_id = None
+    pad_token_id = 0
+
+    def encode(self, text, add_special_tokens=True):
+        return [token % 100 for token in word_token_ids(text)]
+
+    def decode(self, tokens, skip_special_tokens=False):
+        return ' '.join(str(token) for token in tokens)
+
+
+def counting_model():
+    model = nlp_model.NLPModel()
+    model.engine, model.tokenizer = CountingEngine(), WordTokenizer()
+    return model
+
+
+class InferenceEngineTestCase(SimpleTestCase):
+    """Boucle de génération commune aux moteurs."""
+
+    def test_stateful_engine_only_feeds_new_tokens(self):
+        engine = CountingEngine()
+
+        tokens, state = engine.generate([1, 2, 3], max_new_tokens=3)
+
+        self.assertEqual(tokens, [4, 5, 6])
+        self.assertEqual(engine.feeds, [3, 1, 1])
+        self.assertEqual(state, 5)
+
+    def test_cached_prefix_is_skipped_and_eos_stops(self):
+        engine = CountingEngine()
+
+        tokens, _ = engine.generate([1, 2, 3, 4], max_new_tokens=5, state=3, state_length=3, eos_token_id=6)
+
+        self.assertEqual(tokens, [5, 6])
+        self.assertEqual(engine.feeds, [1, 1])
+
+    def test_stateless_engine_refeeds_the_sequence(self):
+        engine = CountingEngine()
+        engine.supports_state = False
+
+        engine.generate([1, 2], max_new_tokens=3)
+
+        self.assertEqual(engine.feeds, [2, 3, 4])
+
+    def test_batch_runs_one_forward_pass_per_token(self):
+        model = counting_model()
+        questions = ['Bonjour', 'Comment vas-tu ce matin ?', 'Merci']
+
+        histories = [[{'id': i, 'role': 'user', 'content': 'Salut'}] for i in range(3)]
+
+        answers = model.generate_batch(questions, histories, max_length=4, temperature=0,
+                                       conversation_ids=[1, 2, 3])
+
+        self.assertEqual(model.engine.batches, [3, 3, 3, 3])
+        expected = counting_model()
+        self.assertEqual(answers, [
+            expected.generate_response(q, h, max_length=4, temperature=0) for q, h in zip(questions, histories)
+        ])
+        self.assertEqual(model.prefix_cache.stats()['entries'], 3)
+
+
+class ConversationPrefixCacheTestCase(TestCase):
+    """Cache de préfixe sur une conversation réelle, de la base au moteur."""
+
+    def test_prefix_cache_hits_on_most_turns(self):
+        user = User.objects.create_user('ines', 'ines@example.com', 'motdepasse123')
+        conversation = Conversation.objects.create(user=user)
+        model = counting_model()
+
+        for i in range(12):
+            question = f'Question numéro {i} sur le chien'
+            history = get_context_window(conversation, max_messages=10, query=question)
+            answer = model.generate_response(question, history, max_length=4, temperature=0,
+                                             conversation_id=conversation.pk)
+            save_exchange(conversation, question, answer)
+            conversation.refresh_from_db()
+
+        stats = model.prefix_cache.stats()
+        # Échecs : premier tour, premier historique, puis un par bloc abandonné
+        self.assertEqual((stats['hits'], stats['misses']), (7, 5))
+        self.assertGreater(stats['tokens_reused'], 0)
+
+
+class ModelServerTestCase(SimpleTestCase):
+    """Serveur de modèle sur socket Unix et son client."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.socket_path = os.path.join(directory.name, 'nlp.sock')
+        self.server = ModelServer(self.socket_path, authkey=b'secret', supervise_interval=0.05)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(self.server.shutdown)
+        deadline = time.monotonic() + 5
+        while not os.path.exists(self.socket_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def model_client(self, **kwargs):
+        return ModelClient(self.socket_path, authkey=b'secret', **kwargs)
+
+    def test_generates_and_streams(self):
+        client = self.model_client()
+        answer = "Bonjour ! Comment puis-je vous aider aujourd'hui ?"
+
+        self.assertTrue(client.ping())
+        self.assertEqual(client.generate('Bonjour'), answer)
+        self.assertEqual(''.join(client.generate_stream('Bonjour')), answer)
+
+    def test_ping_does_not_wait_for_the_pool(self):
+        client = self.model_client(pool_size=1, acquire_timeout=5)
+        client._slots.acquire()
+
+        start = time.monotonic()
+        self.assertTrue(client.ping())
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_wrong_authkey_is_refused(self):
+        client = ModelClient(self.socket_path, authkey=b'autre')
+
+        self.assertFalse(client.ping())
+        with self.assertRaises(ModelServerError):
+            client.generate('Bonjour')
+
+    def test_dead_replica_is_restarted(self):
+        self.server._replicas[0].process.kill()
+
+        deadline = time.monotonic() + 10
+        while self.server.restarts == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.server.restarts, 1)
+        self.assertTrue(self.model_client().ping())
+        self.assertIn('Bonjour', self.model_client().generate('Bonjour'))
+
+    def test_authkey_is_required(self):
+        with mock.patch.dict(os.environ, {'NLP_SERVER_AUTHKEY': ''}):
+            with self.assertRaises(ImproperlyConfigured):
+                get_authkey()
+
+
+class RateLimitTestCase(TestCase):
+    """Limitation du nombre de questions par seau à jetons."""
+
+    def setUp(self):
+        isolate_bucket_store(self)
+
+    def test_guest_is_throttled_with_retry_after(self):
+        with mock.patch.dict(os.environ, {'RATE_LIMIT_GUEST': '2', 'RATE_LIMIT_PERIOD': '3600'}):
+            statuses = [
+                self.client.post('/api/chat/ask/', {'question': 'Bonjour'}).status_code
+                for _ in range(3)
+            ]
+            response = self.client.post('/api/chat/ask/', {'question': 'Bonjour'})
+
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(response['Retry-After'], '1800')
+
+    def test_forwarded_for_header_does_not_reset_the_bucket(self):
+        with mock.patch.dict(os.environ, {'RATE_LIMIT_GUEST': '2', 'RATE_LIMIT_PERIOD': '3600'}):
+            statuses = [
+                self.client.post(
+                    '/api/chat/ask/', {'question': 'Bonjour'}, HTTP_X_FORWARDED_FOR=f'203.0.113.{i}'
+                ).status_code
+                for i in range(3)
+            ]
+
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_sqlite_buckets_refill_and_are_purged(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SQLiteBucketStore(Path(directory) / 'ratelimit.sqlite3')
+
+            results = [store.consume('user:1', 2, 0.5, now=100)[0] for _ in range(3)]
+            allowed, wait = store.consume('user:1', 2, 0.5, now=101)
+
+            self.assertEqual(results, [True, True, False])
+            self.assertFalse(allowed)
+            self.assertAlmostEqual(wait, 1.0)
+            self.assertTrue(store.consume('user:1', 2, 0.5, now=102)[0])
+            store.purge(now=106)
+            count = store._connection().execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0]
+            self.assertEqual(count, 0)
+
+
+class AdmissionTestCase(SimpleTestCase):
+    """File d'admission des générations : priorités, créneaux réservés, délais."""
+
+    def test_waiting_requests_are_served_by_priority(self):
+        controller = AdmissionController(slots=1, reserved=0)
+        running = controller.enter('free')
+        guest = controller.enter('guest')
+        pro = controller.enter('pro')
+
+        running.release()
+
+        self.assertIsNotNone(pro.granted_at)
+        self.assertIsNone(guest.granted_at)
+        self.assertEqual(controller.stats()['queued']['guest'], 1)
+
+    def test_reserved_slot_is_kept_for_authenticated_users(self):
+        controller = AdmissionController(slots=2, reserved=1)
+        controller.enter('guest')
+
+        second_guest = controller.enter('guest')
+        free = controller.enter('free')
+
+        self.assertIsNone(second_guest.granted_at)
+        self.assertIsNotNone(free.granted_at)
+
+    def test_rejects_when_estimated_wait_exceeds_deadline(self):
+        controller = AdmissionController(slots=1, reserved=0, deadlines={'guest': 5})
+        controller.service_time = 10
+        controller.enter('pro')
+
+        with self.assertRaises(AdmissionRejected) as raised:
+            controller.enter('guest')
+
+        self.assertEqual(raised.exception.queue_position, 1)
+        self.assertEqual(raised.exception.retry_after, 10)
+
+    def test_full_queue_evicts_a_guest_for_a_paying_user(self):
+        controller = AdmissionController(slots=1, queue_size=1, reserved=0)
+        controller.enter('guest')
+        queued_guest = controller.enter('guest')
+
+        controller.enter('pro')
+
+        with self.assertRaises(AdmissionRejected):
+            queued_guest.wait()
+        self.assertEqual(controller.stats()['queued']['pro'], 1)
+
+    def test_stream_service_time_excludes_client_reads(self):
+        controller = AdmissionController(slots=1, reserved=0)
+        stream = AdmittedStream(iter(['a', 'b', 'c']), controller.enter('pro'))
+
+        for _ in stream:
+            time.sleep(0.05)  # client lent
+
+        self.assertLess(controller.service_time, 0.05)
+        self.assertEqual(controller.stats()['running'], 0)
+
+    def test_slot_is_released_when_the_stream_cannot_start(self):
+        controller = AdmissionController(slots=1, reserved=0)
+        model = mock.Mock()
+        model.generate_response_stream.side_effect = RuntimeError('modèle indisponible')
+
+        with mock.patch.object(nlp_model, 'get_admission_controller', return_value=controller), \
+                mock.patch.object(nlp_model, 'get_model_client', return_value=None), \
+                mock.patch.object(nlp_model, 'get_nlp_model', return_value=model):
+            with self.assertRaises(RuntimeError):
+                nlp_model.generate_ai_response_stream('Bonjour', priority='pro')
+
+        self.assertEqual(controller.stats()['running'], 0)
+
+
+class MetricsTestCase(TestCase):
+    """Instrumentation et endpoint /metrics."""
+
+    def setUp(self):
+        isolate_bucket_store(self)
+        self.user = User.objects.create_user('dave', 'dave@example.com', 'motdepasse123')
+        self.conversation = Conversation.objects.create(user=self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in (
+            mock.patch.object(metrics, 'enabled', True),
+            mock.patch.object(metrics, 'registry', metrics.Registry()),
+            mock.patch.object(metrics, '_store', metrics.MetricsStore(Path(directory.name) / 'metrics.sqlite3')),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_stages_and_queries_are_exported(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.post('/api/chat/ask/', {'question': 'Bonjour', 'conversation_id': self.conversation.id}, format='json')
+
+        body = self.client.get('/metrics').content.decode()
+
+        for stage in ('auth', 'conversation', 'history', 'generate', 'persist', 'render'):
+            self.assertIn(f'cocoja_stage_seconds_count{{stage="{stage}"}} 1', body)
+        self.assertIn('cocoja_db_queries_per_request_count{view="ask_model"} 1', body)
+        self.assertRegex(body, r'cocoja_request_seconds_bucket\{method="POST",status="200",view="ask_model",le="\+Inf"\} 1')
+
+    def test_snapshots_of_all_processes_are_summed(self):
+        first, second = metrics.Registry(), metrics.Registry()
+        first.observe('cocoja_stage_seconds', 0.002, stage='generate')
+        second.observe('cocoja_stage_seconds', 3, stage='generate')
+        second.inc('cocoja_model_tokens_total', 40, engine='torch')
+
+        body = metrics.render_prometheus([first.snapshot(), second.snapshot()])
+
+        self.assertIn('cocoja_stage_seconds_bucket{stage="generate",le="0.005"} 1', body)
+        self.assertIn('cocoja_stage_seconds_bucket{stage="generate",le="+Inf"} 2', body)
+        self.assertIn('cocoja_stage_seconds_count{stage="generate"} 2', body)
+        self.assertIn('cocoja_model_tokens_total{engine="torch"} 40', body)
+
+    def test_snapshots_of_dead_processes_are_folded_into_retired(self):
+        finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+        finished.wait()
+        store = metrics.get_metrics_store()
+        dead = metrics.Registry()
+        dead.inc('cocoja_model_tokens_total', 40, engine='torch')
+        with store._connection() as conn:
+            for process in ('old-1', 'old-2'):
+                conn.execute(
+                    "INSERT INTO metric_snapshots VALUES (?, ?, ?, 0)",
+                    (process, finished.pid, json.dumps(dead.snapshot())),
+                )
+        metrics.inc('cocoja_model_tokens_total', 2, engine='torch')
+
+        body = metrics.export()
+
+        self.assertIn('cocoja_model_tokens_total{engine="torch"} 82', body)
+        processes = [row[0] for row in store._connection().execute("SELECT process FROM metric_snapshots")]
+        self.assertEqual(sorted(processes), sorted([metrics.RETIRED, metrics._process_id]))
+        self.assertEqual(store.prune(), 0)
+
+
+class ExportImportTestCase(TestCase):
+    """Export NDJSON en streaming et réimport par lots."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'motdepasse123')
+        self.other = User.objects.create_user('bob', 'bob@example.com', 'motdepasse123')
+        self.conversation = Conversation.objects.create(user=self.user, title='Historique')
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation, role='user' if i % 2 == 0 else 'assistant',
+                                   content=f'message {i} é')
+        Conversation.objects.create(user=self.other, title='Autre')
+
+    def test_export_streams_only_own_history_and_reimports(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/chat/conversations/export/?compression=gzip')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 1 + 1 + 5)
+
+        result = import_records(lines, user=self.other, batch_size=2)
+
+        self.assertEqual(result, {'conversations': 1, 'messages': 5})
+        imported = Conversation.objects.get(user=self.other, title='Historique')
+        self.assertEqual(imported.message_count, 5)
+        self.assertEqual(imported.last_message_preview, 'message 4 é')
+        originals = list(self.conversation.messages.values_list('role', 'content', 'created_at'))
+        self.assertEqual(list(imported.messages.values_list('role', 'content', 'created_at')), originals)
+
+    def test_import_keeps_exported_dates(self):
+        lines = [json.dumps(record) for record in (
+            {'type': 'conversation', 'id': 1, 'user': 'bob', 'title': 'Ancienne',
+             'created_at': '2020-01-02T03:04:05+00:00', 'updated_at': '2021-06-07T08:09:10+00:00'},
+            {'type': 'message', 'conversation': 1, 'role': 'user', 'content': 'x',
+             'created_at': '2021-06-07T08:09:10+00:00'},
+        )]
+
+        import_records(lines)
+
+        imported = Conversation.objects.get(title='Ancienne')
+        self.assertEqual(
+            (imported.created_at.isoformat(), imported.updated_at.isoformat()),
+            ('2020-01-02T03:04:05+00:00', '2021-06-07T08:09:10+00:00'),
+        )
+        self.assertEqual(imported.messages.get().created_at.isoformat(), '2021-06-07T08:09:10+00:00')
+        # auto_now reste actif pour le reste du processus
+        imported.save()
+        self.assertGreater(imported.updated_at.year, 2021)
+
+    def test_embeddings_are_indexed_only_on_request(self):
+        lines = list(export_chunks(self.user))[0].splitlines()
+
+        import_records(lines, user=self.other)
+        first = Conversation.objects.filter(user=self.other, title='Historique').get()
+        import_records(lines, user=self.other, index_embeddings=True)
+
+        indexed = MessageEmbedding.objects.filter(conversation__user=self.other, conversation__title='Historique')
+        self.assertEqual(indexed.count(), 5)
+        self.assertFalse(indexed.filter(conversation=first).exists())
+
+    def test_invalid_import_writes_nothing(self):
+        lines = [
+            '{"type": "conversation", "id": 1, "user": "alice", "title": "A"}',
+            '{"type": "message", "conversation": 2, "role": "user", "content": "x"}',
+        ]
+        with self.assertRaises(ValueError):
+            import_records(lines)
+        self.assertFalse(Conversation.objects.filter(title='A').exists())
+
+
+class ArchiveTestCase(TestCase):
+    """Archivage des conversations inactives et restauration à la lecture."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'motdepasse123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.idle = Conversation.objects.create(user=self.user, title='Ancienne')
+        for i in range(4):
+            Message.objects.create(conversation=self.idle, role='user' if i % 2 == 0 else 'assistant',
+                                   content=f'réponse numéro {i} ' * 20)
+        self.recent = Conversation.objects.create(user=self.user, title='Récente')
+        Message.objects.create(conversation=self.recent, role='user', content='bonjour')
+        Conversation.objects.filter(pk=self.idle.pk).update(updated_at=timezone.now() - timedelta(days=400))
+        self.originals = list(self.idle.messages.values_list('id', 'role', 'content', 'created_at'))
+
+    def test_idle_conversation_is_archived_then_restored_on_read(self):
+        stats = archive_idle_conversations(older_than_days=180)
+
+        self.assertEqual((stats['conversations'], stats['messages']), (1, 4))
+        self.assertGreater(stats['reclaimed_bytes'], 0)
+        self.assertFalse(Message.objects.filter(conversation=self.idle).exists())
+        self.assertTrue(Message.objects.filter(conversation=self.recent).exists())
+        listed = self.client.get('/api/chat/conversations/').json()
+        self.assertEqual(next(c for c in listed if c['id'] == self.idle.pk)['message_count'], 4)
+        exported = [r for r in iter_records(self.user) if r['type'] == 'message']
+        self.assertEqual(len(exported), 5)
+        # Relancer le job ne retraite rien
+        self.assertEqual(archive_idle_conversations(older_than_days=180)['conversations'], 0)
+
+        response = self.client.get(f'/api/chat/conversations/{self.idle.pk}/')
+
+        self.assertEqual([m['id'] for m in response.json()['messages']], [m[0] for m in self.originals])
+        self.assertEqual(list(self.idle.messages.values_list('id', 'role', 'content', 'created_at')), self.originals)
+        self.assertFalse(ConversationArchive.objects.exists())
+        self.assertEqual(MessageEmbedding.objects.filter(conversation=self.idle).count(), 4)
+        self.assertIsNone(Conversation.objects.get(pk=self.idle.pk).archived_at)
+
+
+class SerializationFastPathTestCase(TestCase):
+    """Le chemin rapide (.values_list + orjson) rend exactement la sortie des serializers DRF."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'motdepasse123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.conversation = Conversation.objects.create(user=self.user, title='Été \u2028 "quotes"')
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation, role='user' if i % 2 == 0 else 'assistant',
+                                   content=f'ligne {i}\n<b>é</b> \u2029')
+        Conversation.objects.create(user=self.user, title='Vide')
+
+    def assertSameBytes(self, response, data):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, JSONRenderer().render(data))
+
+    def test_list_retrieve_and_messages_match_drf_serializers(self):
+        conversation = Conversation.objects.get(pk=self.conversation.pk)
+        conversations = Conversation.objects.filter(user=self.user)
+
+        self.assertSameBytes(self.client.get('/api/chat/conversations/'),
+                             ConversationListSerializer(conversations, many=True).data)
+        self.assertSameBytes(self.client.get(f'/api/chat/conversations/{conversation.pk}/'),
+                             ConversationSerializer(conversation).data)
+        response = self.client.get(f'/api/chat/conversations/{conversation.pk}/messages/?page_size=2')
+        latest = conversation.messages.order_by('-created_at', '-id')
+        self.assertEqual(response.json()['results'], MessageSerializer(latest[:2], many=True).data)
+        older = self.client.get(response.json()['next']).json()['results']
+        self.assertEqual(older, MessageSerializer(latest[2:4], many=True).data)
+
+
+class BenchmarkHarnessTestCase(TestCase):
+    """Banc de charge : exécution à petite échelle et comparaison à la référence."""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {'RATE_LIMIT_BACKEND': 'none', 'NLP_CACHE_BACKEND': 'none'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        model = nlp_model._model_instance
+        self.addCleanup(setattr, nlp_model, '_model_instance', model)
+
+    def test_replay_reports_every_scenario_and_flags_extra_queries(self):
+        fixtures = benchmark.seed(users=2, conversations=1, messages=4, heavy_users=1, heavy_messages=60)
+        benchmark.install_stub_model(latency=0)
+        plan = benchmark.build_plan(fixtures, benchmark.DEFAULT_MIX, total=60)
+
+        summary = benchmark.summarize(benchmark.run_plan(plan))
+
+        self.assertEqual(set(summary['scenarios']), set(benchmark.DEFAULT_MIX))
+        self.assertEqual(sum(row['errors'] for row in summary['scenarios'].values()), 0)
+        self.assertEqual(benchmark.compare(summary, summary), [])
+        baseline = {'scenarios': {'conversations': {**summary['scenarios']['conversations'], 'queries': 1}}}
+        self.assertEqual(len(benchmark.compare(summary, baseline)), 1)
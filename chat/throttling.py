@@ -0,0 +1,255 @@
+"""
+Limitation du nombre de questions posées au modèle (seau à jetons).
+
+Chaque utilisateur dispose d'un seau de `RATE_LIMIT_<NIVEAU>` jetons, rempli
+en continu sur `RATE_LIMIT_PERIOD` secondes ; une question consomme un jeton.
+Niveaux : `guest` (non connecté, clé = adresse IP), `free` et `pro` (membres
+du groupe `RATE_LIMIT_PRO_GROUP`), clé = id de l'utilisateur.
+
+Les seaux sont stockés hors de la base principale (`RATE_LIMIT_BACKEND`) :
+    sqlite  fichier partagé entre workers (défaut, `RATE_LIMIT_PATH`), une
+            seule requête UPSERT atomique par vérification
+    memory  dictionnaire du processus : avec N workers, un client obtient
+            jusqu'à N fois sa limite
+    none    pas de limitation
+
+L'adresse IP des invités est celle vue par DRF (`REST_FRAMEWORK['NUM_PROXIES']`,
+réglé par `NUM_PROXIES`) : `X-Forwarded-For` n'est lu que derrière un nombre
+connu de proxys, sinon un client pourrait changer de seau à chaque requête.
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+from rest_framework.throttling import BaseThrottle
+
+from cocoja.env_loader import get_env
+
+DEFAULT_LIMITS = {'guest': 5, 'free': 50, 'pro': 500}
+
+# Nombre de vérifications entre deux purges des seaux redevenus pleins
+PURGE_INTERVAL = 1000
+
+
+def user_tier(user) -> str:
+    """
+    Niveau d'abonnement : `guest`, `free` ou `pro`.
+
+    Mémorisé sur l'objet utilisateur de la requête (une seule requête SQL
+    pour le throttle et la file d'admission).
+    """
+    if user is None or not user.is_authenticated:
+        return 'guest'
+    tier = getattr(user, '_chat_tier', None)
+    if tier is None:
+        group = get_env('RATE_LIMIT_PRO_GROUP', 'pro')
+        tier = 'pro' if user.groups.filter(name=group).exists() else 'free'
+        user._chat_tier = tier
+    return tier
+
+
+class BucketStore:
+    """
+    Stockage des seaux. Un seau absent est plein : seuls les clients actifs
+    occupent de la place, et un seau redevenu plein peut être supprimé.
+    """
+
+    def __init__(self):
+        self._calls = 0
+
+    def consume(self, key: str, capacity: float, rate: float,
+                now: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Prend un jeton dans le seau `key`.
+
+        Args:
+            key: Identifiant du client
+            capacity: Taille du seau
+            rate: Jetons ajoutés par seconde
+            now: Horodatage (time.time() par défaut)
+
+        Returns:
+            (accepté, secondes avant le prochain jeton si refusé)
+        """
+        now = time.time() if now is None else now
+        self._calls += 1
+        if self._calls % PURGE_INTERVAL == 0:
+            self.purge(now)
+        return self._consume(key, capacity, rate, now)
+
+    def _consume(self, key, capacity, rate, now):
+        raise NotImplementedError
+
+    def purge(self, now: float):
+        """Supprime les seaux redevenus pleins."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryBucketStore(BucketStore):
+    """Seaux en mémoire, propres au processus."""
+
+    def __init__(self):
+        super().__init__()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _consume(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated_at, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+                return False, (1 - tokens) / rate
+            tokens -= 1
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            return True, 0.0
+
+    def purge(self, now):
+        with self._lock:
+            for key in [key for key, bucket in self._buckets.items() if bucket[2] <= now]:
+                del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBucketStore(BucketStore):
+    """
+    Seaux partagés entre processus dans un fichier SQLite.
+
+    Lecture, remplissage et décompte se font dans un seul UPSERT : SQLite
+    sérialise les écritures, deux workers ne peuvent donc pas consommer le
+    même jeton. Le fichier n'a pas besoin de survivre à un crash (au pire,
+    les seaux repartent pleins) : `synchronous=OFF`.
+    """
+
+    CONSUME_SQL = (
+        "INSERT INTO rate_limit_buckets (key, tokens, updated_at, full_at)"
+        " VALUES (:key, :capacity - 1, :now, :now + 1 / :rate)"
+        " ON CONFLICT (key) DO UPDATE SET"
+        "  tokens = MIN(:capacity, tokens + (:now - updated_at) * :rate) - 1,"
+        "  updated_at = :now,"
+        "  full_at = :now + (:capacity + 1 - MIN(:capacity, tokens + (:now - updated_at) * :rate)) / :rate"
+        " WHERE MIN(:capacity, tokens + (:now - updated_at) * :rate) >= 1"
+        " RETURNING tokens"
+    )
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = str(path)
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+            " key TEXT PRIMARY KEY, tokens REAL NOT NULL,"
+            " updated_at REAL NOT NULL, full_at REAL NOT NULL) WITHOUT ROWID"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Mode autocommit : chaque requête est sa propre transaction
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def _consume(self, key, capacity, rate, now):
+        conn = self._connection()
+        params = {'key': key, 'capacity': float(capacity), 'rate': rate, 'now': now}
+        if conn.execute(self.CONSUME_SQL, params).fetchone() is not None:
+            return True, 0.0
+        # Refus : seau vide, on calcule seulement l'attente
+        row = conn.execute(
+            "SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?", (key,)
+        ).fetchone()
+        tokens = min(capacity, row[0] + (now - row[1]) * rate) if row else capacity
+        return False, max(0.0, (1 - tokens) / rate)
+
+    def purge(self, now):
+        self._connection().execute("DELETE FROM rate_limit_buckets WHERE full_at <= ?", (now,))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM rate_limit_buckets")
+
+
+_bucket_store: Optional[BucketStore] = None
+_bucket_store_lock = threading.Lock()
+
+
+def get_bucket_store() -> Optional[BucketStore]:
+    """
+    Retourne le stockage des seaux, ou None si la limitation est désactivée
+    (`RATE_LIMIT_BACKEND=none`).
+    """
+    global _bucket_store
+    backend = get_env('RATE_LIMIT_BACKEND', 'sqlite').lower()
+    if backend == 'none':
+        return None
+    if _bucket_store is None:
+        with _bucket_store_lock:
+            if _bucket_store is None:
+                if backend == 'memory':
+                    _bucket_store = MemoryBucketStore()
+                else:
+                    default_path = Path(__file__).resolve().parent.parent / 'ratelimit.sqlite3'
+                    _bucket_store = SQLiteBucketStore(get_env('RATE_LIMIT_PATH', str(default_path)))
+    return _bucket_store
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle DRF des endpoints de génération.
+
+    En cas de refus, DRF répond 429 avec l'en-tête `Retry-After`.
+    """
+
+    def __init__(self):
+        self._wait = None
+
+    def get_cache_key(self, request, user) -> str:
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        # L'adresse IP plutôt que la session : un invité peut jeter son cookie
+        return f'ip:{self.get_ident(request)}'
+
+    def check(self, request, user) -> Optional[float]:
+        """
+        Consomme un jeton pour `user`.
+
+        Utilisable hors DRF (vues asynchrones) : `request` peut être une
+        requête Django.
+
+        Returns:
+            None si la requête est acceptée, sinon l'attente en secondes
+        """
+        store = get_bucket_store()
+        if store is None:
+            return None
+        tier = user_tier(user)
+        capacity = get_env(f'RATE_LIMIT_{tier.upper()}', DEFAULT_LIMITS[tier], int)
+        if capacity <= 0:
+            return None
+        period = get_env('RATE_LIMIT_PERIOD', 86400, float)
+        allowed, wait = store.consume(self.get_cache_key(request, user), capacity, capacity / period)
+        return None if allowed else wait
+
+    def allow_request(self, request, view):
+        self._wait = self.check(request, request.user)
+        return self._wait is None
+
+    def wait(self):
+        return self._wait
+
+
+def retry_after(wait: float) -> str:
+    """Valeur de l'en-tête `Retry-After` (secondes entières, arrondies au-dessus)."""
+    return str(max(1, math.ceil(wait)))
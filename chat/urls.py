@@ -1,6 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ask_model, ConversationViewSet, MessageViewSet
+from .views import (
+    ask_model,
+    ask_model_async,
+    ask_model_stream,
+    model_stats,
+    search,
+    ConversationViewSet,
+    MessageViewSet,
+)
 
 router = DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversation')
@@ -8,6 +16,10 @@ router.register(r'messages', MessageViewSet, basename='message')
 
 urlpatterns = [
     path('ask/', ask_model, name='ask_model'),
+    path('ask/async/', ask_model_async, name='ask_model_async'),
+    path('ask/stream/', ask_model_stream, name='ask_model_stream'),
+    path('search/', search, name='search'),
+    path('model/stats/', model_stats, name='model_stats'),
     path('', include(router.urls)),
 ]
 
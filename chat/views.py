@@ -1,16 +1,50 @@
-from rest_framework.decorators import api_view, permission_classes
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.decorators import api_view, permission_classes, renderer_classes, throttle_classes
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from rest_framework import viewsets, status
+from rest_framework import exceptions, viewsets, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from cocoja.env_loader import get_env
+from . import metrics
 from .models import Conversation, Message
+from .pagination import MessageCursorPagination
 from .serializers import (
+    CONVERSATION_LIST_VALUES,
+    MESSAGE_VALUES,
     ConversationSerializer,
     ConversationListSerializer,
     MessageSerializer,
-    MessageCreateSerializer
+    MessageCreateSerializer,
+    conversation_detail,
+    conversation_list_dicts,
+    message_dicts,
 )
-from .nlp_model import generate_ai_response
+from .admission import AdmissionRejected
+from .model_server import ModelServerBusy
+from .nlp_model import (
+    agenerate_ai_response,
+    generate_ai_response,
+    generate_ai_response_stream,
+    get_admission_controller,
+    get_batch_scheduler,
+    get_loaded_model,
+    get_response_cache,
+    invalidate_conversation,
+    model_status,
+)
+from .archive import rehydrate
+from .export import export_chunks
+from .search import search_messages
+from .services import aget_context_window, get_context_window, persist_exchange
+from .streaming import EventStreamRenderer, NDJSONRenderer, sse_event, sse_response, stream_response
+from .throttling import TokenBucketThrottle, retry_after, user_tier
+from .weights import process_memory
 
 
 class ConversationViewSet(viewsets.ModelViewSet):
@@ -26,10 +60,37 @@ class ConversationViewSet(viewsets.ModelViewSet):
         # Les utilisateurs ne voient que leurs propres conversations
         return Conversation.objects.filter(user=self.request.user)
     
+    def get_object(self):
+        conversation = super().get_object()
+        # Conversation archivée : messages restaurés avant lecture ou ajout.
+        # Un GET peut donc écrire : jusqu'à CHAT_ARCHIVE_MAX_MESSAGES messages
+        # réinsérés dans une transaction, une seule fois par conversation
+        # (les conversations plus longues ne sont jamais archivées).
+        if self.action in ('retrieve', 'messages', 'add_message'):
+            rehydrate(conversation)
+        return conversation
+    
+    # Lectures : chemin rapide de chat.serializers (mêmes données, sans
+    # instancier de modèle ni de champ DRF par ligne)
+    def list(self, request, *args, **kwargs):
+        rows = self.filter_queryset(self.get_queryset()).values_list(*CONVERSATION_LIST_VALUES)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(conversation_list_dicts(page))
+        return Response(conversation_list_dicts(rows))
+    
+    def retrieve(self, request, *args, **kwargs):
+        return Response(conversation_detail(self.get_object()))
+    
     def perform_create(self, serializer):
         # Associer automatiquement la conversation à l'utilisateur connecté
         serializer.save(user=self.request.user)
     
+    def perform_destroy(self, instance):
+        conversation_id = instance.pk
+        instance.delete()
+        invalidate_conversation(conversation_id)
+    
     @action(detail=True, methods=['post'])
     def add_message(self, request, pk=None):
         """Ajouter un message à une conversation."""
@@ -41,29 +102,74 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], pagination_class=MessageCursorPagination)
     def messages(self, request, pk=None):
-        """Récupérer tous les messages d'une conversation."""
+        """Récupérer les messages d'une conversation, paginés du plus récent au plus ancien."""
         conversation = self.get_object()
-        messages = conversation.messages.all()
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        # Dictionnaires : la pagination lit `created_at` et `id` par clé
+        page = self.paginate_queryset(conversation.messages.values(*MESSAGE_VALUES))
+        return self.get_paginated_response(message_dicts(tuple(row.values()) for row in page))
+    
+    @action(detail=False, methods=['get'], renderer_classes=[JSONRenderer, NDJSONRenderer])
+    def export(self, request):
+        """
+        Exporter tout l'historique de l'utilisateur en NDJSON (voir chat.export).
+        
+        Streamé à mémoire constante ; `?compression=gzip` pour un fichier compressé.
+        """
+        compress = request.query_params.get('compression') == 'gzip'
+        response = stream_response(
+            request,
+            export_chunks(request.user, compress=compress),
+            'application/gzip' if compress else 'application/x-ndjson',
+        )
+        filename = 'conversations.ndjson.gz' if compress else 'conversations.ndjson'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
 
 class MessageViewSet(viewsets.ModelViewSet):
     """ViewSet pour gérer les messages."""
     permission_classes = [IsAuthenticated]
     serializer_class = MessageSerializer
+    pagination_class = MessageCursorPagination
     
     def get_queryset(self):
         # Les utilisateurs ne voient que les messages de leurs conversations
         return Message.objects.filter(conversation__user=self.request.user)
+    
+    # Un message modifié ou supprimé change l'historique : l'état de préfixe
+    # du modèle pour cette conversation n'est plus valable
+    def perform_update(self, serializer):
+        message = serializer.save()
+        invalidate_conversation(message.conversation_id)
+    
+    def perform_destroy(self, instance):
+        instance.delete()
+        invalidate_conversation(instance.conversation_id)
+
+
+def _admission_rejected(error: AdmissionRejected, response_class=Response):
+    """Réponse 503 avec la position dans la file et l'en-tête `Retry-After`."""
+    response = response_class(
+        {
+            'error': str(error),
+            'queue_position': error.queue_position,
+            'retry_after': round(error.retry_after, 1) if error.retry_after is not None else None,
+        },
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    if error.retry_after is not None:
+        response['Retry-After'] = retry_after(error.retry_after)
+    return response
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([TokenBucketThrottle])
 def ask_model(request):
     """Endpoint pour poser une question au modèle (guest ou authentifié)."""
+    metrics.observe_auth(request)
     user_input = request.data.get('question')
     conversation_id = request.data.get('conversation_id')
     
@@ -73,51 +179,276 @@ def ask_model(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Récupérer l'historique de conversation si disponible
+    # Récupérer la conversation (une seule fois) et ses derniers messages
+    conversation = None
     conversation_history = None
     if request.user.is_authenticated and conversation_id:
-        try:
-            conversation = Conversation.objects.get(id=conversation_id, user=request.user)
-            # Formatter les derniers messages pour le contexte
-            recent_messages = conversation.messages.all()[:10]  # Limiter à 10 derniers messages
-            conversation_history = [
-                {'role': msg.role, 'content': msg.content}
-                for msg in recent_messages
-            ]
-        except Conversation.DoesNotExist:
-            pass
+        with metrics.stage('conversation'):
+            conversation = Conversation.objects.filter(id=conversation_id, user=request.user).first()
+        if conversation:
+            with metrics.stage('history'):
+                rehydrate(conversation)
+                conversation_history = get_context_window(conversation, query=user_input)
     
     # Générer la réponse avec le modèle NLP
     # TODO: Cette fonction utilise actuellement un mode simulation
     # Modifiez chat/nlp_model.py pour intégrer votre modèle réel
     try:
-        response = generate_ai_response(user_input, conversation_history)
+        with metrics.stage('generate'):
+            response = generate_ai_response(
+                user_input, conversation_history, conversation_id=conversation.pk if conversation else None,
+                priority=user_tier(request.user),
+            )
+    except AdmissionRejected as e:
+        return _admission_rejected(e)
+    except ModelServerBusy as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return Response(
             {'error': f'Erreur lors de la génération de la réponse: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
     
-    # Si l'utilisateur est authentifié, sauvegarder les messages
+    # Si l'utilisateur est authentifié, sauvegarder l'échange
+    if conversation:
+        with metrics.stage('persist'):
+            persist_exchange(conversation, user_input, response)
+    
+    return Response({'answer': response})
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([TokenBucketThrottle])
+@renderer_classes([JSONRenderer, EventStreamRenderer])
+def ask_model_stream(request):
+    """
+    Variante streaming de `ask_model` (Server-Sent Events).
+    
+    Envoie un événement `token` par fragment généré, puis un événement `done`
+    contenant la réponse complète. Les messages ne sont sauvegardés qu'une fois
+    le flux terminé ; un flux abandonné par le client n'écrit rien en base.
+    """
+    metrics.observe_auth(request)
+    user_input = request.data.get('question')
+    conversation_id = request.data.get('conversation_id')
+    
+    if not user_input:
+        return Response(
+            {'error': 'Le champ question est requis.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    conversation = None
+    conversation_history = None
     if request.user.is_authenticated and conversation_id:
+        with metrics.stage('conversation'):
+            conversation = Conversation.objects.filter(id=conversation_id, user=request.user).first()
+        if conversation:
+            with metrics.stage('history'):
+                rehydrate(conversation)
+                conversation_history = get_context_window(conversation, query=user_input)
+    
+    # Attente du créneau avant d'ouvrir le flux : un refus reste une réponse 503
+    try:
+        stream = generate_ai_response_stream(
+            user_input, conversation_history, conversation_id=conversation.pk if conversation else None,
+            priority=user_tier(request.user),
+        )
+    except AdmissionRejected as e:
+        return _admission_rejected(e)
+    except ModelServerBusy as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return Response(
+            {'error': f'Erreur lors de la génération de la réponse: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    def events():
+        chunks = []
         try:
-            conversation = Conversation.objects.get(id=conversation_id, user=request.user)
-            
-            # Sauvegarder le message de l'utilisateur
-            Message.objects.create(
-                conversation=conversation,
-                role='user',
-                content=user_input
-            )
-            
-            # Sauvegarder la réponse de l'assistant
-            Message.objects.create(
-                conversation=conversation,
-                role='assistant',
-                content=response
+            # Étape `generate` : durée du flux complet, client compris
+            with metrics.stage('generate'):
+                for chunk in stream:
+                    chunks.append(chunk)
+                    yield sse_event('token', {'token': chunk})
+        except Exception as e:
+            yield sse_event('error', {'error': f'Erreur lors de la génération de la réponse: {str(e)}'})
+            return
+        finally:
+            # Libère le modèle même si le client a abandonné le flux
+            stream.close()
+        
+        response = ''.join(chunks)
+        if conversation:
+            with metrics.stage('persist'):
+                persist_exchange(conversation, user_input, response)
+        yield sse_event('done', {'answer': response})
+    
+    return sse_response(request, events())
+
+
+def _authenticate_and_parse(request):
+    """
+    Authentifie la requête et lit son corps avec les classes DRF configurées.
+    
+    Utilisé par les vues asynchrones, que DRF ne prend pas en charge : on
+    garde ainsi exactement la même authentification (session + CSRF, JWT).
+    """
+    drf_request = Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    return drf_request.user, drf_request.data
+
+
+# Même comportement que les vues DRF : la protection CSRF est appliquée par
+# SessionAuthentication (sessions uniquement), pas par le middleware
+@csrf_exempt
+async def ask_model_async(request):
+    """
+    Variante asynchrone de `ask_model` pour les serveurs ASGI.
+    
+    Les accès à la base passent par l'ORM asynchrone et la génération est
+    confiée au pool borné du modèle : une requête en attente ne bloque aucun
+    thread du serveur.
+    """
+    if request.method != 'POST':
+        return JsonResponse(
+            {'detail': f'Méthode "{request.method}" non autorisée.'},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED
+        )
+    
+    try:
+        user, data = await sync_to_async(_authenticate_and_parse)(request)
+    except exceptions.APIException as e:
+        detail = e.detail if isinstance(e.detail, (dict, list)) else {'detail': e.detail}
+        return JsonResponse(detail, status=e.status_code, safe=False)
+    
+    tier = await sync_to_async(user_tier)(user)
+    wait = await sync_to_async(TokenBucketThrottle().check)(request, user)
+    metrics.observe_auth(request)
+    if wait is not None:
+        response = JsonResponse(
+            {'detail': 'Trop de questions, réessayez plus tard.'},
+            status=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        response['Retry-After'] = retry_after(wait)
+        return response
+    
+    user_input = data.get('question')
+    conversation_id = data.get('conversation_id')
+    
+    if not user_input:
+        return JsonResponse(
+            {'error': 'Le champ question est requis.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    conversation = None
+    conversation_history = None
+    if user.is_authenticated and conversation_id:
+        with metrics.stage('conversation'):
+            conversation = await Conversation.objects.filter(id=conversation_id, user=user).afirst()
+        if conversation:
+            with metrics.stage('history'):
+                if conversation.archived_at is not None:
+                    await sync_to_async(rehydrate)(conversation)
+                conversation_history = await aget_context_window(conversation, query=user_input)
+    
+    try:
+        with metrics.stage('generate'):
+            response = await agenerate_ai_response(
+                user_input, conversation_history, conversation.pk if conversation else None,
+                priority=tier,
             )
-        except Conversation.DoesNotExist:
-            pass
+    except AdmissionRejected as e:
+        return _admission_rejected(e, JsonResponse)
+    except ModelServerBusy as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'Erreur lors de la génération de la réponse: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
     
-    return Response({'answer': response})
+    if conversation:
+        # Une transaction ne peut pas être ouverte depuis du code asynchrone
+        with metrics.stage('persist'):
+            await sync_to_async(persist_exchange)(conversation, user_input, response)
+    
+    return JsonResponse({'answer': response})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search(request):
+    """
+    Recherche plein texte dans les messages de l'utilisateur.
+
+    Paramètres : `q` (obligatoire) et `limit` (20 par défaut, 100 au maximum).
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response(
+            {'error': 'Le paramètre q est requis'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+    except ValueError:
+        return Response(
+            {'error': 'Le paramètre limit doit être un entier'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response({
+        'query': query,
+        'results': search_messages(request.user, query, limit),
+    })
+
+
+def health_ready(request):
+    """
+    Sonde de disponibilité pour le répartiteur de charge.
+
+    200 quand le modèle est chargé (ou le serveur de modèle joignable),
+    503 sinon. Vue Django simple : ni authentification ni session.
+    """
+    state = model_status()
+    return JsonResponse(state, status=200 if state['status'] == 'ready' else 503)
+
+
+def metrics_view(request):
+    """
+    Mesures de tous les processus au format texte de Prometheus.
+
+    404 si `METRICS_ENABLED` est désactivé ; si `METRICS_TOKEN` est défini,
+    l'en-tête `Authorization: Bearer <token>` est exigé.
+    """
+    if not metrics.enabled:
+        raise Http404
+    token = get_env('METRICS_TOKEN')
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def model_stats(request):
+    """Statistiques d'exécution du modèle (réservé aux administrateurs)."""
+    scheduler = get_batch_scheduler()
+    cache = get_response_cache()
+    model = get_loaded_model()
+    admission = get_admission_controller()
+    return Response({
+        'admission': admission.stats() if admission else None,
+        'batching': scheduler.stats() if scheduler else None,
+        'response_cache': cache.stats() if cache else None,
+        'prompt_cache': model.prompt_builder.stats() if model else None,
+        'prefix_cache': model.prefix_cache.stats() if model else None,
+        'memory': process_memory(),
+    })
@@ -0,0 +1,173 @@
+"""
+Chargement des poids du modèle par projection mémoire (mmap).
+
+Les tenseurs sont des vues en lecture seule sur le fichier : les pages sont
+partagées, via le cache de pages du noyau, entre tous les workers qui
+projettent le même fichier. Chargés avant le fork (`gunicorn --preload`), les
+workers héritent en plus des mêmes objets sans rien relire.
+
+Formats pris en charge, sans dépendance autre que NumPy :
+    - fichier `.safetensors` (ou dossier contenant des `.safetensors`)
+    - dossier de fichiers `.npy` (un tenseur par fichier, nommé d'après le fichier)
+"""
+
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+# Types safetensors sans équivalent NumPy (BF16, F8...) non pris en charge
+SAFETENSORS_DTYPES = {
+    'F64': np.float64,
+    'F32': np.float32,
+    'F16': np.float16,
+    'I64': np.int64,
+    'I32': np.int32,
+    'I16': np.int16,
+    'I8': np.int8,
+    'U8': np.uint8,
+    'BOOL': np.bool_,
+}
+
+
+class WeightsFormatError(ValueError):
+    """Fichier de poids illisible ou format non pris en charge."""
+
+
+def load_safetensors(path: Union[str, Path]) -> Dict[str, np.ndarray]:
+    """
+    Projette un fichier safetensors en mémoire.
+
+    Format : 8 octets (taille N de l'en-tête, little-endian), N octets d'en-tête
+    JSON {nom: {dtype, shape, data_offsets}}, puis les données.
+
+    Returns:
+        {nom: tableau en lecture seule adossé au fichier}
+    """
+    with open(path, 'rb') as f:
+        (header_size,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop('__metadata__', None)
+
+    if not header:
+        return {}
+    data = np.memmap(path, dtype=np.uint8, mode='r', offset=8 + header_size)
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES.get(info['dtype'])
+        if dtype is None:
+            raise WeightsFormatError(f"{path}: type {info['dtype']} non pris en charge ({name})")
+        begin, end = info['data_offsets']
+        tensors[name] = data[begin:end].view(np.dtype(dtype).newbyteorder('<')).reshape(info['shape'])
+    return tensors
+
+
+def save_safetensors(tensors: Dict[str, np.ndarray], path: Union[str, Path]):
+    """Écrit des tableaux NumPy au format safetensors (conversion, tests)."""
+    codes = {np.dtype(dtype): code for code, dtype in SAFETENSORS_DTYPES.items()}
+    header = {}
+    offset = 0
+    arrays = []
+    for name, array in tensors.items():
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        code = codes.get(array.dtype.newbyteorder('='))
+        if code is None:
+            raise WeightsFormatError(f"Type {array.dtype} non pris en charge ({name})")
+        header[name] = {
+            'dtype': code,
+            'shape': list(array.shape),
+            'data_offsets': [offset, offset + array.nbytes],
+        }
+        offset += array.nbytes
+        arrays.append(array)
+
+    encoded = json.dumps(header, separators=(',', ':')).encode()
+    # En-tête aligné sur 8 octets pour que les tenseurs le soient aussi
+    encoded += b' ' * (-len(encoded) % 8)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for array in arrays:
+            f.write(array.tobytes())
+
+
+def load_npy_dir(path: Union[str, Path]) -> Dict[str, np.ndarray]:
+    """Projette en mémoire tous les `.npy` d'un dossier."""
+    return {
+        file.stem: np.load(file, mmap_mode='r', allow_pickle=False)
+        for file in sorted(Path(path).glob('*.npy'))
+    }
+
+
+def load_weights(path: Union[str, Path]) -> Dict[str, np.ndarray]:
+    """
+    Charge des poids par mmap depuis un fichier ou un dossier.
+
+    Raises:
+        WeightsFormatError: Aucun fichier de poids reconnu
+    """
+    path = Path(path)
+    if path.is_file() and path.suffix == '.safetensors':
+        return load_safetensors(path)
+    if path.is_dir():
+        tensors = {}
+        for file in sorted(path.glob('*.safetensors')):
+            tensors.update(load_safetensors(file))
+        tensors.update(load_npy_dir(path))
+        if tensors:
+            return tensors
+    raise WeightsFormatError(f"Aucun poids .safetensors ou .npy trouvé dans {path}")
+
+
+def weights_nbytes(tensors: Dict[str, np.ndarray]) -> int:
+    return sum(tensor.nbytes for tensor in tensors.values())
+
+
+def process_memory(pid: Union[int, str] = 'self') -> Optional[dict]:
+    """
+    Mémoire d'un processus, lue dans /proc (Linux).
+
+    `pss` répartit chaque page partagée entre les processus qui la projettent :
+    la somme des PSS des workers est leur coût réel. Des poids bien partagés
+    apparaissent en `shared`, pas en `private`.
+
+    Returns:
+        {pid, rss, pss, shared, private} en octets, ou None hors Linux
+    """
+    base = Path('/proc') / str(pid)
+    fields = {}
+    try:
+        with open(base / 'smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        'pid': os.getpid() if pid == 'self' else int(pid),
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def child_pids(parent_pid: int) -> List[int]:
+    """Processus enfants directs de `parent_pid` (les workers d'un maître gunicorn)."""
+    children = []
+    for entry in Path('/proc').iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / 'stat').read_text()
+        except OSError:
+            continue
+        # Le nom du programme (2e champ) peut contenir des espaces : on part de la fin
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        if ppid == parent_pid:
+            children.append(int(entry.name))
+    return sorted(children)
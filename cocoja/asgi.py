@@ -3,8 +3,12 @@ ASGI config for cocoja project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn cocoja.asgi:application``) so that
+the streaming endpoint ``/api/chat/ask/stream/`` sends tokens as they are
+generated instead of buffering the whole answer.
+
 For more information on this file, see
-https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
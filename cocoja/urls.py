@@ -2,7 +2,7 @@
 URL configuration for cocoja project.
 
 The `urlpatterns` list routes URLs to views. For more information please see:
-    https://docs.djangoproject.com/en/4.2/topics/http/urls/
+    https://docs.djangoproject.com/en/5.2/topics/http/urls/
 Examples:
 Function views
     1. Add an import:  from my_app import views
@@ -15,10 +15,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from chat.views import health_ready, metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    re_path(r'^health/ready/?$', health_ready, name='health_ready'),
+    re_path(r'^metrics/?$', metrics_view, name='metrics'),
     path('api/chat/', include('chat.urls')),
     path('api/auth/', include('users.urls')),
 
@@ -18,7 +18,7 @@ trap 'echo -e "\n${YELLOW}Stopping all servers...${NC}"; kill 0' SIGINT SIGTERM
 run_django() {
     echo -e "${GREEN}[Django]${NC} Starting on http://127.0.0.1:8000"
     cd "$(dirname "$0")"
-    python3 manage.py runserver
+    NLP_PRELOAD=True python3 manage.py runserver
 }
 
 # Function to run Vite dev server
@@ -104,9 +104,30 @@ export async function addMessageToConversation(
   return response.data
 }
 
-export async function fetchConversationMessages(conversationId: number): Promise<ApiMessage[]> {
-  const response = await api.get(`/chat/conversations/${conversationId}/messages/`)
-  return response.data
+export interface ApiCursorPage<T> {
+  next: string | null
+  previous: string | null
+  results: T[]
+}
+
+function cursorFromUrl(url: string | null): string | null {
+  if (!url) return null
+  return new URL(url, window.location.origin).searchParams.get('cursor')
+}
+
+export async function fetchConversationMessages(
+  conversationId: number,
+  cursor?: string | null,
+): Promise<{ messages: ApiMessage[]; olderCursor: string | null }> {
+  const response = await api.get<ApiCursorPage<ApiMessage>>(
+    `/chat/conversations/${conversationId}/messages/`,
+    { params: cursor ? { cursor } : undefined },
+  )
+  return {
+    // L'API renvoie les plus récents en premier : on remet l'ordre chronologique
+    messages: [...response.data.results].reverse(),
+    olderCursor: cursorFromUrl(response.data.next),
+  }
 }
 
 export async function getCsrfToken(): Promise<void> {
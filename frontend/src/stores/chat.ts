@@ -4,7 +4,7 @@ import { ref, computed } from 'vue'
 import type { Conversation, Message } from '@/types/chat'
 import {
   fetchConversations,
-  fetchConversation,
+  fetchConversationMessages,
   createConversation,
   deleteConversation as apiDeleteConversation,
   updateConversation,
@@ -121,16 +121,29 @@ export const useChatStore = defineStore('chat', () => {
 
   async function loadConversationMessages(conversationId: number) {
     try {
-      const apiConv = await fetchConversation(conversationId)
+      const page = await fetchConversationMessages(conversationId)
       const conv = conversations.value.find((c) => c.id === conversationId)
-      if (conv && apiConv.messages) {
-        conv.messages = apiConv.messages.map(apiMessageToMessage)
+      if (conv) {
+        conv.messages = page.messages.map(apiMessageToMessage)
+        conv.olderCursor = page.olderCursor
       }
     } catch (error) {
       console.error('Erreur lors du chargement des messages:', error)
     }
   }
 
+  async function loadOlderMessages(conversationId: number) {
+    const conv = conversations.value.find((c) => c.id === conversationId)
+    if (!conv || !conv.olderCursor) return
+    try {
+      const page = await fetchConversationMessages(conversationId, conv.olderCursor)
+      conv.messages = [...page.messages.map(apiMessageToMessage), ...conv.messages]
+      conv.olderCursor = page.olderCursor
+    } catch (error) {
+      console.error('Erreur lors du chargement des messages précédents:', error)
+    }
+  }
+
   async function createNewChat() {
     try {
       const apiConv = await createConversation()
@@ -360,5 +373,6 @@ export const useChatStore = defineStore('chat', () => {
     initForUser,
     resetForGuest,
     loadConversationMessages,
+    loadOlderMessages,
   }
 })
@@ -12,6 +12,7 @@ export interface Conversation {
   createdAt: string
   updatedAt: string
   messageCount?: number
+  olderCursor?: string | null
   lastMessage?: {
     role: string
     content: string